@@ -0,0 +1,346 @@
+# async_search.py
+"""
+async_search.py
+run FlightSearch lookups for many destinations concurrently with asyncio
+"""
+import logging
+import statistics
+import time
+from config import Config
+from price_calendar import PriceCalendar, calendar_date_pairs, calendar_dates
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSearchEngine:
+    """fan out IATA lookups and flight searches with a concurrency limit"""
+
+    def __init__(self, flight_search, concurrency=None, journal=None):
+        """
+        initialize async search engine
+
+        parameters:
+            flight_search: FlightSearch instance used for every lookup
+            concurrency: max number of lookups in flight at the same time
+            journal: RunJournal recording every answer, answers it holds are not searched again
+        """
+        self.flight_search = flight_search
+        self.concurrency = max(1, concurrency or Config.SEARCH_CONCURRENCY)
+        self.journal = journal
+
+        # (route label, seconds spent on the lookup)
+        self.latencies = []
+        # (origin, destination code) -> PriceCalendar of the last calendar search
+        self.calendars = {}
+        # (origin, destination code) -> FlightData, None or exception of the last search
+        self.route_outcomes = {}
+        # (route and dates label, exception) for the failed date pairs of routes that were
+        # still answered by another pair, in the last sweep
+        self.pair_errors = []
+
+    async def _timed_call(self, semaphore, label, func, *args):
+        """
+        run a blocking call in a worker thread, recording its latency
+
+        a failed call does not stop the others, the HTTP client's circuit
+        breaker makes them fail fast when the API is really down
+        """
+        import asyncio
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            try:
+                return await loop.run_in_executor(None, func, *args)
+            finally:
+                self.latencies.append((label, time.perf_counter() - start))
+
+    async def _fill_iata_codes(self, destinations, data_manager):
+        """look up IATA codes for every destination without one"""
+        import asyncio
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = [dest for dest in destinations if not dest.get("iataCode")]
+        
+        # most cities are in the offline dataset, only the rest need the API
+        local_codes = self.flight_search.city_index.resolve_many(dest["city"] for dest in pending)
+        unresolved = []
+        for dest in pending:
+            iata = local_codes.get(dest["city"])
+            if iata:
+                data_manager.update_destination_code(dest["id"], iata)
+                dest["iataCode"] = iata
+                logger.debug(f"{dest['city']} → {iata}")
+            else:
+                unresolved.append(dest)
+        pending = unresolved
+
+        async def fill(dest):
+            iata = await self._timed_call(
+                semaphore, f"IATA {dest['city']}",
+                self.flight_search.get_destination_code, dest["city"]
+            )
+            if iata:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, data_manager.update_destination_code, dest["id"], iata)
+                dest["iataCode"] = iata
+            return iata
+
+        results = await asyncio.gather(*(fill(dest) for dest in pending), return_exceptions=True)
+
+        errors = []
+        for dest, result in zip(pending, results):
+            if isinstance(result, Exception):
+                errors.append((dest["city"], result))
+            elif result:
+                logger.debug(f"{dest['city']} → {result}")
+        return errors
+
+    @staticmethod
+    def _empty_results():
+        """result buckets reported for one origin"""
+        return {
+            "found_deals": [],
+            "price_not_met": [],
+            "no_flights_found": [],
+            "skipped_destinations": [],
+            "errors": [],
+        }
+
+    def plan_lookups(self, origins, destinations, from_time, to_time):
+        """
+        list the searches a sweep is made of
+
+        rows sharing a destination code, and origins sharing a route, are searched once
+
+        return: (list of (origin, destination code), list of (departure_date, return_date));
+                every route is searched for every date pair
+        """
+        routes = list(dict.fromkeys(
+            (origin, dest["iataCode"])
+            for origin in origins
+            for dest in destinations
+            if dest.get("iataCode") and dest["iataCode"] != origin
+        ))
+
+        if Config.PRICE_CALENDAR:
+            pairs = calendar_date_pairs(
+                from_time, to_time, Config.CALENDAR_MIN_TRIP_DAYS, Config.CALENDAR_MAX_TRIP_DAYS
+            )
+        else:
+            pairs = [(from_time, to_time)]
+        return routes, pairs
+
+    def _search_matrix(self, origins, destinations, from_time, to_time, max_age_hours=None):
+        """search every origin × destination route, each distinct route once"""
+        routes, pairs = self.plan_lookups(origins, destinations, from_time, to_time)
+
+        # everything cached is answered with one batched query, without starting an event loop
+        answers, missing = self.flight_search.cached_results(routes, pairs, max_age_hours)
+        if self.journal is not None and self.journal.lookups:
+            # answered before an interrupted run of the same sweep stopped
+            journaled = self.journal.lookups
+            answers.update((key, journaled[key]) for key in missing if key in journaled)
+            missing = [key for key in missing if key not in journaled]
+        if missing:
+            for key, answer in self._run(self._fetch_missing(missing)).items():
+                answers[key] = answer if isinstance(answer, Exception) else answer[key[1]]
+
+        return self.collect_results(origins, destinations, from_time, to_time, answers)
+
+    def collect_results(self, origins, destinations, from_time, to_time, answers):
+        """
+        sort the answers of a sweep into the result buckets of every origin
+
+        parameters:
+            answers: dict of ((origin, destination code), (departure_date, return_date))
+                     -> FlightData, None or the exception of a failed search
+        return: dict of origin -> result dict as returned by search_destinations
+        """
+        results = {origin: self._empty_results() for origin in origins}
+        self.pair_errors = []
+
+        searchable = []
+        for dest in destinations:
+            if dest.get("iataCode"):
+                searchable.append(dest)
+            else:
+                for origin in origins:
+                    results[origin]["skipped_destinations"].append(dest["city"])
+
+        routes, _ = self.plan_lookups(origins, searchable, from_time, to_time)
+        by_route = self._route_outcomes(routes, from_time, to_time, answers)
+        self.route_outcomes.update(by_route)
+
+        # classify in sheet order so the report reads the same as before
+        for origin in origins:
+            if len(origins) > 1:
+                logger.info(f"\n  From {origin}:")
+            for dest in searchable:
+                route = (origin, dest["iataCode"])
+                if route in by_route:
+                    self._classify(results[origin], dest, by_route[route])
+
+        return results
+
+    @staticmethod
+    def _classify(results, dest, flight):
+        """put one destination's search outcome into its result bucket"""
+        currency_symbol = Config.get_currency_symbol()
+        if isinstance(flight, Exception):
+            results["errors"].append((dest["city"], flight))
+            return
+
+        if flight is None:
+            logger.info(f"  {dest['city']}: No direct flight was found")
+            results["no_flights_found"].append(dest["city"])
+        elif flight.price < dest["lowestPrice"]:
+            logger.info(f"  {dest['city']}: {currency_symbol}{flight.price} "
+                        f"Lowest price found! (Target: {currency_symbol}{dest['lowestPrice']})")
+            results["found_deals"].append({
+                "destination": dest["city"],
+                "flight": flight,
+                "target_price": dest["lowestPrice"]
+            })
+        else:
+            logger.info(f"  {dest['city']}: {currency_symbol}{flight.price} "
+                        f"No flight under (Target: {currency_symbol}{dest['lowestPrice']})")
+            results["price_not_met"].append({
+                "city": dest["city"],
+                "current_price": flight.price,
+                "target_price": dest["lowestPrice"]
+            })
+
+    async def _fetch_missing(self, missing):
+        """
+        search the (route, date pair) lookups the cache could not answer
+
+        parameters:
+            missing: list of ((origin, destination code), (departure_date, return_date))
+        return: dict of (route, pair) -> dict of pair -> FlightData or None, or an exception
+        """
+        import asyncio
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        def label(route, pair):
+            if Config.PRICE_CALENDAR:
+                return f"{route[0]} → {route[1]} {pair[0]}/{pair[1]}"
+            return f"{route[0]} → {route[1]}"
+
+        answers = await asyncio.gather(
+            *(
+                self._timed_call(semaphore, label(route, pair), self._fetch_lookup, route, pair)
+                for route, pair in missing
+            ),
+            return_exceptions=True
+        )
+        return dict(zip(missing, answers))
+
+    def _fetch_lookup(self, route, pair):
+        """search one route and date pair, recording the answer in the run journal"""
+        answer = self.flight_search.fetch_window(route[0], route[1], [pair])
+        if self.journal is not None:
+            for answered_pair, flight in answer.items():
+                self.journal.record_lookup(route, answered_pair, flight)
+        return answer
+
+    def _route_outcomes(self, routes, from_time, to_time, answers):
+        """
+        combine the answers of every date pair into one outcome per route
+
+        a route is only reported as failed when none of its date pairs was answered,
+        the failed pairs of the other routes are kept in pair_errors
+
+        return: dict of route -> cheapest FlightData, None, or an exception
+        """
+        flights_by_route = {route: {} for route in routes}
+        failed_by_route = {}
+        for (route, pair), answer in answers.items():
+            if route not in flights_by_route:
+                continue
+            if isinstance(answer, Exception):
+                failed_by_route.setdefault(route, []).append((pair, answer))
+            else:
+                flights_by_route[route][pair] = answer
+
+        outcome = {}
+        for route, failed in failed_by_route.items():
+            if not flights_by_route[route]:
+                outcome[route] = failed[0][1]
+                continue
+            for pair, error in failed:
+                self.pair_errors.append((f"{route[0]} → {route[1]} {pair[0]}/{pair[1]}", error))
+
+        dates = calendar_dates(from_time, to_time) if Config.PRICE_CALENDAR else None
+        for route in routes:
+            flights = flights_by_route[route]
+            if dates is not None:
+                calendar = PriceCalendar(route[0], route[1], dates, flights)
+                self.calendars[route] = calendar
+                if route not in outcome:
+                    cheapest = calendar.cheapest()
+                    outcome[route] = cheapest[2] if cheapest else None
+            elif route not in outcome:
+                outcome[route] = next(iter(flights.values()), None)
+        return outcome
+
+    def fill_iata_codes(self, destinations, data_manager):
+        """
+        fill in missing IATA codes concurrently
+
+        return: list of (city, exception) for failed lookups
+        """
+        # nothing to look up, do not start an event loop
+        if all(dest.get("iataCode") for dest in destinations):
+            return []
+        return self._run(self._fill_iata_codes(destinations, data_manager))
+
+    def search_destinations(self, origin, destinations, from_time, to_time):
+        """
+        search all destinations concurrently
+
+        return: dict with found_deals, price_not_met, no_flights_found,
+                skipped_destinations and errors lists
+        """
+        return self._search_matrix([origin], destinations, from_time, to_time)[origin]
+
+    def search_route_matrix(self, origins, destinations, from_time, to_time, max_age_hours=None):
+        """
+        search all destinations from several origins with one shared cache and token
+
+        parameters:
+            max_age_hours: oldest cached answer accepted (default CACHE_EXPIRY_HOURS)
+        return: dict of origin -> result dict as returned by search_destinations
+        """
+        origins = list(dict.fromkeys(origins))
+        return self._search_matrix(origins, destinations, from_time, to_time, max_age_hours)
+
+    def _run(self, coroutine):
+        """run a coroutine with a thread pool sized to the concurrency limit"""
+        # asyncio is only loaded when something has to be fetched
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        async def runner():
+            loop = asyncio.get_running_loop()
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                loop.set_default_executor(executor)
+                return await coroutine
+
+        return asyncio.run(runner())
+
+    def latency_report(self, slowest=5):
+        """return a short text report of per-route latency"""
+        if not self.latencies:
+            return "  No lookups were made"
+
+        values = sorted(seconds for _, seconds in self.latencies)
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        lines = [
+            f"  Concurrency: {self.concurrency}",
+            f"  Lookups: {len(values)}",
+            f"  Mean: {statistics.mean(values):.3f}s  Median: {statistics.median(values):.3f}s  "
+            f"P95: {p95:.3f}s  Max: {values[-1]:.3f}s",
+        ]
+        ranked = sorted(self.latencies, key=lambda item: item[1], reverse=True)
+        for label, seconds in ranked[:slowest]:
+            lines.append(f"    {label}: {seconds:.3f}s")
+        return "\n".join(lines)
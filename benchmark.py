@@ -0,0 +1,360 @@
+# benchmark.py
+"""
+benchmark.py
+run the monitoring pipeline end to end against local Amadeus, Sheety and SMTP stand-ins
+
+usage: python benchmark.py --sizes 10,100,1000 --latency-ms 20 --error-rate 0.01
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from config import Config
+from fake_services import FakeAmadeus, FakeSheety, FakeSmtp, make_sheet
+
+DEFAULT_SIZES = [10, 100, 1000]
+DEFAULT_RESULTS_FILE = "benchmark_results.jsonl"
+
+
+def code_version():
+    """short git commit of the code being measured, with a marker for local changes"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True
+        ).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class StageRecorder:
+    """
+    measure wall time, upstream calls and cache hits of each pipeline stage, or
+    only its peak memory: tracing allocations slows the stage down, so a run that
+    measures memory is not timed
+    """
+
+    def __init__(self, amadeus, sheety, smtp, verbose=False, trace_memory=False):
+        self.amadeus = amadeus
+        self.sheety = sheety
+        self.smtp = smtp
+        self.verbose = verbose
+        self.trace_memory = trace_memory
+        self.cache_manager = None
+        self.stages = {}
+
+    def _cache_counts(self):
+        if self.cache_manager is None:
+            return 0, 0, 0
+        return self.cache_manager.hits, self.cache_manager.misses, self.cache_manager.expired
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """record one stage, the pipeline output is hidden unless verbose"""
+        amadeus_before = self.amadeus.total()
+        sheety_before = self.sheety.total()
+        emails_before = self.smtp.messages
+        hits_before, misses_before, expired_before = self._cache_counts()
+
+        output = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        if self.trace_memory:
+            tracemalloc.start()
+            try:
+                with output:
+                    yield
+            finally:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.stages[name] = {"peak_memory_kb": round(peak / 1024, 1)}
+            return
+
+        start = time.perf_counter()
+        try:
+            with output:
+                yield
+        finally:
+            wall = time.perf_counter() - start
+
+            hits, misses, expired = self._cache_counts()
+            hits, misses, expired = hits - hits_before, misses - misses_before, expired - expired_before
+            lookups = hits + misses + expired
+            self.stages[name] = {
+                "wall_seconds": round(wall, 4),
+                "amadeus_calls": self.amadeus.total() - amadeus_before,
+                "sheety_calls": self.sheety.total() - sheety_before,
+                "emails": self.smtp.messages - emails_before,
+                "cache_hits": hits,
+                "cache_misses": misses,
+                "cache_expired": expired,
+                "cache_hit_ratio": round(hits / lookups, 4) if lookups else None,
+            }
+
+
+@contextlib.contextmanager
+def _benchmark_config(amadeus, sheety, smtp, calendar, concurrency):
+    """point Config at the stand-ins, restoring every setting afterwards"""
+    overrides = {
+        # pace requests only when the stand-in enforces a quota
+        "AMADEUS_REQUESTS_PER_SECOND": amadeus.rate_limit,
+        "SHEETY_REQUESTS_PER_SECOND": 0,
+        "AMADEUS_BASE_URL": amadeus.url,
+        "AMADEUS_API_KEY": "benchmark",
+        "AMADEUS_API_SECRET": "benchmark",
+        "SHEETY_PRICES_ENDPOINT": f"{sheety.url}/prices",
+        "SHEETY_USERS_ENDPOINT": f"{sheety.url}/users",
+        "SHEETY_WRITES_PER_MINUTE": 0,
+        "EMAIL_USER": "benchmark@example.com",
+        "EMAIL_PASS": "benchmark",
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": smtp.server_address[1],
+        "SMTP_STARTTLS": False,
+        "ORIGIN_CITY_IATAS": ["SYD"],
+        "PRICE_CALENDAR": calendar,
+        "SEARCH_CONCURRENCY": concurrency,
+        "NOTIFICATION_MODE": "digest",
+    }
+    saved = {name: getattr(Config, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(Config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(Config, name, value)
+
+
+def run_scenario(size, latency_ms=20, error_rate=0.0, calendar=False, concurrency=None, verbose=False,
+                 rate_limit=0):
+    """
+    run every stage of the pipeline against fresh stand-ins and an empty cache,
+    once timed and once more to measure peak memory
+
+    parameters:
+        rate_limit: Amadeus requests per second before the stand-in answers 429 (0 = no quota)
+
+    return: dict with the scenario settings and per-stage measurements
+    """
+    concurrency = concurrency or Config.SEARCH_CONCURRENCY
+    timed = _run_pipeline(size, latency_ms, error_rate, calendar, concurrency, verbose, rate_limit)
+    traced = _run_pipeline(size, latency_ms, error_rate, calendar, concurrency, False, rate_limit,
+                           trace_memory=True)
+    for name, stage in timed["stages"].items():
+        stage["peak_memory_kb"] = traced["stages"][name]["peak_memory_kb"]
+
+    scenario = {
+        "size": size,
+        "latency_ms": latency_ms,
+        "error_rate": error_rate,
+        "calendar": calendar,
+        "concurrency": concurrency,
+    }
+    # only set when used, so earlier runs stay comparable
+    if rate_limit:
+        scenario["rate_limit"] = rate_limit
+    total_wall = round(sum(stage["wall_seconds"] for stage in timed["stages"].values()), 4)
+    return dict(timed, scenario=scenario, total_wall_seconds=total_wall)
+
+
+def _run_pipeline(size, latency_ms, error_rate, calendar, concurrency, verbose, rate_limit, trace_memory=False):
+    """
+    run every stage of the pipeline once against fresh stand-ins and an empty cache
+
+    return: dict with the per-stage measurements and the outcome of the sweep
+    """
+    # imported here so Config is patched before anything reads it
+    from data_manager import DataManager
+    from flight_search import FlightSearch
+    from async_search import AsyncSearchEngine
+    from notification_manager import NotificationManager, NotificationDispatcher
+    from reports import send_notifications
+
+    latency = latency_ms / 1000
+    amadeus = FakeAmadeus(latency=latency, error_rate=error_rate, rate_limit=rate_limit).start()
+    sheety = FakeSheety(make_sheet(size), [{"id": 2, "email": "user@example.com"}], latency=latency).start()
+    smtp = FakeSmtp().start()
+    recorder = StageRecorder(amadeus, sheety, smtp, verbose=verbose, trace_memory=trace_memory)
+    previous_directory = os.getcwd()
+
+    try:
+        with tempfile.TemporaryDirectory() as work_directory, \
+                _benchmark_config(amadeus, sheety, smtp, calendar, concurrency):
+            # every cache path is relative, so the run starts from an empty cache
+            os.chdir(work_directory)
+            try:
+                Config.setup_cache_dirs()
+
+                with recorder.stage("init"):
+                    data_manager = DataManager()
+                    flight_search = FlightSearch()
+                    notifier = NotificationDispatcher(NotificationManager())
+                    search_engine = AsyncSearchEngine(flight_search, concurrency)
+                recorder.cache_manager = flight_search.cache_manager
+
+                with recorder.stage("sheet"):
+                    destinations = data_manager.get_destination_data()
+                    users = data_manager.get_user_emails()
+
+                with recorder.stage("iata"):
+                    iata_errors = search_engine.fill_iata_codes(destinations, data_manager)
+                    flight_search.cache_manager.flush()
+                    data_manager.flush_updates()
+
+                search_start = datetime.now() + timedelta(days=1)
+                search_end = datetime.now() + timedelta(days=10)
+                with recorder.stage("search_cold"):
+                    cold = search_engine.search_route_matrix(["SYD"], destinations, search_start, search_end)
+                    flight_search.price_history.flush()
+
+                # the same sweep again is answered from the cache
+                with recorder.stage("search_warm"):
+                    search_engine.search_route_matrix(["SYD"], destinations, search_start, search_end)
+
+                with recorder.stage("notify"):
+                    send_notifications(notifier, users, "SYD", cold["SYD"])
+                    notifier.drain()
+
+                flight_search.price_history.flush()
+            finally:
+                os.chdir(previous_directory)
+    finally:
+        amadeus.stop()
+        sheety.stop()
+        smtp.stop()
+
+    return {
+        "stages": recorder.stages,
+        "found_deals": len(cold["SYD"]["found_deals"]),
+        "errors": len(cold["SYD"]["errors"]) + len(iata_errors),
+        "throttled": amadeus.throttled,
+    }
+
+
+def load_results(results_file):
+    """every stored benchmark run, oldest first"""
+    if not os.path.exists(results_file):
+        return []
+    with open(results_file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def find_baseline(history, result):
+    """latest stored run of the same scenario from another code version"""
+    for previous in reversed(history):
+        if previous["scenario"] == result["scenario"] and previous["version"] != result["version"]:
+            return previous
+    return None
+
+
+def compare(result, baseline, threshold):
+    """
+    list the stages that got slower or bigger than the baseline by more than threshold
+
+    return: list of text lines, empty when nothing regressed
+    """
+    regressions = []
+    for name, stage in result["stages"].items():
+        old = baseline["stages"].get(name)
+        if not old:
+            continue
+        for metric in ("wall_seconds", "peak_memory_kb", "amadeus_calls"):
+            before, after = old[metric], stage[metric]
+            # ignore noise on stages that take almost nothing
+            if metric == "wall_seconds" and after < 0.05:
+                continue
+            if before and (after - before) / before > threshold:
+                regressions.append(
+                    f"    {name}.{metric}: {before} -> {after} (+{(after - before) / before:.0%})"
+                )
+    return regressions
+
+
+def format_result(result):
+    """table of one run, one line per stage"""
+    scenario = result["scenario"]
+    lines = [
+        f"\n  {scenario['size']} destination/s, {scenario['latency_ms']} ms latency, "
+        f"{scenario['error_rate']:.1%} errors, calendar {'on' if scenario['calendar'] else 'off'}, "
+        f"concurrency {scenario['concurrency']}"
+        + (f", {scenario['rate_limit']} request/s quota" if scenario.get("rate_limit") else ""),
+        f"    {'stage':<12} {'wall s':>9} {'amadeus':>8} {'sheety':>7} {'emails':>6} "
+        f"{'hit ratio':>9} {'peak KB':>10}",
+    ]
+    for name, stage in result["stages"].items():
+        ratio = "-" if stage["cache_hit_ratio"] is None else f"{stage['cache_hit_ratio']:.0%}"
+        lines.append(
+            f"    {name:<12} {stage['wall_seconds']:>9.3f} {stage['amadeus_calls']:>8} "
+            f"{stage['sheety_calls']:>7} {stage['emails']:>6} {ratio:>9} {stage['peak_memory_kb']:>10.1f}"
+        )
+    lines.append(f"    total {result['total_wall_seconds']:.3f}s, "
+                 f"{result['found_deals']} deal/s, {result['errors']} error/s, "
+                 f"{result.get('throttled', 0)} throttled")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    """run the benchmark scenarios, store and compare the results"""
+    parser = argparse.ArgumentParser(description="End-to-end benchmark against local stand-in services")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma-separated sheet sizes, e.g. 10,100,1000,10000")
+    parser.add_argument("--latency-ms", type=float, default=20, help="added latency per API request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of API requests that fail with 500")
+    parser.add_argument("--calendar", action="store_true", help="search every date pair of the window")
+    parser.add_argument("--rate-limit", type=float, default=0,
+                        help="Amadeus requests per second before the stand-in answers 429 (default no quota)")
+    parser.add_argument("--concurrency", type=int, default=None, help="concurrent lookups (default SEARCH_CONCURRENCY)")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_FILE, help="file the runs are appended to")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change reported as a regression")
+    parser.add_argument("--no-save", action="store_true", help="do not store this run")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline output")
+    args = parser.parse_args(argv)
+    if args.verbose:
+        Config.setup_logging()
+
+    results_file = os.path.abspath(args.results)
+    history = load_results(results_file)
+    version = code_version()
+    regressed = False
+
+    print(f"Benchmark of version {version} (Python {platform.python_version()})")
+    for size in (int(size) for size in args.sizes.split(",") if size.strip()):
+        result = run_scenario(size, args.latency_ms, args.error_rate, args.calendar,
+                              args.concurrency, args.verbose, args.rate_limit)
+        result.update({
+            "version": version,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+        })
+        print(format_result(result))
+
+        baseline = find_baseline(history, result)
+        if baseline:
+            regressions = compare(result, baseline, args.threshold)
+            if regressions:
+                regressed = True
+                print(f"  Regressions against {baseline['version']}:")
+                print("\n".join(regressions))
+            else:
+                print(f"  No regression against {baseline['version']}")
+
+        if not args.no_save:
+            with open(results_file, 'a') as f:
+                f.write(json.dumps(result) + "\n")
+            history.append(result)
+
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
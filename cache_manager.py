@@ -2,88 +2,516 @@
 """
 cache_manager to handle caching of flight data and IATA codes
 """
+import atexit
 import json
+import logging
 import os
-from datetime import datetime, timedelta
+import sqlite3
+import threading
+from collections import namedtuple
+from datetime import date, datetime, timedelta
 from config import Config
+from flight_data import FlightData
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FlightQuery(namedtuple(
+    "FlightQuery",
+    ["origin", "destination", "departure_date", "return_date", "non_stop", "currency", "adults"]
+)):
+    """full set of search parameters a cached result answers"""
+    
+    __slots__ = ()
+    
+    @classmethod
+    def create(cls, origin, destination, departure_date, return_date,
+               non_stop=True, currency=None, adults=1):
+        """build a query, normalising dates to YYYY-MM-DD strings"""
+        def as_text(value):
+            if isinstance(value, (date, datetime)):
+                return value.strftime("%Y-%m-%d")
+            return value
+        
+        return cls(
+            origin,
+            destination,
+            as_text(departure_date),
+            as_text(return_date),
+            bool(non_stop),
+            currency or Config.CURRENCY_CODE,
+            int(adults)
+        )
+
 
 class CacheManager:
    
     
+    # bump when the flights table layout changes
+    _SCHEMA_VERSION = 4
+    # SQLite limits the number of bound parameters per statement
+    _QUERY_CHUNK = 100
+    
     def __init__(self):
         self.cache_dir = Config.FLIGHTS_CACHE_DIR
+        self.db_file = Config.FLIGHTS_CACHE_DB
+        # resolved once, the sweeper thread may connect after the working directory changed
+        self._db_path = os.path.abspath(self.db_file)
         self.iata_cache_file = Config.IATA_CACHE_FILE
+        self.iata_flush_threshold = Config.IATA_FLUSH_THRESHOLD
         self.expiry_hours = Config.CACHE_EXPIRY_HOURS
+        self.stale_hours = Config.CACHE_STALE_HOURS
+        self.max_entries = Config.CACHE_MAX_ENTRIES
+        # searches may run on several threads at once
+        self._lock = threading.Lock()
+        # one SQLite connection per thread
+        self._local = threading.local()
+        # fresh answers found, queries not in the cache and answers too old to serve,
+        # counted like the hit, miss and expired results of cache_lookups_total
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        # expired answers served by get_many_stale while they are refreshed
+        self.stale = 0
+        
+        # query -> time of the last hit, written to last_used with the next flush or sweep
+        self._touched = {}
+        self._sweeper = None
+        self._sweeper_stop = threading.Event()
+        self._metrics = get_metrics()
+        
+        # city -> IATA code, loaded on first use and written behind
+        self._iata_codes = None
+        self._iata_pending = 0
+        # never lose codes found during a run that ends early
+        atexit.register(self.flush)
+        
+        self._init_db()
+        self.migrate_json_cache()
     
-    def _get_cache_filename(self, origin, destination):
-        """create a cache filename based on origin and destination"""
-        return f"{self.cache_dir}/{origin}_{destination}.json"
-    
-    def save_flight_data(self, origin, destination, flight_data):
-        """save flight data to cache"""
-        cache_file = self._get_cache_filename(origin, destination)
-        # cache structure
-        cache_data = {
-            "timestamp": datetime.now().isoformat(),
-            "origin": origin,
-            "destination": destination,
-            "data": {
-                "price": flight_data.price,
-                "origin_airport": flight_data.origin_airport,
-                "destination_airport": flight_data.destination_airport,
-                "out_date": flight_data.out_date,
-                "return_date": flight_data.return_date,
-                "airline": getattr(flight_data, 'airline', None),           
-                "flight_number": getattr(flight_data, 'flight_number', None), 
-                "stops": getattr(flight_data, 'stops', 0),                   
-                "booking_link": getattr(flight_data, 'booking_link', None)   
-            }
-        }
-    
-        with open(cache_file, 'w') as f:
-            json.dump(cache_data, f, indent=2)
-        
-        print(f"Saved: {origin} → {destination}")
-
+    def _connect(self):
+        """return the SQLite connection of the current thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self._db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self._db_path, timeout=30)
+            self._local.connection = connection
+        return connection
+    
+    def _init_db(self):
+        """create the flight table and its indexes, upgrading older layouts"""
+        connection = self._connect()
+        if Config.CACHE_SHARED:
+            # several hosts use the file, only the rollback journal locks across them
+            connection.execute("PRAGMA journal_mode=DELETE")
+            connection.execute("PRAGMA synchronous=FULL")
+        else:
+            # WAL lets readers run while a search writes new results
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        
+        with connection:
+            if version < 2:
+                # version 1 was keyed by route only
+                if self._has_table("flights"):
+                    connection.execute("ALTER TABLE flights RENAME TO flights_v1")
+            
+            # data is FlightData.to_bytes(), NULL when the search found no flights;
+            # last_used is the last time a lookup was answered by the row, for LRU eviction
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS flights (
+                    origin TEXT NOT NULL,
+                    destination TEXT NOT NULL,
+                    departure_date TEXT NOT NULL,
+                    return_date TEXT NOT NULL,
+                    non_stop INTEGER NOT NULL,
+                    currency TEXT NOT NULL,
+                    adults INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    data BLOB,
+                    last_used REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (origin, destination, departure_date, return_date,
+                                 non_stop, currency, adults)
+                )
+                """
+            )
+            
+            if self._has_table("flights_v1"):
+                # old rows came from non-stop, one adult searches in the configured currency
+                connection.execute(
+                    """
+                    INSERT OR REPLACE INTO flights
+                    SELECT origin, destination, out_date, return_date, 1, ?, 1, fetched_at, data, fetched_at
+                    FROM flights_v1
+                    WHERE out_date IS NOT NULL AND return_date IS NOT NULL
+                    """,
+                    (Config.CURRENCY_CODE,)
+                )
+                connection.execute("DROP TABLE flights_v1")
+            
+            if version < 3:
+                # version 2 stored indented JSON text
+                self._convert_json_rows(connection)
+            
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(flights)")}
+            if "last_used" not in columns:
+                # version 3 did not track reads, start from the fetch time
+                connection.execute("ALTER TABLE flights ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+                connection.execute("UPDATE flights SET last_used = fetched_at")
+            
+            # created after the upgrade so index names do not clash with version 1
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_flights_travel_dates ON flights (departure_date, return_date)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_flights_fetched_at ON flights (fetched_at)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_flights_last_used ON flights (last_used)"
+            )
+            
+            connection.execute(f"PRAGMA user_version = {self._SCHEMA_VERSION}")
+    
+    def _has_table(self, name):
+        """check whether a table exists in the cache database"""
+        row = self._connect().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone()
+        return row is not None
+    
+    @staticmethod
+    def _convert_json_rows(connection):
+        """rewrite JSON text rows as binary FlightData, dropping unreadable ones"""
+        converted = []
+        broken = []
+        for rowid, data in connection.execute("SELECT rowid, data FROM flights WHERE typeof(data) = 'text'"):
+            try:
+                converted.append((FlightData.from_dict(json.loads(data)).to_bytes(), rowid))
+            except (ValueError, TypeError, KeyError):
+                broken.append((rowid,))
+        connection.executemany("UPDATE flights SET data = ? WHERE rowid = ?", converted)
+        connection.executemany("DELETE FROM flights WHERE rowid = ?", broken)
+    
+    def _put_rows(self, rows):
+        """insert or replace (FlightQuery, FlightData or None, fetched_at) rows"""
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                """
+                INSERT OR REPLACE INTO flights
+                    (origin, destination, departure_date, return_date,
+                     non_stop, currency, adults, fetched_at, data, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (*query, fetched_at, None if flight_data is None else flight_data.to_bytes(), fetched_at)
+                    for query, flight_data, fetched_at in rows
+                ]
+            )
+    
+    def put_many(self, entries):
+        """
+        save many search results in one transaction
+        
+        parameters:
+            entries: iterable of (FlightQuery, FlightData or None when no flights were found)
+        """
+        now = datetime.now().timestamp()
+        rows = [(query, flight_data, now) for query, flight_data in entries]
+        self._put_rows(rows)
+        self._metrics.inc("cache_writes_total", len(rows))
+        
+        for query, _, _ in rows:
+            logger.debug(f"Saved: {query.origin} → {query.destination} "
+                         f"({query.departure_date} - {query.return_date})")
+    
+    def get_many(self, queries, max_age_hours=None):
+        """
+        load cached search results for many queries at once
+        
+        parameters:
+            queries: iterable of FlightQuery
+            max_age_hours: override CACHE_EXPIRY_HOURS for this lookup
+        return: dict of FlightQuery -> cached FlightData, or None when the search
+                found no flights; only fresh entries are included
+        """
+        return self._lookup(queries, max_age_hours, 0)[0]
+    
+    def get_many_stale(self, queries):
+        """
+        like get_many, but answers expired for less than CACHE_STALE_HOURS are served too
+        
+        return: (dict of FlightQuery -> FlightData or None, list of the served
+                 queries that are stale and should be refreshed)
+        """
+        return self._lookup(queries, None, self.stale_hours)
+    
+    def _lookup(self, queries, max_age_hours, stale_hours):
+        """read fresh answers, and answers at most stale_hours past their expiry"""
+        queries = list(dict.fromkeys(queries))
+        max_age_hours = self.expiry_hours if max_age_hours is None else max_age_hours
+        now = datetime.now()
+        fresh_after = (now - timedelta(hours=max_age_hours)).timestamp()
+        oldest = (now - timedelta(hours=max_age_hours + stale_hours)).timestamp()
+        connection = self._connect()
+        found = {}
+        stale = []
+        expired = 0
+        
+        for i in range(0, len(queries), self._QUERY_CHUNK):
+            chunk = queries[i:i + self._QUERY_CHUNK]
+            placeholders = ", ".join("(?, ?, ?, ?, ?, ?, ?)" for _ in chunk)
+            params = [value for query in chunk for value in query]
+            cursor = connection.execute(
+                f"""
+                SELECT origin, destination, departure_date, return_date,
+                       non_stop, currency, adults, fetched_at, data
+                FROM flights
+                WHERE (origin, destination, departure_date, return_date,
+                       non_stop, currency, adults) IN (VALUES {placeholders})
+                """,
+                params
+            )
+            for row in cursor:
+                query = FlightQuery(*row[:4], bool(row[4]), *row[5:7])
+                fetched_at, data = row[7], row[8]
+                # cheack whether cache is expired
+                if fetched_at < oldest:
+                    logger.debug(f"Cache is expired: {query.origin} → {query.destination}")
+                    expired += 1
+                    continue
+                if fetched_at < fresh_after:
+                    logger.debug(f"Serving stale cache data: {query.origin} → {query.destination}")
+                    stale.append(query)
+                else:
+                    logger.debug(f"Useing the cache data: {query.origin} → {query.destination}")
+                found[query] = None if data is None else FlightData.from_bytes(data)
+        
+        fresh = len(found) - len(stale)
+        with self._lock:
+            self.hits += fresh
+            self.misses += len(queries) - len(found) - expired
+            self.expired += expired
+            self.stale += len(stale)
+            touched_at = now.timestamp()
+            for query in found:
+                self._touched[query] = touched_at
+        self._metrics.inc("cache_lookups_total", fresh, result="hit")
+        self._metrics.inc("cache_lookups_total", len(stale), result="stale")
+        self._metrics.inc("cache_lookups_total", len(queries) - len(found) - expired, result="miss")
+        self._metrics.inc("cache_lookups_total", expired, result="expired")
+        return found, stale
     
-    def load_flight_data(self, origin, destination):
+    def _flush_touched(self):
+        """write the last hit time of every entry read since the previous flush"""
+        with self._lock:
+            touched = self._touched
+            self._touched = {}
+        if not touched:
+            return
+        
+        connection = self._connect()
+        with connection:
+            connection.executemany(
+                """
+                UPDATE flights SET last_used = MAX(last_used, ?)
+                WHERE origin = ? AND destination = ? AND departure_date = ? AND return_date = ?
+                  AND non_stop = ? AND currency = ? AND adults = ?
+                """,
+                [(used_at, *query) for query, used_at in touched.items()]
+            )
+    
+    def sweep(self):
+        """
+        delete entries too old to be served, then evict the least recently used
+        entries beyond CACHE_MAX_ENTRIES
+        
+        return: (number of expired entries deleted, number of entries evicted)
+        """
+        self._flush_touched()
+        oldest = (datetime.now() - timedelta(hours=self.expiry_hours + self.stale_hours)).timestamp()
+        connection = self._connect()
+        with connection:
+            expired = connection.execute("DELETE FROM flights WHERE fetched_at < ?", (oldest,)).rowcount
+            evicted = 0
+            if self.max_entries > 0:
+                count = connection.execute("SELECT COUNT(*) FROM flights").fetchone()[0]
+                if count > self.max_entries:
+                    evicted = connection.execute(
+                        """
+                        DELETE FROM flights WHERE rowid IN (
+                            SELECT rowid FROM flights ORDER BY last_used LIMIT ?
+                        )
+                        """,
+                        (count - self.max_entries,)
+                    ).rowcount
+        
+        self._metrics.inc("cache_evictions_total", expired, reason="expired")
+        self._metrics.inc("cache_evictions_total", evicted, reason="lru")
+        if expired or evicted:
+            logger.debug(f"Cache sweep: {expired} expired and {evicted} least recently used entries deleted")
+        return expired, evicted
+    
+    def start_sweeper(self, interval_minutes=None):
+        """
+        sweep now, then every interval_minutes, in a background thread
+        
+        parameters:
+            interval_minutes: time between two sweeps (default CACHE_SWEEP_MINUTES, 0 = no sweeper)
+        """
+        interval_minutes = Config.CACHE_SWEEP_MINUTES if interval_minutes is None else interval_minutes
+        if interval_minutes <= 0 or self._sweeper is not None:
+            return
+        
+        def run():
+            while True:
+                try:
+                    self.sweep()
+                except sqlite3.Error as e:
+                    logger.warning(f"Cache sweep failed: {e}")
+                if self._sweeper_stop.wait(interval_minutes * 60):
+                    return
+        
+        self._sweeper_stop.clear()
+        self._sweeper = threading.Thread(target=run, name="cache-sweeper", daemon=True)
+        self._sweeper.start()
+    
+    def stop_sweeper(self):
+        """stop the background sweeper, waiting for a running sweep to finish"""
+        if self._sweeper is None:
+            return
+        self._sweeper_stop.set()
+        self._sweeper.join()
+        self._sweeper = None
+    
+    def get_window(self, origin, destination, date_pairs, non_stop=True, currency=None, adults=1,
+                   max_age_hours=None):
+        """
+        split a window of date pairs into cached results and dates still to search
+        
+        when the search window slides forward, the overlapping pairs come from
+        the cache and only the newly exposed ones are returned as missing
+        
+        parameters:
+            date_pairs: iterable of (departure_date, return_date)
+            max_age_hours: override CACHE_EXPIRY_HOURS for this lookup
+        return: (dict of (departure_date, return_date) -> FlightData or None,
+                 list of (departure_date, return_date) not in the cache)
+        """
+        queries = [
+            FlightQuery.create(origin, destination, departure, arrival, non_stop, currency, adults)
+            for departure, arrival in date_pairs
+        ]
+        found = self.get_many(queries, max_age_hours)
+        
+        hits = {}
+        missing = []
+        for query in dict.fromkeys(queries):
+            pair = (query.departure_date, query.return_date)
+            if query in found:
+                hits[pair] = found[query]
+            else:
+                missing.append(pair)
+        return hits, missing
+    
+    def save_flight_data(self, query, flight_data):
+        """save the result of a search (None when no flights were found) to cache"""
+        self.put_many([(query, flight_data)])
+    
+    def load_flight_data(self, query):
         """load flight data from cache if is expired"""
-        cache_file = self._get_cache_filename(origin, destination)
+        return self.get_many([query]).get(query)
+    
+    def migrate_json_cache(self):
+        """
+        move the legacy per-route JSON cache files into the SQLite store
+        
+        return: number of migrated routes
+        """
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        
+        json_files = [name for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+        if not json_files:
+            return 0
         
-        if not os.path.exists(cache_file):
-            return None
+        rows = []
+        migrated = []
+        for name in json_files:
+            try:
+                with open(os.path.join(self.cache_dir, name), 'r') as f:
+                    cache_data = json.load(f)
+                fetched_at = datetime.fromisoformat(cache_data["timestamp"]).timestamp()
+                data = cache_data["data"]
+                # legacy files came from non-stop, one adult searches
+                query = FlightQuery.create(
+                    cache_data["origin"], cache_data["destination"],
+                    data["out_date"], data["return_date"]
+                )
+                rows.append((query, FlightData.from_dict(data), fetched_at))
+                migrated.append(name)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Skip broken cache file {name}: {e}")
         
-        with open(cache_file, 'r') as f:
-            cache_data = json.load(f)
+        self._put_rows(rows)
         
-        # cheack whether cache is expired
-        cached_time = datetime.fromisoformat(cache_data["timestamp"])
-        if datetime.now() - cached_time > timedelta(hours=self.expiry_hours):
-            print(f"Cache is expired: {origin} → {destination}")
-            return None
+        # the data now lives in SQLite, remove the old files
+        for name in migrated:
+            os.remove(os.path.join(self.cache_dir, name))
+        try:
+            os.rmdir(self.cache_dir)
+        except OSError:
+            pass
         
-        print(f"Useing the cache data: {origin} → {destination}")
-        return cache_data["data"]
+        logger.info(f"Migrated {len(rows)} cached route/s to {self.db_file}")
+        return len(rows)
     
-    def save_iata_code(self, city, iata_code):
-        """save IATA code to cache"""
+    def _load_iata_index(self):
+        """read the IATA cache file into memory once (caller holds the lock)"""
+        if self._iata_codes is not None:
+            return
+        
+        self._iata_codes = {}
         if os.path.exists(self.iata_cache_file):
             with open(self.iata_cache_file, 'r') as f:
-                iata_cache = json.load(f)
-        else:
-            iata_cache = {}
-        
-        iata_cache[city.lower()] = iata_code
+                self._iata_codes = json.load(f)
+    
+    def _flush_iata_index(self):
+        """write the IATA index with one atomic replace (caller holds the lock)"""
+        if not self._iata_pending:
+            return
         
-        with open(self.iata_cache_file, 'w') as f:
-            json.dump(iata_cache, f, indent=2)
+        directory = os.path.dirname(self.iata_cache_file) or "."
+        os.makedirs(directory, exist_ok=True)
+        temp_file = f"{self.iata_cache_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(self._iata_codes, f, indent=2)
+        os.replace(temp_file, self.iata_cache_file)
+        self._iata_pending = 0
+    
+    def save_iata_code(self, city, iata_code):
+        """save IATA code to cache, written to disk in batches"""
+        with self._lock:
+            self._load_iata_index()
+            self._iata_codes[city.lower()] = iata_code
+            self._iata_pending += 1
+            
+            if self._iata_pending >= self.iata_flush_threshold:
+                self._flush_iata_index()
     
     def load_iata_code(self, city):
         """load IATA code from cache"""
-        if not os.path.exists(self.iata_cache_file):
-            return None
-        
-        with open(self.iata_cache_file, 'r') as f:
-            iata_cache = json.load(f)
-        
-        return iata_cache.get(city.lower())
+        with self._lock:
+            self._load_iata_index()
+            return self._iata_codes.get(city.lower())
+    
+    def flush(self):
+        """write IATA codes and entry read times that are not on disk yet"""
+        with self._lock:
+            self._flush_iata_index()
+        self._flush_touched()
@@ -0,0 +1,173 @@
+# city_index.py
+"""
+city_index.py
+resolve city names to IATA codes offline from the bundled reference dataset
+"""
+import bisect
+import csv
+import difflib
+import logging
+import os
+import pickle
+import re
+import threading
+import unicodedata
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_city(name):
+    """lower-case a city name and strip accents, punctuation and extra spaces"""
+    decomposed = unicodedata.normalize("NFKD", name)
+    without_accents = "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+    cleaned = re.sub(r"[^\w]+", " ", without_accents.casefold())
+    return " ".join(cleaned.split())
+
+
+class CityIndex:
+    """in-memory index of city names to IATA codes"""
+
+    # bump when the compiled index layout changes
+    _FORMAT_VERSION = 1
+    # shorter prefixes match too many cities to be useful
+    _MIN_PREFIX_LENGTH = 4
+
+    def __init__(self, source_file=None, compiled_file=None, fuzzy_cutoff=None):
+        """
+        initialize city index, the dataset is loaded on first lookup
+
+        parameters:
+            source_file: CSV with city, iata_code, country_code and aliases columns
+            compiled_file: binary copy of the index, rebuilt when the CSV changes
+            fuzzy_cutoff: minimum similarity (0-1) accepted for a fuzzy match
+        """
+        self.source_file = source_file or Config.CITY_DATASET_FILE
+        self.compiled_file = compiled_file or Config.CITY_INDEX_FILE
+        self.fuzzy_cutoff = Config.CITY_FUZZY_CUTOFF if fuzzy_cutoff is None else fuzzy_cutoff
+
+        # normalized name -> IATA code
+        self._codes = None
+        # sorted normalized names for prefix search
+        self._names = None
+        self._lock = threading.Lock()
+
+    def _source_signature(self):
+        """identify the CSV version the compiled index was built from"""
+        stat = os.stat(self.source_file)
+        return [self._FORMAT_VERSION, stat.st_mtime_ns, stat.st_size]
+
+    def _load_compiled(self, signature):
+        """load the compiled index if it matches the current CSV"""
+        if not os.path.exists(self.compiled_file):
+            return False
+
+        try:
+            with open(self.compiled_file, 'rb') as f:
+                compiled = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+
+        if compiled.get("signature") != signature:
+            return False
+
+        self._codes = compiled["codes"]
+        self._names = compiled["names"]
+        return True
+
+    def _build(self, signature):
+        """parse the CSV and save the compiled index"""
+        codes = {}
+        with open(self.source_file, 'r', encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                code = row["iata_code"].strip().upper()
+                names = [row["city"]] + (row.get("aliases") or "").split(";")
+                for name in names:
+                    key = normalize_city(name)
+                    if key:
+                        codes.setdefault(key, code)
+
+        self._codes = codes
+        self._names = sorted(codes)
+
+        try:
+            directory = os.path.dirname(self.compiled_file) or "."
+            os.makedirs(directory, exist_ok=True)
+            temp_file = f"{self.compiled_file}.tmp"
+            with open(temp_file, 'wb') as f:
+                pickle.dump(
+                    {"signature": signature, "codes": self._codes, "names": self._names},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(temp_file, self.compiled_file)
+        except OSError as e:
+            logger.warning(f"Failed to save the city index: {e}")
+
+    def _ensure_loaded(self):
+        """load the index on first use"""
+        with self._lock:
+            if self._codes is not None:
+                return
+
+            if not os.path.exists(self.source_file):
+                self._codes = {}
+                self._names = []
+                return
+
+            signature = self._source_signature()
+            if not self._load_compiled(signature):
+                self._build(signature)
+
+    def _prefix_match(self, key):
+        """return the code when every city starting with key shares it"""
+        if len(key) < self._MIN_PREFIX_LENGTH:
+            return None
+
+        start = bisect.bisect_left(self._names, key)
+        codes = set()
+        for name in self._names[start:]:
+            if not name.startswith(key):
+                break
+            codes.add(self._codes[name])
+            if len(codes) > 1:
+                return None
+        return codes.pop() if codes else None
+
+    def _fuzzy_match(self, key):
+        """return the code of the closest spelling, if close enough"""
+        matches = difflib.get_close_matches(key, self._names, n=2, cutoff=self.fuzzy_cutoff)
+        if not matches:
+            return None
+        # two equally good candidates for different cities is a guess
+        if len(matches) > 1 and self._codes[matches[0]] != self._codes[matches[1]]:
+            ratio = difflib.SequenceMatcher(None, key, matches[0]).ratio()
+            runner_up = difflib.SequenceMatcher(None, key, matches[1]).ratio()
+            if ratio == runner_up:
+                return None
+        return self._codes[matches[0]]
+
+    def resolve(self, city_name):
+        """
+        find the IATA code of a city without calling any API
+
+        return: IATA code, or None when the city is not in the dataset
+        """
+        self._ensure_loaded()
+        key = normalize_city(city_name or "")
+        if not key:
+            return None
+
+        return (
+            self._codes.get(key)
+            or self._prefix_match(key)
+            or self._fuzzy_match(key)
+        )
+
+    def resolve_many(self, city_names):
+        """
+        resolve several cities at once
+
+        return: dict of city name -> IATA code or None
+        """
+        return {city_name: self.resolve(city_name) for city_name in city_names}
@@ -0,0 +1,71 @@
+# coalescer.py
+"""
+coalescer.py
+let identical concurrent calls share one execution
+"""
+import threading
+from metrics import get_metrics
+
+
+class _Call:
+    """one call in progress, waited on by every duplicate caller"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """run func once per key while a call with that key is in progress"""
+
+    def __init__(self, name=None):
+        """
+        initialize single flight
+
+        parameters:
+            name: label of the coalesced_calls_total counter, no metric when None
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        # number of calls answered by another caller's execution
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        call func(*args, **kwargs), or wait for the identical call already running
+
+        parameters:
+            key: hashable identity of the call
+        return: the result of func, exceptions are raised in every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            if self.name:
+                get_metrics().inc("coalesced_calls_total", kind=self.name)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            # later calls with the same key start a new execution
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
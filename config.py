@@ -2,7 +2,9 @@
 """
 manage application configuration and environment variables
 """
+import logging
 import os
+import sys
 from dotenv import load_dotenv
 
 # load .env file
@@ -15,16 +17,31 @@ class Config:
     SHEETY_PRICES_ENDPOINT = os.getenv("SHEETY_PRICES_ENDPOINT")
     SHEETY_USERS_ENDPOINT = os.getenv("SHEETY_USERS_ENDPOINT")
     
+    # max number of Sheety row updates per minute (0 = no limit)
+    SHEETY_WRITES_PER_MINUTE = int(os.getenv("SHEETY_WRITES_PER_MINUTE", "60"))
+    
     # Amadeus settings
     AMADEUS_API_KEY = os.getenv("AMADEUS_API_KEY")
     AMADEUS_API_SECRET = os.getenv("AMADEUS_API_SECRET")
+    # point at a local stand-in for benchmarks and testing
+    AMADEUS_BASE_URL = os.getenv("AMADEUS_BASE_URL", "https://test.api.amadeus.com").rstrip("/")
     
     # Email settings
     EMAIL_USER = os.getenv("EMAIL_USER")
     EMAIL_PASS = os.getenv("EMAIL_PASS")
+    SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+    SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+    # set to false for a local SMTP stand-in without TLS
+    SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() == "true"
+    # per_deal: one email per deal plus a summary
+    # digest: one email per run, recipient_digest: one email per recipient
+    NOTIFICATION_MODE = os.getenv("NOTIFICATION_MODE", "digest")
     
-    # Origin city IATA code
+    # Origin city IATA code, several origins can be separated by commas (e.g. SYD,MEL)
     ORIGIN_CITY_IATA = os.getenv("ORIGIN_CITY_IATA", "SYD")
+    ORIGIN_CITY_IATAS = list(dict.fromkeys(
+        code.strip().upper() for code in ORIGIN_CITY_IATA.split(",") if code.strip()
+    ))
     
     # Currency settings
     CURRENCY_CODE = os.getenv("CURRENCY_CODE", "AUD")
@@ -40,9 +57,111 @@ class Config:
     
     # Cache settings
     CACHE_DIR = "cache"
+    FLIGHTS_CACHE_DB = "cache/flights.db"
+    # legacy per-route JSON cache, migrated into FLIGHTS_CACHE_DB on startup
     FLIGHTS_CACHE_DIR = "cache/flights"
     IATA_CACHE_FILE = "cache/iata_codes.json"
+    # new IATA codes are written to disk after this many lookups (and at exit)
+    IATA_FLUSH_THRESHOLD = 50
     CACHE_EXPIRY_HOURS = 24
+    # entries kept in the flight cache, the least recently used are evicted first (0 = no limit)
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "200000"))
+    # stale-while-revalidate: an answer expired for less than this many hours is still
+    # served while a background search refreshes it (0 = off)
+    CACHE_STALE_HOURS = float(os.getenv("CACHE_STALE_HOURS", "0"))
+    CACHE_REFRESH_WORKERS = int(os.getenv("CACHE_REFRESH_WORKERS", "2"))
+    # the background sweeper deletes entries too old to be served and enforces CACHE_MAX_ENTRIES
+    CACHE_SWEEP_MINUTES = float(os.getenv("CACHE_SWEEP_MINUTES", "30"))
+    # true when FLIGHTS_CACHE_DB is used by workers on several hosts over a shared filesystem,
+    # SQLite's WAL mode needs shared memory on one host and is turned off then
+    CACHE_SHARED = os.getenv("CACHE_SHARED", "false").lower() == "true"
+    # Price history: every price returned by the API, one file per route
+    PRICE_HISTORY_DIR = "cache/history"
+    PRICE_HISTORY_FLUSH_THRESHOLD = 500
+    PRICE_HISTORY_RETENTION_DAYS = 365
+    PRICE_HISTORY_COMPACT_DAYS = 7
+    TOKEN_CACHE_FILE = "cache/amadeus_token.json"
+    # renew the access token this many seconds before it expires
+    TOKEN_REFRESH_MARGIN_SECONDS = 60
+    
+    # Offline city reference dataset shipped with the project
+    CITY_DATASET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.csv")
+    CITY_INDEX_FILE = "cache/city_index.pickle"
+    # minimum spelling similarity (0-1) for a fuzzy city match
+    CITY_FUZZY_CUTOFF = 0.85
+    
+    # Search settings
+    # max number of Amadeus lookups running at the same time
+    SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "8"))
+    
+    # Price calendar: search every departure/return pair in the window, opt-in as it
+    # costs one API call per pair (about 28 per route for the default window)
+    PRICE_CALENDAR = os.getenv("PRICE_CALENDAR", "false").lower() == "true"
+    CALENDAR_MIN_TRIP_DAYS = int(os.getenv("CALENDAR_MIN_TRIP_DAYS", "3"))
+    CALENDAR_MAX_TRIP_DAYS = int(os.getenv("CALENDAR_MAX_TRIP_DAYS", "9"))
+    
+    # Multi-offer search: request many offers per call and keep the best match
+    MULTI_OFFER_SEARCH = os.getenv("MULTI_OFFER_SEARCH", "false").lower() == "true"
+    MAX_OFFERS = int(os.getenv("MAX_OFFERS", "250"))
+    MAX_STOPS = int(os.getenv("MAX_STOPS", "0"))
+    MAX_DURATION_HOURS = float(os.getenv("MAX_DURATION_HOURS", "0"))
+    PREFERRED_CARRIERS = [code.strip().upper() for code in os.getenv("PREFERRED_CARRIERS", "").split(",") if code.strip()]
+    EXCLUDED_CARRIERS = [code.strip().upper() for code in os.getenv("EXCLUDED_CARRIERS", "").split(",") if code.strip()]
+    
+    # Daemon mode: routes are refreshed more often when prices move, sit near
+    # the target or the departure is close, within an hourly API call budget
+    DAEMON_API_CALLS_PER_HOUR = int(os.getenv("DAEMON_API_CALLS_PER_HOUR", "400"))
+    DAEMON_MIN_REFRESH_MINUTES = int(os.getenv("DAEMON_MIN_REFRESH_MINUTES", "30"))
+    DAEMON_MAX_REFRESH_HOURS = float(os.getenv("DAEMON_MAX_REFRESH_HOURS", "24"))
+    DAEMON_SHEET_REFRESH_HOURS = float(os.getenv("DAEMON_SHEET_REFRESH_HOURS", "6"))
+    
+    # Local query service (python service.py), only reachable from this machine by default
+    SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+    SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8080"))
+    
+    # Run journal: progress of a sweep, an interrupted run resumes from it;
+    # search answers are synced to disk every RUN_JOURNAL_FSYNC_EVERY records
+    RUN_JOURNAL_FILE = "cache/run_journal.jsonl"
+    RUN_JOURNAL_FSYNC_EVERY = int(os.getenv("RUN_JOURNAL_FSYNC_EVERY", "50"))
+    
+    # Sharded sweeps (python coordinator.py): the searches of a sweep are queued in
+    # WORK_QUEUE_DB and run by worker processes (python worker.py), on this host or on
+    # hosts sharing the file; a search taken by a worker can be taken over by another one
+    # after WORK_LEASE_SECONDS, a failed search is tried WORK_MAX_ATTEMPTS times in all
+    WORK_QUEUE_DB = os.getenv("WORK_QUEUE_DB", "cache/work_queue.db")
+    SWEEP_WORKERS = int(os.getenv("SWEEP_WORKERS", "4"))
+    WORK_LEASE_SECONDS = float(os.getenv("WORK_LEASE_SECONDS", "300"))
+    WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+    WORK_RETRY_DELAY_SECONDS = float(os.getenv("WORK_RETRY_DELAY_SECONDS", "30"))
+    # the coordinator stops waiting once no search finished for this long (0 = wait forever)
+    WORK_STALL_SECONDS = float(os.getenv("WORK_STALL_SECONDS", "900"))
+    
+    # Offline-first: the sheets are read from a local snapshot while it is fresh and the
+    # Amadeus token is only requested on a cache miss, so a fully cached run stays offline
+    OFFLINE_FIRST = os.getenv("OFFLINE_FIRST", "false").lower() == "true"
+    SHEET_SNAPSHOT_FILE = "cache/sheets.json"
+    SHEET_SNAPSHOT_TTL_MINUTES = float(os.getenv("SHEET_SNAPSHOT_TTL_MINUTES", "60"))
+    
+    # Logging: DEBUG also shows every cache hit, save and API lookup, WARNING only problems
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    # Run report written at the end of every run
+    METRICS_REPORT_FILE = os.getenv("METRICS_REPORT_FILE", "cache/run_report.json")
+    METRICS_PROMETHEUS_FILE = os.getenv("METRICS_PROMETHEUS_FILE", "cache/metrics.prom")
+    
+    # HTTP transport settings
+    # connections kept open per host, enough for every concurrent search
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", SEARCH_CONCURRENCY))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+    # requests per second per API host (0 = no limit), halved on every 429 and recovered gradually
+    AMADEUS_REQUESTS_PER_SECOND = float(os.getenv("AMADEUS_REQUESTS_PER_SECOND", "10"))
+    SHEETY_REQUESTS_PER_SECOND = float(os.getenv("SHEETY_REQUESTS_PER_SECOND", "5"))
+    # calls to a host are paused for CIRCUIT_BREAKER_COOLDOWN_SECONDS once at least
+    # CIRCUIT_BREAKER_ERROR_RATE of its last CIRCUIT_BREAKER_WINDOW requests failed
+    CIRCUIT_BREAKER_ERROR_RATE = float(os.getenv("CIRCUIT_BREAKER_ERROR_RATE", "0.5"))
+    CIRCUIT_BREAKER_WINDOW = int(os.getenv("CIRCUIT_BREAKER_WINDOW", "20"))
+    CIRCUIT_BREAKER_MIN_CALLS = int(os.getenv("CIRCUIT_BREAKER_MIN_CALLS", "10"))
+    CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_COOLDOWN_SECONDS", "60"))
     
     @classmethod
     def validate(cls):
@@ -57,6 +176,8 @@ class Config:
         }
         
         missing = [key for key, value in required.items() if not value]
+        if not cls.ORIGIN_CITY_IATAS:
+            missing.append("ORIGIN_CITY_IATA")
         
         if missing:
             raise ValueError(f"Missing improtant value: {', '.join(missing)}")
@@ -67,7 +188,15 @@ class Config:
     def setup_cache_dirs(cls):
         """create cache directories if not exist"""
         os.makedirs(cls.CACHE_DIR, exist_ok=True)
-        os.makedirs(cls.FLIGHTS_CACHE_DIR, exist_ok=True)
+    
+    @classmethod
+    def setup_logging(cls):
+        """send log messages to the console, at LOG_LEVEL and above"""
+        logging.basicConfig(
+            level=getattr(logging, cls.LOG_LEVEL, logging.INFO),
+            format="%(message)s",
+            stream=sys.stdout
+        )
     
     @classmethod
     def get_currency_symbol(cls):
@@ -0,0 +1,203 @@
+# coordinator.py
+"""
+coordinator.py
+queue a sweep for worker processes and report it once every route is searched
+
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from config import Config
+from data_manager import DataManager
+from flight_search import FlightSearch
+from async_search import AsyncSearchEngine
+from notification_manager import NotificationManager, NotificationDispatcher
+from reports import failure_summary, send_notifications
+from main import print_header, send_api_failure_notification, write_run_report
+from metrics import get_metrics
+from work_queue import WorkQueue, DONE, FAILED, LEASED, PENDING
+from worker import start_workers
+
+# progress is printed at most this often while the workers search
+PROGRESS_SECONDS = 10
+
+
+def wait_for_sweep(work_queue, sweep_id, processes, stall_seconds=None):
+    """
+    wait until every task of the sweep is done or failed
+
+    parameters:
+        processes: local worker processes, waiting stops early when all of them died
+        stall_seconds: waiting stops once no task finished for this long,
+                       0 waits forever (default WORK_STALL_SECONDS)
+    return: progress of the sweep when waiting stopped
+    """
+    stall_seconds = Config.WORK_STALL_SECONDS if stall_seconds is None else stall_seconds
+    last_printed = 0
+    last_finished = None
+    last_change = time.time()
+    while True:
+        progress = work_queue.progress(sweep_id)
+        finished = progress[DONE] + progress[FAILED]
+        total = sum(progress.values())
+        if time.time() - last_printed >= PROGRESS_SECONDS or finished == total:
+            print(f"   {finished}/{total} search/es finished ({progress[FAILED]} failed)")
+            last_printed = time.time()
+        if finished == total:
+            return progress
+        if processes and not any(process.is_alive() for process in processes):
+            print("   Every local worker stopped before the sweep was finished")
+            return progress
+        if finished != last_finished:
+            last_finished, last_change = finished, time.time()
+        elif stall_seconds and time.time() - last_change >= stall_seconds:
+            # with --workers 0 nobody may ever come, the next run picks the sweep up again
+            print(f"   No search finished for {stall_seconds:.0f}s, {total - finished} search/es "
+                  f"still missing ({progress[PENDING]} waiting, {progress[LEASED]} taken by a worker)")
+            return progress
+        time.sleep(1)
+
+
+def main(argv=None):
+    """queue a sweep, let the workers search it and notify the users"""
+    parser = argparse.ArgumentParser(description="Sweep every route with several worker processes")
+    parser.add_argument("--workers", type=int, default=Config.SWEEP_WORKERS,
+                        help="worker processes started here, 0 = only workers started elsewhere")
+    args = parser.parse_args(argv)
+
+    Config.setup_logging()
+    metrics = get_metrics()
+    print_header("The sharded flight price sweep has been activated!!")
+
+    with metrics.stage("config"):
+        try:
+            Config.validate()
+            Config.setup_cache_dirs()
+            print("Configuration verification passed")
+        except Exception as e:
+            print(f"Configuration error: {e}")
+            exit(1)
+
+    with metrics.stage("init"):
+        try:
+            data_manager = DataManager()
+            flight_search = FlightSearch()
+            notifier = NotificationDispatcher(NotificationManager())
+            work_queue = WorkQueue()
+        except Exception as e:
+            print(f"Failed to initialize: {e}")
+            exit(1)
+
+    origins = list(dict.fromkeys(Config.ORIGIN_CITY_IATAS))
+    search_start = datetime.now() + timedelta(days=1)
+    search_end = datetime.now() + timedelta(days=10)
+    print(f"   Place of departure: {', '.join(origins)}")
+    print(f"   Date: {search_start.strftime('%Y-%m-%d')} to {search_end.strftime('%Y-%m-%d')}")
+
+    # ===== Destinations and IATA codes =====
+    print_header("Get the list of monitoring destinations")
+    with metrics.stage("destinations"):
+        try:
+            destinations = data_manager.get_destination_data()
+            print(f"Succeed to obtain {len(destinations)} destination/s")
+        except Exception as e:
+            print(f"Fail to obtain destination: {e}")
+            exit(1)
+
+    search_engine = AsyncSearchEngine(flight_search)
+    with metrics.stage("iata"):
+        iata_errors = search_engine.fill_iata_codes(destinations, data_manager)
+        flight_search.cache_manager.flush()
+        try:
+            written = data_manager.flush_updates()
+            if written:
+                print(f"Updated {written} IATA code/s in the sheet")
+        except Exception as e:
+            print(f"Failed to update the sheet: {e}")
+    for city, error in iata_errors:
+        print(f" IATA lookup failed for {city}: {error}")
+
+    # ===== Queue and search =====
+    print_header("Search for lowest priced flights")
+    with metrics.stage("search"):
+        routes, pairs = search_engine.plan_lookups(origins, destinations, search_start, search_end)
+        sweep_id, resumed = work_queue.create_sweep(origins, search_start, search_end, routes, pairs)
+        if resumed:
+            print(f"   Picking up the unfinished sweep {sweep_id}")
+        print(f"   Sweep {sweep_id}: {len(routes) * len(pairs)} search/es queued")
+
+        processes = start_workers(args.workers, sweep_id) if args.workers > 0 else []
+        if not processes:
+            print(f"   Waiting for workers: python worker.py --sweep {sweep_id}")
+        progress = wait_for_sweep(work_queue, sweep_id, processes)
+        for process in processes:
+            if process.is_alive() and progress[PENDING] + progress[LEASED]:
+                # the sweep stalled, its leases expire and the next run searches them again
+                process.terminate()
+            process.join()
+
+    # searches the workers never finished are reported as failures,
+    # the next run of the coordinator picks the sweep up again
+    unfinished = progress[PENDING] + progress[LEASED]
+    answers = work_queue.answers(
+        sweep_id, Exception("Not searched, no worker finished it before the coordinator stopped waiting")
+    )
+
+    results_by_origin = search_engine.collect_results(origins, destinations, search_start, search_end, answers)
+    found_deals = [deal for results in results_by_origin.values() for deal in results["found_deals"]]
+    errors = [
+        (f"{city} from {origin}" if len(origins) > 1 else city, error)
+        for origin, results in results_by_origin.items()
+        for city, error in results["errors"]
+    ]
+    for city in results_by_origin[origins[0]]["skipped_destinations"]:
+        print(f" Skip {city}(no IATA code)")
+
+    # failed dates of routes answered by other dates are reported, their deals are kept
+    failures = list(iata_errors) + errors + search_engine.pair_errors
+    if failures:
+        summary = failure_summary(failures, len(answers))
+        print(f" API call failed: {summary}")
+        send_api_failure_notification(notifier, data_manager, summary)
+
+    with metrics.stage("history"):
+        # the prices found by the workers are written here, by one process in time order
+        for (origin, destination), records in work_queue.take_prices(sweep_id):
+            flight_search.price_history.add_records(origin, destination, records)
+        flight_search.price_history.flush()
+        flight_search.price_history.maybe_compact()
+
+    # ===== Notify =====
+    print_header("Send notifications to users")
+    with metrics.stage("notify"):
+        if unfinished:
+            # users hear about the deals once, from the run that finishes the sweep
+            print("  The sweep is not finished, its deals are sent by the run that finishes it")
+            results_by_origin = {}
+
+        for origin, results in results_by_origin.items():
+            try:
+                users = data_manager.get_user_emails(origin=origin)
+                if not users:
+                    print(f"  No users found for {origin}, skipping notification sending")
+                    continue
+                send_notifications(notifier, users, origin, results)
+            except Exception as e:
+                print(f" Fail to notification: {e}")
+        notifier.drain()
+
+    if not unfinished:
+        work_queue.finish_sweep(sweep_id)
+
+    print_header(" The sweep has completed running.")
+    print(f"   Valid destination: {len(destinations)} ")
+    print(f"   Lowest price: {len(found_deals)} ")
+    print(f"   Searches: {progress[DONE]} done, {progress[FAILED]} failed, {unfinished} not searched")
+    for stage, seconds in metrics.stages.items():
+        print(f"   {stage}: {seconds:.2f}s")
+    write_run_report(metrics)
+    print()
+
+
+if __name__ == "__main__":
+    main()
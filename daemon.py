@@ -0,0 +1,273 @@
+# daemon.py
+"""
+daemon.py
+keep monitoring flight prices, refreshing each route when it is due
+
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from config import Config
+from data_manager import DataManager
+from flight_search import FlightSearch
+from async_search import AsyncSearchEngine
+from notification_manager import NotificationManager, NotificationDispatcher
+from price_calendar import calendar_date_pairs
+from refresh_scheduler import ApiBudget, RefreshScheduler
+from reports import failure_summary, send_notifications
+from main import print_header, send_api_failure_notification, write_run_report
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# never sleep longer than this, so the sheet refresh and Ctrl+C stay responsive
+MAX_SLEEP_SECONDS = 300
+
+
+class PriceDaemon:
+    """long-running monitor that spends the API budget on the routes that need it"""
+
+    def __init__(self, data_manager, flight_search, notifier):
+        """
+        initialize price daemon
+
+        parameters:
+            data_manager: DataManager for the destination and user sheets
+            flight_search: FlightSearch shared by every refresh
+            notifier: object with send_email(message, recipient_emails)
+        """
+        self.data_manager = data_manager
+        self.flight_search = flight_search
+        self.notifier = notifier
+        self.search_engine = AsyncSearchEngine(flight_search)
+        self.budget = ApiBudget()
+        self.scheduler = RefreshScheduler(flight_search.price_history)
+
+        self.origins = Config.ORIGIN_CITY_IATAS
+        self.destinations = []
+        self._sheet_loaded_at = None
+        # route -> price of the last deal emailed, so a deal is only sent again when cheaper
+        self._notified = {}
+        self._failure_notified = False
+
+    def _search_window(self):
+        """first and last departure day searched, moving with the clock"""
+        return datetime.now() + timedelta(days=1), datetime.now() + timedelta(days=10)
+
+    def _route_cost(self):
+        """estimated API calls for one route refresh"""
+        if not Config.PRICE_CALENDAR:
+            return 1
+        search_start, search_end = self._search_window()
+        pairs = calendar_date_pairs(
+            search_start, search_end, Config.CALENDAR_MIN_TRIP_DAYS, Config.CALENDAR_MAX_TRIP_DAYS
+        )
+        # a route costing more than the whole bucket would never be refreshed
+        return max(1, min(len(pairs), self.budget.capacity))
+
+    def load_destinations(self):
+        """reload the destination sheet, fill missing IATA codes and update the schedule"""
+        print_header("Reload the list of monitoring destinations")
+        destinations = self.data_manager.get_destination_data(refresh=True)
+        print(f"Succeed to obtain {len(destinations)} destination/s")
+
+        iata_errors = self.search_engine.fill_iata_codes(destinations, self.data_manager)
+        self.flight_search.cache_manager.flush()
+        try:
+            written = self.data_manager.flush_updates()
+            if written:
+                print(f"Updated {written} IATA code/s in the sheet")
+        except Exception as e:
+            print(f"Failed to update the sheet: {e}")
+        for city, error in iata_errors:
+            print(f" Skip {city}: {error}")
+
+        self.destinations = destinations
+        self._sheet_loaded_at = time.time()
+
+        targets = {}
+        for dest in destinations:
+            if not dest.get("iataCode"):
+                continue
+            for origin in self.origins:
+                if dest["iataCode"] != origin:
+                    route = (origin, dest["iataCode"])
+                    targets[route] = max(targets.get(route, 0), dest["lowestPrice"])
+
+        for origin, code in list(self.scheduler.routes):
+            if (origin, code) not in targets:
+                self.scheduler.remove(origin, code)
+                self._notified.pop((origin, code), None)
+        for (origin, code), target_price in targets.items():
+            self.scheduler.add(origin, code, target_price)
+        print(f"Monitoring {len(targets)} route/s")
+
+    def _sheet_is_stale(self):
+        """check whether the destination sheet should be downloaded again"""
+        return time.time() - self._sheet_loaded_at >= Config.DAEMON_SHEET_REFRESH_HOURS * 3600
+
+    def refresh_due_routes(self):
+        """
+        search every route that is due, as far as the API budget allows
+
+        return: number of routes refreshed
+        """
+        cost = self._route_cost()
+        due = self.scheduler.pop_due(self.budget, cost)
+        if not due:
+            return 0
+
+        print_header(f"Refresh {len(due)} route/s ({self.budget.available():.0f} API call/s left this hour)")
+        search_start, search_end = self._search_window()
+        calls_before = self.flight_search.api_calls
+
+        due_by_origin = {}
+        for state in due:
+            due_by_origin.setdefault(state.origin, set()).add(state.destination)
+
+        # anything cached since the shortest refresh interval is still fresh enough
+        max_age_hours = Config.DAEMON_MIN_REFRESH_MINUTES / 60
+        results_by_origin = {}
+        # failed dates of routes answered by other dates
+        pair_errors = []
+        for origin, codes in due_by_origin.items():
+            rows = [dest for dest in self.destinations if dest.get("iataCode") in codes]
+            results_by_origin.update(self.search_engine.search_route_matrix(
+                [origin], rows, search_start, search_end, max_age_hours=max_age_hours
+            ))
+            pair_errors.extend(self.search_engine.pair_errors)
+
+        # give back what the cache saved
+        spent = self.flight_search.api_calls - calls_before
+        self.budget.refund(max(0, cost * len(due) - spent))
+
+        errors = []
+        outcomes = self.search_engine.route_outcomes
+        for state in due:
+            route = (state.origin, state.destination)
+            if route not in outcomes:
+                # no sheet row for the route any more
+                self.scheduler.retry_later(state)
+                continue
+            outcome = outcomes.pop(route)
+            if isinstance(outcome, Exception):
+                errors.append((f"{state.origin} → {state.destination}", outcome))
+                self.scheduler.retry_later(state)
+            else:
+                interval = self.scheduler.reschedule(state, outcome)
+                logger.debug(f"  {state.origin} → {state.destination}: next refresh in {interval / 60:.0f} min")
+
+        errors.extend(pair_errors)
+        if errors and not self._failure_notified:
+            summary = failure_summary(errors, len(due))
+            print(f" API call failed: {summary}")
+            send_api_failure_notification(self.notifier, self.data_manager, summary)
+            # one failure email until a refresh succeeds again
+            self._failure_notified = True
+        elif not errors:
+            self._failure_notified = False
+
+        self._notify_new_deals(results_by_origin)
+        self.flight_search.price_history.flush()
+        print(f"  API calls: {spent}")
+        return len(due)
+
+    def _notify_new_deals(self, results_by_origin):
+        """email deals that are new or cheaper than the last one sent for the route"""
+        for origin, results in results_by_origin.items():
+            codes = {dest["city"]: dest["iataCode"] for dest in self.destinations if dest.get("iataCode")}
+
+            # a route back above its target may alert again on the next drop
+            for item in results["price_not_met"]:
+                self._notified.pop((origin, codes.get(item["city"])), None)
+
+            new_deals = []
+            for deal in results["found_deals"]:
+                route = (origin, codes.get(deal["destination"]))
+                last_price = self._notified.get(route)
+                if last_price is None or deal["flight"].price < last_price:
+                    new_deals.append(deal)
+                    self._notified[route] = deal["flight"].price
+            if not new_deals:
+                continue
+
+            try:
+                users = self.data_manager.get_user_emails(origin=origin)
+                if not users:
+                    print(f"  No users found for {origin}, skipping notification sending")
+                    continue
+                deals_only = dict(results, found_deals=new_deals, price_not_met=[],
+                                  no_flights_found=[], skipped_destinations=[], errors=[])
+                send_notifications(self.notifier, users, origin, deals_only)
+            except Exception as e:
+                print(f" Fail to notification: {e}")
+
+    def seconds_until_next_refresh(self):
+        """time to sleep before the next route or sheet refresh is due"""
+        waits = [Config.DAEMON_SHEET_REFRESH_HOURS * 3600 - (time.time() - self._sheet_loaded_at)]
+        next_due = self.scheduler.next_due_time()
+        if next_due is not None:
+            # a due route may still have to wait for the budget to refill
+            waits.append(max(next_due - time.time(), self.budget.seconds_until(self._route_cost())))
+        return min(MAX_SLEEP_SECONDS, max(1.0, min(waits)))
+
+    def run(self):
+        """refresh routes until interrupted"""
+        self.load_destinations()
+        while True:
+            if self._sheet_is_stale():
+                try:
+                    self.load_destinations()
+                except Exception as e:
+                    # keep monitoring the routes already known
+                    print(f"Fail to obtain destination: {e}")
+                    self._sheet_loaded_at = time.time()
+
+            with get_metrics().stage("refresh"):
+                refreshed = self.refresh_due_routes()
+            self.flight_search.price_history.maybe_compact()
+            if refreshed:
+                write_run_report(get_metrics())
+            time.sleep(self.seconds_until_next_refresh())
+
+
+def main():
+    """start the monitoring daemon"""
+    Config.setup_logging()
+    print_header("The flight price monitoring daemon has been activated!!")
+
+    try:
+        Config.validate()
+        Config.setup_cache_dirs()
+        print("Configuration verification passed")
+    except Exception as e:
+        print(f"Configuration error: {e}")
+        exit(1)
+
+    try:
+        data_manager = DataManager()
+        flight_search = FlightSearch()
+        notifier = NotificationDispatcher(NotificationManager())
+        daemon = PriceDaemon(data_manager, flight_search, notifier)
+    except Exception as e:
+        print(f"Failed to initialize: {e}")
+        exit(1)
+
+    print(f"   Place of departure: {', '.join(daemon.origins)}")
+    print(f"   API budget: {Config.DAEMON_API_CALLS_PER_HOUR} call/s per hour")
+
+    # expired entries are deleted and the cache kept within CACHE_MAX_ENTRIES
+    flight_search.cache_manager.start_sweeper()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print_header("Stopping the daemon")
+    finally:
+        flight_search.cache_manager.stop_sweeper()
+        flight_search.price_history.flush()
+        flight_search.cache_manager.flush()
+        notifier.drain()
+
+
+if __name__ == "__main__":
+    main()
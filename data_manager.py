@@ -3,8 +3,16 @@
 data manager to interact with Google Sheets via Sheety API
 
 """
-import requests
+import json
+import logging
+import os
+import threading
+import time
 from config import Config
+from http_client import get_http_client
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
 
 class DataManager:
     """Google Sheets manager class"""
@@ -30,55 +38,231 @@ class DataManager:
 
         self.destination_data = []
         self.user_data = []
+        
+        # each sheet is downloaded once per run
+        self._prices_loaded = False
+        self._users_loaded = False
+        self._prices_mirror = {}
+        # when the prices rows were downloaded, kept when the snapshot is rewritten
+        self._prices_fetched_at = None
+        
+        # row id -> fields waiting to be written
+        self._pending_updates = {}
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        
+        # minimum gap between two writes to stay under the Sheety quota
+        writes_per_minute = Config.SHEETY_WRITES_PER_MINUTE
+        self._write_interval = 60 / writes_per_minute if writes_per_minute > 0 else 0
+        self._last_write = 0.0
+        
+        # shared keep-alive connections to Sheety
+        self._http = get_http_client()
     
-    def get_destination_data(self):
+    def get_destination_data(self, refresh=False):
         """
         obtain destination data from Google Sheet
+        the sheet is downloaded once per run unless refresh is True
         return: list of destination data dicts
         """
+        with self._lock:
+            if self._prices_loaded and not refresh:
+                return self.destination_data
+        
+        snapshot = None if refresh else self._read_snapshot("prices")
+        if snapshot is not None:
+            rows, fetched_at = snapshot
+        else:
+            # only loaded when the sheet is actually downloaded
+            import requests
+            try:
+                response = self._timed_request("get_prices", self._http.get, url=self._prices_endpoint, timeout=10)
+                response.raise_for_status()
+                data = response.json()
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Fail to obtain the destination data: {e}")
+            rows, fetched_at = data.get("prices", []), time.time()
+        
+        with self._lock:
+            self.destination_data = rows
+            # mirror of what the sheet holds, used to skip writes that change nothing
+            self._prices_mirror = {row["id"]: dict(row) for row in self.destination_data if "id" in row}
+            self._prices_fetched_at = fetched_at
+            self._prices_loaded = True
+        
+        if snapshot is None:
+            self._write_snapshot("prices", rows, fetched_at)
+        return self.destination_data
+    
+    def _read_snapshot(self, sheet):
+        """
+        rows of a sheet from the local snapshot
+        
+        return: (rows, download time), None when OFFLINE_FIRST is off or the snapshot is missing or stale
+        """
+        if not Config.OFFLINE_FIRST:
+            return None
+        try:
+            with open(Config.SHEET_SNAPSHOT_FILE, 'r') as f:
+                entry = json.load(f).get(sheet)
+        except (OSError, ValueError):
+            return None
+        
+        if not entry or time.time() - entry["fetched_at"] > Config.SHEET_SNAPSHOT_TTL_MINUTES * 60:
+            get_metrics().inc("sheet_snapshots_total", sheet=sheet, result="stale")
+            return None
+        get_metrics().inc("sheet_snapshots_total", sheet=sheet, result="used")
+        return entry["rows"], entry["fetched_at"]
+    
+    def _write_snapshot(self, sheet, rows, fetched_at):
+        """save the rows of a sheet for the next offline-first runs"""
+        if not Config.OFFLINE_FIRST:
+            return
+        path = Config.SHEET_SNAPSHOT_FILE
+        with self._snapshot_lock:
+            try:
+                try:
+                    with open(path, 'r') as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    snapshot = {}
+                snapshot[sheet] = {"fetched_at": fetched_at, "rows": rows}
+                
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                temp_file = f"{path}.tmp"
+                with open(temp_file, 'w') as f:
+                    json.dump(snapshot, f)
+                os.replace(temp_file, path)
+            except OSError as e:
+                logger.warning(f"Failed to save the {sheet} sheet snapshot: {e}")
+    
+    def _timed_request(self, operation, send, **kwargs):
+        """send one Sheety request, recording its latency and status"""
+        import requests
+        metrics = get_metrics()
+        start = time.perf_counter()
         try:
-            response = requests.get(url=self._prices_endpoint, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            self.destination_data = data.get("prices", [])
-            return self.destination_data
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Fail to obtain the destination data: {e}")
+            response = send(**kwargs)
+        except requests.exceptions.RequestException:
+            metrics.inc("sheety_requests_total", operation=operation, status="error")
+            raise
+        finally:
+            metrics.observe("sheety_request_seconds", time.perf_counter() - start, operation=operation)
+        metrics.inc("sheety_requests_total", operation=operation, status=response.status_code)
+        return response
     
     def update_destination_code(self, row_id: int, iata_code: str) -> None:
         """
-        update the IATA code for a destination in Google Sheet
+        queue an IATA code update for a destination in Google Sheet
+        pending updates are written by flush_updates()
         
         parameters:
             row_id: ID of the row to update
             iata_code: code to update
         """
-        new_data = {
-            "price": {
-                "iataCode": iata_code
-            }
-        }
-        try:
-            response = requests.put(
-                url=f"{self._prices_endpoint}/{row_id}",
-                json=new_data,
-                timeout=10
-            )
-            response.raise_for_status()
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Fail to update IATA code: {e}")
+        with self._lock:
+            self._pending_updates.setdefault(row_id, {})["iataCode"] = iata_code
     
-    def get_user_emails(self):
+    def _wait_for_write_slot(self):
+        """sleep just long enough to stay under the Sheety write quota"""
+        if self._write_interval <= 0:
+            return
+        wait = self._last_write + self._write_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_write = time.monotonic()
+    
+    def flush_updates(self) -> int:
+        """
+        write all pending row updates to Google Sheet
+        fields whose value already matches the sheet are not sent
+        
+        return: number of rows written
+        """
+        with self._lock:
+            pending = self._pending_updates
+            self._pending_updates = {}
+        if not pending:
+            return 0
+        
+        import requests
+        written = 0
+        for position, (row_id, fields) in enumerate(pending.items()):
+            current = self._prices_mirror.get(row_id, {})
+            changed = {key: value for key, value in fields.items() if current.get(key) != value}
+            if not changed:
+                continue
+            
+            self._wait_for_write_slot()
+            try:
+                response = self._timed_request(
+                    "update_price", self._http.put,
+                    url=f"{self._prices_endpoint}/{row_id}",
+                    json={"price": changed},
+                    timeout=10
+                )
+                response.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                # keep the rows that were not written for the next flush
+                with self._lock:
+                    for row_id_left, fields_left in list(pending.items())[position:]:
+                        self._pending_updates.setdefault(row_id_left, {}).update(fields_left)
+                raise Exception(f"Fail to update IATA code: {e}")
+            
+            with self._lock:
+                self._prices_mirror.setdefault(row_id, {}).update(changed)
+            written += 1
+        
+        if written:
+            # the snapshot holds what the sheet holds now
+            with self._lock:
+                rows = [dict(row) for row in self._prices_mirror.values()]
+            self._write_snapshot("prices", rows, self._prices_fetched_at or time.time())
+        return written
+    
+    @staticmethod
+    def _emails_for(users, origin):
+        """emails of users following origin; users without an origin follow every origin"""
+        emails = []
+        for user in users:
+            if "email" not in user:
+                continue
+            user_origin = str(user.get("origin") or "").strip().upper()
+            if origin is None or not user_origin or user_origin == origin.upper():
+                emails.append(user["email"])
+        return emails
+    
+    def get_user_emails(self, refresh=False, origin=None):
         """
         obtain user emails from Google Sheet
+        the sheet is downloaded once per run unless refresh is True
+        
+        parameters:
+            origin: only return users whose optional "origin" column is empty
+                    or equals this IATA code (None = every user)
         return: list of user email strings
         """
-        try:
-            response = requests.get(url=self._users_endpoint, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            self.user_data = data.get("users", [])
-            emails = [user["email"] for user in self.user_data if "email" in user]
-            return emails
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Fail to obatin requests: {e}")
+        with self._lock:
+            if self._users_loaded and not refresh:
+                return self._emails_for(self.user_data, origin)
+        
+        snapshot = None if refresh else self._read_snapshot("users")
+        if snapshot is not None:
+            users = snapshot[0]
+        else:
+            import requests
+            try:
+                response = self._timed_request("get_users", self._http.get, url=self._users_endpoint, timeout=10)
+                response.raise_for_status()
+                data = response.json()
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Fail to obatin requests: {e}")
+            users = data.get("users", [])
+            self._write_snapshot("users", users, time.time())
+        
+        with self._lock:
+            self.user_data = users
+            self._users_loaded = True
+            return self._emails_for(self.user_data, origin)
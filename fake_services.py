@@ -0,0 +1,315 @@
+# fake_services.py
+"""
+fake_services.py
+local stand-ins for the Amadeus, Sheety and SMTP services, used by benchmark.py
+"""
+import json
+import random
+import socketserver
+import string
+import threading
+import time
+import zlib
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _stable_number(*parts):
+    """same number for the same inputs on every run"""
+    return zlib.crc32("|".join(str(part) for part in parts).encode("utf-8"))
+
+
+def fake_iata_code(number):
+    """three-letter code for a number, AAA, AAB, ..."""
+    letters = []
+    for _ in range(3):
+        number, remainder = divmod(number, 26)
+        letters.append(string.ascii_uppercase[remainder])
+    return "".join(reversed(letters))
+
+
+def make_sheet(size, missing_code_ratio=0.1, seed=1):
+    """
+    build Sheety price rows for a benchmark
+
+    parameters:
+        size: number of destinations
+        missing_code_ratio: share of rows without an IATA code, looked up through the API
+    return: list of row dicts as the Sheety prices endpoint returns them
+    """
+    generator = random.Random(seed)
+    rows = []
+    for index in range(size):
+        rows.append({
+            "id": index + 2,
+            "city": f"Bench City {index}",
+            "iataCode": "" if generator.random() < missing_code_ratio else fake_iata_code(index),
+            "lowestPrice": generator.randrange(100, 1100),
+        })
+    return rows
+
+
+class _FakeServer(ThreadingHTTPServer):
+    """HTTP server with simulated latency, failures and quota, counting requests per endpoint"""
+
+    daemon_threads = True
+
+    def __init__(self, handler, latency=0.0, error_rate=0.0, seed=1, rate_limit=0):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        # requests per second answered before 429s are returned (0 = no limit)
+        self.rate_limit = rate_limit
+        self._recent = deque()
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, endpoint):
+        with self._lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def total(self):
+        with self._lock:
+            return sum(self.counts.values())
+
+    def over_limit(self):
+        """True when more than rate_limit requests came in during the last second"""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                self.throttled += 1
+                return True
+            self._recent.append(now)
+            return False
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _JsonHandler(BaseHTTPRequestHandler):
+    """shared helpers of the fake HTTP services"""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _simulate(self, endpoint):
+        """count the request, wait the configured latency, return False when it should fail"""
+        self.server.count(endpoint)
+        if self.server.over_limit():
+            self._send_json(429, {"errors": [{"detail": "simulated quota"}]}, {"Retry-After": "1"})
+            return False
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.should_fail():
+            self._send_json(500, {"errors": [{"detail": "simulated failure"}]})
+            return False
+        return True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _AmadeusHandler(_JsonHandler):
+
+    def do_POST(self):
+        self._read_body()
+        if urlparse(self.path).path != "/v1/security/oauth2/token":
+            self._send_json(404, {})
+            return
+        if self._simulate("token"):
+            self._send_json(200, {"access_token": f"fake-{time.time()}", "expires_in": 1799})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/v1/reference-data/locations/cities":
+            if self._simulate("cities"):
+                keyword = params.get("keyword", "")
+                code = fake_iata_code(_stable_number(keyword) % (26 ** 3))
+                self._send_json(200, {"data": [{"name": keyword, "iataCode": code}]})
+        elif url.path == "/v2/shopping/flight-offers":
+            if self._simulate("flight-offers"):
+                self._send_json(200, {"data": self._offers(params)})
+        else:
+            self._send_json(404, {})
+
+    @staticmethod
+    def _offers(params):
+        """deterministic offers for a route and date pair, none for one route in ten"""
+        origin = params["originLocationCode"]
+        destination = params["destinationLocationCode"]
+        departure = params["departureDate"]
+        arrival = params.get("returnDate") or departure
+        base = _stable_number(origin, destination, departure, arrival)
+        if _stable_number(origin, destination) % 10 == 0:
+            return []
+
+        offers = []
+        for number in range(min(int(params.get("max", 1)), 50)):
+            stops = 0 if params.get("nonStop") == "true" else number % 3
+
+            def itinerary(day, start, end):
+                segments = [{
+                    "departure": {"iataCode": start, "at": f"{day}T08:00:00"},
+                    "arrival": {"iataCode": end if not stops else "HUB"},
+                    "carrierCode": ["QF", "VA", "JQ"][(base + number) % 3],
+                    "number": str(100 + (base + number) % 900),
+                }]
+                for _ in range(stops):
+                    segments.append({
+                        "departure": {"iataCode": "HUB", "at": f"{day}T14:00:00"},
+                        "arrival": {"iataCode": end},
+                        "carrierCode": "QF",
+                        "number": "1",
+                    })
+                segments[-1]["arrival"]["iataCode"] = end
+                return {"duration": f"PT{2 + 3 * stops}H", "segments": segments}
+
+            offers.append({
+                "price": {"total": f"{100 + (base + number * 37) % 1000:.2f}"},
+                "itineraries": [itinerary(departure, origin, destination), itinerary(arrival, destination, origin)],
+            })
+        return offers
+
+
+class _SheetyHandler(_JsonHandler):
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/prices":
+            if self._simulate("prices"):
+                self._send_json(200, {"prices": self.server.rows})
+        elif path == "/users":
+            if self._simulate("users"):
+                self._send_json(200, {"users": self.server.users})
+        else:
+            self._send_json(404, {})
+
+    def do_PUT(self):
+        body = json.loads(self._read_body() or b"{}")
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) != 2 or parts[0] != "prices":
+            self._send_json(404, {})
+            return
+        if not self._simulate("update"):
+            return
+        row_id = int(parts[1])
+        with self.server.rows_lock:
+            for row in self.server.rows:
+                if row["id"] == row_id:
+                    row.update(body.get("price", {}))
+                    self._send_json(200, {"price": row})
+                    return
+        self._send_json(404, {})
+
+
+class FakeAmadeus(_FakeServer):
+    """OAuth token, city search and flight-offers endpoints"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=1, rate_limit=0):
+        super().__init__(_AmadeusHandler, latency, error_rate, seed, rate_limit)
+
+
+class FakeSheety(_FakeServer):
+    """prices and users sheets, url/prices and url/users"""
+
+    def __init__(self, rows, users, latency=0.0, error_rate=0.0, seed=1):
+        super().__init__(_SheetyHandler, latency, error_rate, seed)
+        self.rows = rows
+        self.rows_lock = threading.Lock()
+        self.users = users
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    """just enough SMTP for smtplib, without AUTH or STARTTLS"""
+
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self._reply("220 fake-smtp ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip().upper()
+            if command.startswith(("EHLO", "HELO")):
+                self._reply("250 fake-smtp")
+            elif command.startswith(("MAIL", "RCPT", "RSET", "NOOP")):
+                self._reply("250 OK")
+            elif command == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b".\r\n", b""):
+                        break
+                    size += len(data_line)
+                self.server.record_message(size)
+                self._reply("250 OK queued")
+            elif command == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class FakeSmtp(socketserver.ThreadingTCPServer):
+    """SMTP server that accepts and counts every message"""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SmtpHandler)
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.bytes = 0
+
+    def record_message(self, size):
+        with self._lock:
+            self.messages += 1
+            self.bytes += size
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
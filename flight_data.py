@@ -1,48 +1,170 @@
-
 """
 flight_data.py
 save flight data structure
 """
+import struct
+from collections import namedtuple
+from datetime import date
+
+# price, flags, stops, outbound date ordinal, return date ordinal (0 = no date)
+_HEADER = struct.Struct("<dBbii")
+_LENGTH = struct.Struct("<H")
+_COUNT = struct.Struct("<I")
+# string length written for None
+_NONE_LENGTH = 0xFFFF
+# longer strings are cut to this many bytes, their length would read as None or not fit
+_MAX_TEXT_LENGTH = _NONE_LENGTH - 1
+
+# flags
+_DEFAULT_LINK = 1   # booking link is the Google Flights link, rebuilt when decoding
+_NO_LINK = 2
+
+
+def _date_ordinal(text):
+    return date.fromisoformat(text).toordinal() if text else 0
+
+
+def _ordinal_date(ordinal):
+    return date.fromordinal(ordinal).isoformat() if ordinal else None
+
+
+def _google_flights_link(origin_airport, destination_airport, out_date):
+    # Google Flights URL format
+    return (f"https://www.google.com/travel/flights?"
+            f"q=Flights%20from%20{origin_airport}%20to%20"
+            f"{destination_airport}%20on%20{out_date}")
+
+
+def _pack_text(text):
+    if text is None:
+        return _LENGTH.pack(_NONE_LENGTH)
+    encoded = str(text).encode("utf-8")
+    if len(encoded) > _MAX_TEXT_LENGTH:
+        # cut on a character boundary so the rest still decodes
+        encoded = encoded[:_MAX_TEXT_LENGTH].decode("utf-8", "ignore").encode("utf-8")
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_text(buffer, offset):
+    (length,) = _LENGTH.unpack_from(buffer, offset)
+    offset += _LENGTH.size
+    if length == _NONE_LENGTH:
+        return None, offset
+    return bytes(buffer[offset:offset + length]).decode("utf-8"), offset + length
+
+
+class FlightData(namedtuple(
+    "FlightData",
+    ["price", "origin_airport", "destination_airport", "out_date", "return_date",
+     "airline", "flight_number", "stops", "booking_link"],
+    defaults=(None, None, 0, None)
+)):
+    """
+    save flight data structure
+
+    immutable, without a per-instance __dict__; fields:
+        price: flight price
+        origin_airport: origin airport code
+        destination_airport: destination airport code
+        out_date: outbound date
+        return_date: return date
+        airline: airline name
+        flight_number: flight number
+        stops: number of stops on the outbound flight
+        booking_link: URL for booking
+    """
+
+    __slots__ = ()
 
-class FlightData:
-    """save flight data structure"""
-    
-    def __init__(self, price, origin_airport, destination_airport, out_date, return_date, 
-                 airline=None, flight_number=None, stops=0, booking_link=None):
-        """
-        initialize flight data
-        
-        parameters:
-            price: flight price
-            origin_airport: origin airport code
-            destination_airport: destination airport code
-            out_date: outbound date
-            return_date: return date
-            airline: airline name
-            flight_number: flight number        
-        """
-        self.price = price
-        self.origin_airport = origin_airport
-        self.destination_airport = destination_airport
-        self.out_date = out_date
-        self.return_date = return_date
-        self.airline = airline
-        self.flight_number = flight_number
-        self.stops = stops
-        self.booking_link = booking_link
-    
     def __str__(self):
         """return string representation of flight data"""
         flight_type = "Direct flight" if self.stops == 0 else f"{self.stops} connecting flights"
         airline_info = f" | {self.airline}" if self.airline else ""
-        
+
         return (f"Flight information: ${self.price}{airline_info} | "
                 f"{self.origin_airport} → {self.destination_airport} | "
                 f"{self.out_date} to {self.return_date} | {flight_type}")
-    
+
+    def to_dict(self):
+        """return the flight fields as a JSON-friendly dict"""
+        return dict(self._asdict())
+
+    @classmethod
+    def from_dict(cls, data):
+        """build a flight from a dict made by to_dict (unknown keys are ignored)"""
+        return cls(**{field: data[field] for field in cls._fields if field in data})
+
+    def to_bytes(self):
+        """compact binary form, about a tenth of the JSON size"""
+        if self.booking_link is None:
+            flags = _NO_LINK
+        elif self.booking_link == self.get_google_flights_link():
+            flags = _DEFAULT_LINK
+        else:
+            flags = 0
+
+        parts = [
+            _HEADER.pack(
+                float(self.price), flags, int(self.stops or 0),
+                _date_ordinal(self.out_date), _date_ordinal(self.return_date)
+            ),
+            _pack_text(self.origin_airport),
+            _pack_text(self.destination_airport),
+            _pack_text(self.airline),
+            _pack_text(self.flight_number),
+        ]
+        if not flags:
+            parts.append(_pack_text(self.booking_link))
+        return b"".join(parts)
+
+    @classmethod
+    def decode_from(cls, buffer, offset=0):
+        """
+        read one flight written by to_bytes
+
+        return: (FlightData, offset just after it)
+        """
+        price, flags, stops, out_ordinal, return_ordinal = _HEADER.unpack_from(buffer, offset)
+        offset += _HEADER.size
+        origin_airport, offset = _unpack_text(buffer, offset)
+        destination_airport, offset = _unpack_text(buffer, offset)
+        airline, offset = _unpack_text(buffer, offset)
+        flight_number, offset = _unpack_text(buffer, offset)
+        out_date = _ordinal_date(out_ordinal)
+        booking_link = None
+        if flags & _DEFAULT_LINK:
+            booking_link = _google_flights_link(origin_airport, destination_airport, out_date)
+        elif not flags:
+            booking_link, offset = _unpack_text(buffer, offset)
+
+        flight = cls(
+            price, origin_airport, destination_airport, out_date, _ordinal_date(return_ordinal),
+            airline, flight_number, stops, booking_link
+        )
+        return flight, offset
+
+    @classmethod
+    def from_bytes(cls, data):
+        """build a flight from the output of to_bytes"""
+        return cls.decode_from(data)[0]
+
+    @classmethod
+    def encode_many(cls, flights):
+        """pack a list of flights into one bytes object"""
+        return _COUNT.pack(len(flights)) + b"".join(flight.to_bytes() for flight in flights)
+
+    @classmethod
+    def decode_many(cls, data):
+        """unpack the output of encode_many"""
+        view = memoryview(data)
+        (count,) = _COUNT.unpack_from(view, 0)
+        offset = _COUNT.size
+        flights = []
+        for _ in range(count):
+            flight, offset = cls.decode_from(view, offset)
+            flights.append(flight)
+        return flights
+
     def get_google_flights_link(self):
         """return the Google Flights booking link"""
-        # Google Flights URL format
-        return (f"https://www.google.com/travel/flights?"
-                f"q=Flights%20from%20{self.origin_airport}%20to%20"
-                f"{self.destination_airport}%20on%20{self.out_date}")
+        return _google_flights_link(self.origin_airport, self.destination_airport, self.out_date)
@@ -3,11 +3,22 @@
 flight_search.py
 use Amadeus API to search for flights
 """
-import requests
 # from datetime import datetime
+import logging
+import threading
+import time
 from flight_data import FlightData
 from config import Config
-from cache_manager import CacheManager
+from cache_manager import CacheManager, FlightQuery
+from coalescer import SingleFlight
+from http_client import get_http_client
+from token_manager import TokenManager
+from city_index import CityIndex
+from offer_table import OfferTable, iter_json_array
+from price_history import PriceHistory
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
 
 class FlightSearch:
     """use Amadeus API to search for flights"""
@@ -31,17 +42,44 @@ class FlightSearch:
         # initialize cache manager
         self.cache_manager = CacheManager()
         
-        # obtain access token
-        self._token = self._get_new_token()
+        # every price returned by the API is kept here
+        self.price_history = PriceHistory()
+        
+        # offline city -> IATA lookup, loaded on first use
+        self.city_index = CityIndex()
+        
+        # shared keep-alive connections to Amadeus
+        self._http = get_http_client()
+        
+        # number of Amadeus search and lookup calls made so far
+        self.api_calls = 0
+        self._counter_lock = threading.Lock()
+        self._metrics = get_metrics()
+        
+        # identical searches and city lookups running at the same time share one API call
+        self._flight_calls = SingleFlight("flight_search")
+        self._city_calls = SingleFlight("city_lookup")
+        
+        # stale cached answers being searched again in the background
+        self._refresher = None
+        self._refreshing = set()
+        
+        # access token is fetched on the first real API call, then reused
+        self._tokens = TokenManager(self._get_new_token, client_id=api_key)
+        
+        # stopovers are only allowed when multi-offer search picks the best offer
+        self._non_stop = not Config.MULTI_OFFER_SEARCH or Config.MAX_STOPS == 0
         
         # API endpoints
-        self._search_endpoint = "https://test.api.amadeus.com/v2/shopping/flight-offers"
-        self._city_search_endpoint = "https://test.api.amadeus.com/v1/reference-data/locations/cities"
+        self._token_endpoint = f"{Config.AMADEUS_BASE_URL}/v1/security/oauth2/token"
+        self._search_endpoint = f"{Config.AMADEUS_BASE_URL}/v2/shopping/flight-offers"
+        self._city_search_endpoint = f"{Config.AMADEUS_BASE_URL}/v1/reference-data/locations/cities"
     
     # get new access token
     def _get_new_token(self):
         """obtain new access token from Amadeus API"""
-        print("Obtaining new access token from Amadeus API...")
+        logger.info("Obtaining new access token from Amadeus API...")
+        self._metrics.inc("amadeus_token_refreshes_total")
         
         header = {"Content-Type": "application/x-www-form-urlencoded"}
         body = {
@@ -51,30 +89,99 @@ class FlightSearch:
         }
         
         try:
-            response = requests.post(
-                url="https://test.api.amadeus.com/v1/security/oauth2/token",
+            response = self._timed_request(
+                "token", self._http.post,
+                url=self._token_endpoint,
                 headers=header,
                 data=body,
                 timeout=10
             )
             response.raise_for_status()
-            token = response.json()["access_token"]
-            print("Succeed!")
-            return token
+            data = response.json()
+            logger.info("Succeed!")
+            return data["access_token"], data.get("expires_in", 1799)
         except Exception as e:
             raise Exception(f"Failed to obtain the token: {e}")
     
+    def _count_api_call(self):
+        """count one Amadeus call, searches run on several threads"""
+        with self._counter_lock:
+            self.api_calls += 1
+    
+    def _timed_request(self, endpoint, send, **kwargs):
+        """send one Amadeus request, recording its latency and status"""
+        start = time.perf_counter()
+        try:
+            response = send(**kwargs)
+        except Exception:
+            self._metrics.inc("amadeus_requests_total", endpoint=endpoint, status="error")
+            raise
+        finally:
+            self._metrics.observe("amadeus_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        self._metrics.inc("amadeus_requests_total", endpoint=endpoint, status=response.status_code)
+        return response
+    
+    def _authorized_get(self, url, params, timeout, stream=False):
+        """send an authenticated GET, renewing the token once on 401"""
+        endpoint = url.rsplit("/", 1)[-1]
+        token = self._tokens.get_token()
+        self._count_api_call()
+        response = self._timed_request(
+            endpoint, self._http.get,
+            url=url,
+            headers={"Authorization": f"Bearer {token}"},
+            params=params,
+            timeout=timeout,
+            stream=stream
+        )
+        
+        if response.status_code == 401:
+            logger.warning("Access token was rejected, renewing it...")
+            response.close()
+            token = self._tokens.refresh(token)
+            self._count_api_call()
+            response = self._timed_request(
+                endpoint, self._http.get,
+                url=url,
+                headers={"Authorization": f"Bearer {token}"},
+                params=params,
+                timeout=timeout,
+                stream=stream
+            )
+        
+        return response
+    
+    @property
+    def calls_saved(self):
+        """number of API calls avoided by sharing an identical call already in flight"""
+        return self._flight_calls.coalesced + self._city_calls.coalesced
+    
     def get_destination_code(self, city_name):
         """get IATA code for a city (with caching)"""
+        # "New York", "new york " and "NEW  YORK" are the same lookup
+        key = " ".join(city_name.split()).casefold()
+        return self._city_calls.do(key, self._lookup_destination_code, city_name)
+    
+    def _lookup_destination_code(self, city_name):
+        """find the IATA code of a city in the cache, the offline dataset or the API"""
         # check cache first
         cached_code = self.cache_manager.load_iata_code(city_name)
         if cached_code:
-            print(f"IATA code of {city_name}: {cached_code}")
+            logger.debug(f"IATA code of {city_name}: {cached_code}")
+            self._metrics.inc("iata_lookups_total", source="cache")
             return cached_code
         
-        print(f"Searching for IATA code of {city_name}...")
+        # then the bundled reference dataset, the API is the last resort
+        local_code = self.city_index.resolve(city_name)
+        if local_code:
+            logger.debug(f"IATA code of {city_name}: {local_code}")
+            self._metrics.inc("iata_lookups_total", source="dataset")
+            self.cache_manager.save_iata_code(city_name, local_code)
+            return local_code
+        
+        logger.debug(f"Searching for IATA code of {city_name}...")
+        self._metrics.inc("iata_lookups_total", source="api")
         
-        headers = {"Authorization": f"Bearer {self._token}"}
         params = {
             "keyword": city_name,
             "max": "1",
@@ -82,12 +189,7 @@ class FlightSearch:
         }
         # testing purpose: limit to 1 result
         try:
-            response = requests.get(
-                url=self._city_search_endpoint,
-                headers=headers,
-                params=params,
-                timeout=10
-            )
+            response = self._authorized_get(self._city_search_endpoint, params, timeout=10)
             response.raise_for_status()
             # parse response
             data = response.json()
@@ -97,65 +199,243 @@ class FlightSearch:
                 self.cache_manager.save_iata_code(city_name, code)
                 return code
             else:
-                print(f"Fail to find IATA code of {city_name}")
+                logger.warning(f"Fail to find IATA code of {city_name}")
                 return None
                 
         except Exception as e:
-            print(f"Fail to find IATA code: {e}")
+            logger.error(f"Fail to find IATA code: {e}")
             raise  # for search exception handling
     
-    def search_flights(self, origin_city_code, destination_city_code, from_time, to_time):
-        """search for flights"""
-        # check cache first
-        cached_flight = self.cache_manager.load_flight_data(
-            origin_city_code,
-            destination_city_code
+    def search_flights(self, origin_city_code, destination_city_code, from_time, to_time, max_age_hours=None):
+        """
+        search for flights
+        
+        parameters:
+            max_age_hours: oldest cached answer accepted (default CACHE_EXPIRY_HOURS)
+        """
+        query = FlightQuery.create(
+            origin_city_code, destination_city_code, from_time, to_time, non_stop=self._non_stop
+        )
+        
+        # check cache first, a cached None means no flights were found
+        cached = self._cached([query], max_age_hours)
+        if query in cached:
+            return cached[query]
+        
+        return self._fetch_flight(query)
+    
+    def search_window(self, origin_city_code, destination_city_code, date_pairs, max_age_hours=None):
+        """
+        search several (departure, return) date pairs for one route
+        
+        pairs already answered by the cache are reused, only the others hit the API
+        
+        parameters:
+            max_age_hours: oldest cached answer accepted (default CACHE_EXPIRY_HOURS)
+        return: dict of (departure_date, return_date) -> FlightData or None
+        """
+        hits, missing = self.cached_results(
+            [(origin_city_code, destination_city_code)], date_pairs, max_age_hours
         )
         
-        if cached_flight:
-            # reconstruct FlightData object from cached data for return
-            return FlightData(
-                price=cached_flight["price"],
-                origin_airport=cached_flight["origin_airport"],
-                destination_airport=cached_flight["destination_airport"],
-                out_date=cached_flight["out_date"],
-                return_date=cached_flight["return_date"],
-                airline=cached_flight.get("airline"),
-                flight_number=cached_flight.get("flight_number"),
-                stops=cached_flight.get("stops", 0),
-                booking_link=cached_flight.get("booking_link")
+        results = {pair: flight for (_, pair), flight in hits.items()}
+        results.update(self.fetch_window(origin_city_code, destination_city_code, [pair for _, pair in missing]))
+        return results
+    
+    def cached_results(self, routes, date_pairs, max_age_hours=None):
+        """
+        look up every route × date pair in the cache with one batched query
+        
+        parameters:
+            routes: list of (origin, destination code)
+            date_pairs: list of (departure_date, return_date)
+            max_age_hours: oldest cached answer accepted (default CACHE_EXPIRY_HOURS)
+        return: (dict of (route, (departure_date, return_date)) -> FlightData or None,
+                 list of (route, (departure_date, return_date)) not in the cache)
+        """
+        keys = {}
+        for route in routes:
+            for departure_date, return_date in date_pairs:
+                query = FlightQuery.create(
+                    route[0], route[1], departure_date, return_date, non_stop=self._non_stop
+                )
+                keys[query] = (route, (query.departure_date, query.return_date))
+        
+        found = self._cached(keys, max_age_hours)
+        hits = {keys[query]: flight for query, flight in found.items()}
+        missing = [key for query, key in keys.items() if query not in found]
+        return hits, missing
+    
+    def _cached(self, queries, max_age_hours=None):
+        """
+        cached answers for queries
+        
+        with CACHE_STALE_HOURS an answer that expired recently is served as well
+        and searched again in the background; an explicit max_age_hours asks for
+        answers at least that fresh, so nothing stale is served then
+        
+        return: dict of FlightQuery -> FlightData or None
+        """
+        if max_age_hours is not None or self.cache_manager.stale_hours <= 0:
+            return self.cache_manager.get_many(queries, max_age_hours)
+        
+        found, stale = self.cache_manager.get_many_stale(queries)
+        if stale:
+            self._refresh_in_background(stale)
+        return found
+    
+    def _refresh_in_background(self, queries):
+        """search stale queries again on the refresh workers, each query once at a time"""
+        from concurrent.futures import ThreadPoolExecutor
+        
+        with self._counter_lock:
+            queries = [query for query in queries if query not in self._refreshing]
+            self._refreshing.update(queries)
+            if queries and self._refresher is None:
+                self._refresher = ThreadPoolExecutor(
+                    max_workers=max(1, Config.CACHE_REFRESH_WORKERS), thread_name_prefix="cache-refresh"
+                )
+            for query in queries:
+                self._refresher.submit(self._refresh, query)
+    
+    def _refresh(self, query):
+        """search one stale query again, the answer replaces the cached one"""
+        try:
+            self._fetch_flight(query)
+            self._metrics.inc("cache_refreshes_total", status="ok")
+        except Exception as e:
+            self._metrics.inc("cache_refreshes_total", status="error")
+            logger.warning(f"Background refresh of {query.origin} → {query.destination} failed: {e}")
+        finally:
+            with self._counter_lock:
+                self._refreshing.discard(query)
+    
+    def wait_for_refreshes(self):
+        """
+        wait for the background refreshes started so far
+        
+        return: number of refreshes that were still running or queued
+        """
+        with self._counter_lock:
+            refresher, self._refresher = self._refresher, None
+            pending = len(self._refreshing)
+        if refresher is not None:
+            refresher.shutdown(wait=True)
+        return pending
+    
+    def fetch_window(self, origin_city_code, destination_city_code, date_pairs):
+        """
+        search date pairs with the API without looking at the cache first
+        
+        return: dict of (departure_date, return_date) -> FlightData or None
+        """
+        results = {}
+        for departure_date, return_date in date_pairs:
+            query = FlightQuery.create(
+                origin_city_code, destination_city_code, departure_date, return_date, non_stop=self._non_stop
             )
+            results[(departure_date, return_date)] = self._fetch_flight(query)
+        return results
+    
+    def search_offers(self, query, max_offers=None):
+        """
+        request many offers for a query and store them in an OfferTable
+        
+        the response is parsed while it streams in, one offer at a time
         
-        print(f"Searching flight from {origin_city_code} to {destination_city_code} ...")
+        parameters:
+            query: FlightQuery to search
+            max_offers: number of offers to request (API maximum 250)
+        return: OfferTable with every returned offer
+        """
+        params = {
+            "originLocationCode": query.origin,
+            "destinationLocationCode": query.destination,
+            "departureDate": query.departure_date,
+            "returnDate": query.return_date,
+            "adults": query.adults,
+            "nonStop": "true" if query.non_stop else "false",
+            "currencyCode": query.currency,
+            "max": str(max_offers or Config.MAX_OFFERS)
+        }
+        
+        response = self._authorized_get(self._search_endpoint, params, timeout=15, stream=True)
+        try:
+            if response.status_code != 200:
+                logger.error(f"Fail to use API: {response.status_code}")
+                raise Exception(f"API error: {response.status_code} - {response.text}")
+            
+            return OfferTable.from_offers(
+                iter_json_array(response.iter_content(chunk_size=64 * 1024), key="data")
+            )
+        finally:
+            response.close()
+    
+    def _fetch_best_offer(self, query):
+        """pick the best of many offers for a query and cache it"""
+        logger.debug(f"Searching offers from {query.origin} to {query.destination} ...")
+        try:
+            table = self.search_offers(query)
+            best = table.best(
+                max_stops=Config.MAX_STOPS,
+                carriers=Config.PREFERRED_CARRIERS or None,
+                exclude_carriers=Config.EXCLUDED_CARRIERS,
+                max_duration=Config.MAX_DURATION_HOURS * 60 if Config.MAX_DURATION_HOURS else None
+            )
+            
+            if best is None:
+                logger.debug(f"No matching flights found from {query.origin} to {query.destination} "
+                      f"({len(table)} offer/s checked)")
+                self.cache_manager.save_flight_data(query, None)
+                return None
+            
+            flight_data = table.to_flight_data(best)
+            self.cache_manager.save_flight_data(query, flight_data)
+            self.price_history.record(query.origin, query.destination, flight_data)
+            return flight_data
+        
+        except Exception as e:
+            logger.error(f"Fail to search: {e}")
+            raise  # for search exception handling
+    
+    def _fetch_flight(self, query):
+        """search the Amadeus API for a query and cache the answer, once for identical queries in flight"""
+        return self._flight_calls.do(query, self._search_flight, query)
+    
+    def _search_flight(self, query):
+        """search the Amadeus API for a query and cache the answer"""
+        if Config.MULTI_OFFER_SEARCH:
+            return self._fetch_best_offer(query)
+        
+        origin_city_code = query.origin
+        destination_city_code = query.destination
+        
+        logger.debug(f"Searching flight from {origin_city_code} to {destination_city_code} ...")
         # prepare request
-        headers = {"Authorization": f"Bearer {self._token}"}
         params = {
             "originLocationCode": origin_city_code,
             "destinationLocationCode": destination_city_code,
-            "departureDate": from_time.strftime("%Y-%m-%d"),
-            "returnDate": to_time.strftime("%Y-%m-%d"),
-            "adults": 1,
-            "nonStop": "true",
-            "currencyCode": Config.CURRENCY_CODE,
+            "departureDate": query.departure_date,
+            "returnDate": query.return_date,
+            "adults": query.adults,
+            "nonStop": "true" if query.non_stop else "false",
+            "currencyCode": query.currency,
             "max": "1"
         }
         # testing purpose: limit to 1 result
         try:
-            response = requests.get(
-                url=self._search_endpoint,
-                headers=headers,
-                params=params,
-                timeout=15
-            )
+            response = self._authorized_get(self._search_endpoint, params, timeout=15)
             
             if response.status_code != 200:
-                print(f"Fail to use API: {response.status_code}")
+                logger.error(f"Fail to use API: {response.status_code}")
                 raise Exception(f"API error: {response.status_code} - {response.text}")
             
             data = response.json()
             
             if not data.get("data"):
-                print(f"No flights found from {origin_city_code} to {destination_city_code}")
+                logger.debug(f"No flights found from {origin_city_code} to {destination_city_code}")
+                # remember the empty answer so the same dates are not searched again
+                self.cache_manager.save_flight_data(query, None)
                 return None
             
             # parse flight data
@@ -200,11 +480,12 @@ class FlightSearch:
                 booking_link=booking_link
             )
 
-            # save to cache
-            self.cache_manager.save_flight_data(origin_city_code, destination_city_code, flight_data)
+            # save to cache and history
+            self.cache_manager.save_flight_data(query, flight_data)
+            self.price_history.record(query.origin, query.destination, flight_data)
 
             return flight_data
             
         except Exception as e:
-            print(f"Fail to search: {e}")
+            logger.error(f"Fail to search: {e}")
             raise  # for search exception handling
@@ -0,0 +1,130 @@
+# http_client.py
+"""
+http_client.py
+shared pooled HTTP transport for the Amadeus and Sheety APIs
+"""
+import threading
+from urllib.parse import urlsplit
+from config import Config
+from rate_governor import RateGovernor
+
+
+class HttpClient:
+    """keep one pooled keep-alive session per host with bounded retries"""
+
+    # transient server errors worth retrying
+    RETRY_STATUSES = (500, 502, 503, 504)
+
+    def __init__(self, pool_size=None, max_retries=None, backoff_factor=None):
+        """
+        initialize HTTP client
+
+        parameters:
+            pool_size: max number of open connections kept per host
+            max_retries: max number of retries for a single request
+            backoff_factor: base delay (seconds) of the exponential backoff
+        """
+        self.pool_size = pool_size or Config.HTTP_POOL_SIZE
+        self.max_retries = Config.HTTP_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = Config.HTTP_BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+
+        self._sessions = {}
+        self._lock = threading.Lock()
+        # per-host pacing and circuit breaking shared by every caller
+        self.governor = RateGovernor()
+
+    def _build_session(self):
+        """create a session with a tuned connection pool and retry policy"""
+        # imported on first use, runs answered from local data never load requests
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            # token, search, sheet reads and row updates are all safe to repeat
+            allowed_methods=frozenset({"GET", "PUT", "POST"}),
+            raise_on_status=False,
+            # a 429 with Retry-After goes back to request(), where the governor slows the host down
+            respect_retry_after_header=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=retry,
+        )
+
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def session_for(self, url):
+        """return the shared session for the host of url"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._build_session()
+                self._sessions[host] = session
+            return session
+
+    def request(self, method, url, **kwargs):
+        """
+        send a request through the pooled session of its host
+
+        the request waits for the host's rate limit; a 429 slows the host down and
+        is retried after its Retry-After delay, up to max_retries times
+        """
+        host = urlsplit(url).netloc
+        attempt = 0
+        while True:
+            self.governor.before_request(host)
+            try:
+                response = self.session_for(url).request(method, url, **kwargs)
+            except Exception:
+                self.governor.record_error(host)
+                raise
+            self.governor.record_response(host, response.status_code, response.headers.get("Retry-After"))
+
+            if response.status_code != 429 or attempt >= self.max_retries:
+                return response
+            response.close()
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        """send a GET request"""
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """send a POST request"""
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """send a PUT request"""
+        return self.request("PUT", url, **kwargs)
+
+    def close(self):
+        """close every pooled connection"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_http_client():
+    """return the HttpClient shared by every module in this run"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
@@ -8,7 +8,11 @@ from datetime import datetime, timedelta
 from config import Config
 from data_manager import DataManager
 from flight_search import FlightSearch
-from notification_manager import NotificationManager
+from async_search import AsyncSearchEngine
+from notification_manager import NotificationManager, NotificationDispatcher
+from reports import failure_summary, send_notifications
+from metrics import get_metrics
+from run_journal import RunJournal
 
 def print_header(title):
     """print formatted header"""
@@ -39,222 +43,194 @@ def send_api_failure_notification(notification_manager, data_manager, error_mess
     except Exception as e:
         print(f"Failed to send notification: {e}")
 
+def write_run_report(metrics):
+    """save the stage timings and counters of this run"""
+    try:
+        metrics.write_report(Config.METRICS_REPORT_FILE, Config.METRICS_PROMETHEUS_FILE)
+        print(f"   Run report: {Config.METRICS_REPORT_FILE}")
+    except OSError as e:
+        print(f"Failed to write the run report: {e}")
+
 def main():
     """main function for flight price monitoring and notification"""
     
+    Config.setup_logging()
+    metrics = get_metrics()
     print_header("The flight price monitoring system has been activated!!")
     
-    currency_symbol = Config.get_currency_symbol()
-    
     # ===== Verifying the configuration =====
     print("\n verifying the configuration...")
-    try:
-        Config.validate()
-        Config.setup_cache_dirs()
-        print("Configuration verification passed")
-    except Exception as e:
-        print(f"Configuration error: {e}")
-        print("\n Please check whether the.env file is configured correctly")
-        exit(1)
+    with metrics.stage("config"):
+        try:
+            Config.validate()
+            Config.setup_cache_dirs()
+            print("Configuration verification passed")
+        except Exception as e:
+            print(f"Configuration error: {e}")
+            print("\n Please check whether the.env file is configured correctly")
+            exit(1)
     
     # ===== Initialization module =====
     print_header("Initialization module")
-    try:
-        data_manager = DataManager()
-        print("The data manager has been initialized successfully!!")
-        
-        flight_search = FlightSearch()
-        print("The flight search engine has been initialized successfully!!")
-        
-        notification_manager = NotificationManager()
-        print("Notify the manager that the initialization was successful!!")
-    except Exception as e:
-        print(f"Failed to initialize: {e}")
-        exit(1)
+    with metrics.stage("init"):
+        try:
+            data_manager = DataManager()
+            print("The data manager has been initialized successfully!!")
+            
+            flight_search = FlightSearch()
+            print("The flight search engine has been initialized successfully!!")
+            
+            notification_manager = NotificationManager()
+            # emails are sent in the background over one SMTP session
+            notifier = NotificationDispatcher(notification_manager)
+            print("Notify the manager that the initialization was successful!!")
+        except Exception as e:
+            print(f"Failed to initialize: {e}")
+            exit(1)
+    
+    # expired entries are deleted in the background while the run goes on
+    flight_search.cache_manager.start_sweeper()
     
     # ===== Setting parameters =====
-    origin = Config.ORIGIN_CITY_IATA
+    origins = Config.ORIGIN_CITY_IATAS
     search_start = datetime.now() + timedelta(days=1)
     search_end = datetime.now() + timedelta(days=10)
     
     print(f"\n Searchable configuration:")
-    print(f"   Place of departure: {origin}")
+    print(f"   Place of departure: {', '.join(origins)}")
     print(f"   Date: {search_start.strftime('%Y-%m-%d')} to {search_end.strftime('%Y-%m-%d')}")
     
+    # progress is journaled, a run that died halfway is picked up where it stopped
+    journal = RunJournal()
+    if journal.begin(origins, search_start, search_end):
+        started = datetime.fromtimestamp(journal.started_at).strftime('%Y-%m-%d %H:%M')
+        print(f"   Resuming the unfinished run started at {started} "
+              f"({len(journal.lookups)} search/es already done)")
+    
     # ===== Obtain destination data =====
     print_header("Get the list of monitoring destinations")
-    try:
-        destinations = data_manager.get_destination_data()
-        print(f"Succeed to obtain {len(destinations)} destination/s")
-    except Exception as e:
-        print(f"Fail to obtain destination: {e}")
-        exit(1)
+    with metrics.stage("destinations"):
+        try:
+            destinations = data_manager.get_destination_data()
+            print(f"Succeed to obtain {len(destinations)} destination/s")
+        except Exception as e:
+            print(f"Fail to obtain destination: {e}")
+            exit(1)
     
     # ===== Gettting IATA code =====
     print_header("Check and fill in the IATA airport code")
-    api_failed = False
+    search_engine = AsyncSearchEngine(flight_search, journal=journal)
     
-    for dest in destinations:
-        if not dest.get("iataCode"):
+    with metrics.stage("iata"):
+        iata_errors = []
+        if journal.stage_done("iata"):
+            print("Already done by the interrupted run")
+        else:
+            iata_errors = search_engine.fill_iata_codes(destinations, data_manager)
+            flight_search.cache_manager.flush()
+            
             try:
-                iata = flight_search.get_destination_code(dest["city"])
-                if iata:
-                    data_manager.update_destination_code(dest["id"], iata)
-                    dest["iataCode"] = iata
-                    print(f"{dest['city']} → {iata}")
+                written = data_manager.flush_updates()
+                if written:
+                    print(f"Updated {written} IATA code/s in the sheet")
+                if not iata_errors:
+                    journal.complete_stage("iata")
             except Exception as e:
-                print(f"API call failed: {e}")
-                api_failed = True
-                send_api_failure_notification(notification_manager, data_manager, str(e))
-                break
+                # the codes are cached locally and will be written on the next run
+                print(f"Failed to update the sheet: {e}")
     
-    if api_failed:
-        print("\n The program ended prematurely due to a failed API call")
-        exit(1)
+    # rows whose code could not be found are skipped, the other ones are still searched
+    for city, error in iata_errors:
+        print(f" IATA lookup failed for {city}: {error}")
     
     # ===== Search flights =====
     print_header("Search for lowest priced flights")
-    found_deals = []
-    no_flights_found = []
-    price_not_met = []
-    skipped_destinations = []
-    
-    for dest in destinations:
-        if not dest.get("iataCode"):
-            print(f" Skip {dest['city']}(no IATA code)")
-            skipped_destinations.append(dest['city'])
-            continue
-        
-        print(f"\n  Searching for {dest['city']} ({dest['iataCode']})")
-        
-        try:
-            flight = flight_search.search_flights(
-                origin,
-                dest["iataCode"],
-                search_start,
-                search_end
-            )
-            
-            if flight is None:
-                print(f"    No direct flight was found")
-                no_flights_found.append(dest['city'])
-            elif flight:
-                print(f"   Price: {currency_symbol}{flight.price}")
-                
-                if flight.price < dest["lowestPrice"]:
-                    print(f"    Lowest price found! (Target: {currency_symbol}{dest['lowestPrice']})")
-                    found_deals.append({
-                        "destination": dest["city"],
-                        "flight": flight,
-                        "target_price": dest["lowestPrice"]
-                    })
-                else:
-                    print(f"    No flight under (Target: {currency_symbol}{dest['lowestPrice']})")
-                    price_not_met.append({
-                        "city": dest['city'],
-                        "current_price": flight.price,
-                        "target_price": dest["lowestPrice"]
-                    })
-        
-        except Exception as e:
-            print(f" API call failed: {e}")
-            send_api_failure_notification(notification_manager, data_manager, str(e))
-            break
+    # every origin × destination route shares one cache, token and connection pool
+    with metrics.stage("search"):
+        results_by_origin = search_engine.search_route_matrix(origins, destinations, search_start, search_end)
+    found_deals = [deal for results in results_by_origin.values() for deal in results["found_deals"]]
+    errors = [
+        (f"{city} from {origin}" if len(origins) > 1 else city, error)
+        for origin, results in results_by_origin.items()
+        for city, error in results["errors"]
+    ]
+    
+    for city in results_by_origin[origins[0]]["skipped_destinations"]:
+        print(f" Skip {city}(no IATA code)")
+    
+    # one email for everything that failed, the rest of the run went on
+    # failed dates of routes answered by other dates are reported, their deals are kept
+    failures = list(iata_errors) + errors + search_engine.pair_errors
+    if failures:
+        summary = failure_summary(failures, len(search_engine.latencies))
+        print(f" API call failed: {summary}")
+        send_api_failure_notification(notifier, data_manager, summary)
+    
+    with metrics.stage("history"):
+        flight_search.price_history.flush()
+        flight_search.price_history.maybe_compact()
+    
+    print("\n Search latency:")
+    print(search_engine.latency_report())
     
     # ===== Send notifications to users =====
     print_header("Send notifications to users")
     
-    try:
-        users = data_manager.get_user_emails()
-        if not users:
-            print("  No users found, skipping notification sending")
-        else:
-            # send deal notifications
-            if found_deals:
-                print(f"\n Find {len(found_deals)} lowest priced flight/s")
-                for deal in found_deals:
-                    flight = deal["flight"]
-                    
-                    flight_type = "direct flight" if getattr(flight, 'stops', 0) == 0 else f"{getattr(flight, 'stops', 0)}次中转"
-                    airline = getattr(flight, 'airline', 'N/A')
-                    flight_number = getattr(flight, 'flight_number', '')
-                    airline_info = f"{airline} {flight_number}".strip() if airline != 'N/A' else "N/A"
-                    booking_link = getattr(flight, 'booking_link', 'https://www.google.com/flights')
-
-                    message = (
-                        f" Lowest priced air tickets discovered!!\n\n"
-                        f" Destination: {deal['destination']}\n"
-                        f" Current price: {currency_symbol}{flight.price}\n"
-                        f" Target price: {currency_symbol}{deal['target_price']}\n"
-                        f" Save: {currency_symbol}{(deal['target_price'] - flight.price):.2f}\n\n"
-                        f" Departure: {flight.origin_airport}\n"
-                        f" Destination: {flight.destination_airport}\n"
-                        f" Date to outbound: {flight.out_date}\n"
-                        f" Date to inbound: {flight.return_date}\n"
-                        f" Airline: {airline_info}\n"
-                        f" Flight type: {flight_type}\n\n"
-                        f" Booking URL:\n{booking_link}\n\n"
-                        f" Prices may change at any time. Please make your reservation as soon as possible!!\n\n"
-                        f"— Flight price monitoring system"
-                    )
-
-                    notification_manager.send_email(message, users)
-                    print(f"   Sended notification  ")
+    with metrics.stage("notify"):
+        # an offline-first run answered entirely from the cache found nothing new,
+        # the run that fetched these results already notified the users; a resumed
+        # run is answered from its journal, its notifications may not be sent yet
+        if Config.OFFLINE_FIRST and flight_search.api_calls == 0 and not journal.resumed:
+            print("  Every result came from the cache, no new notifications to send")
+            results_by_origin = {}
+        
+        # the failure alert goes out first, so it is not counted against the first origin
+        notifier.wait_sent()
+        
+        # origins whose notifications did not all go out; every delivered email is
+        # journaled, the next run only sends the others
+        undelivered = []
+        for origin, results in results_by_origin.items():
+            try:
+                users = data_manager.get_user_emails(origin=origin)
+                if not users:
+                    print(f"  No users found for {origin}, skipping notification sending")
+                    continue
+                send_notifications(notifier, users, origin, results, journal=journal)
+                if not notifier.wait_sent():
+                    print(f"  Some notifications for {origin} could not be sent")
+                    undelivered.append(origin)
             
-            # send summary report
-            if price_not_met or no_flights_found or skipped_destinations:
-                print(f"\n Send the query summary report...")
-                
-                summary_parts = [
-                    f" Flight price monitoring report\n\n",
-                    f" Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n",
-                    f" Departure: {origin}\n\n"
-                ]
-                
-                if found_deals:
-                    summary_parts.append(f" Number of low price flight: {len(found_deals)} \n")
-                    for deal in found_deals:
-                        summary_parts.append(f"  • {deal['destination']}: {currency_symbol}{deal['flight'].price}\n")
-                    summary_parts.append("\n")
-                else:
-                    summary_parts.append(f" No low-priced flights were found this time\n\n")
-                
-                if price_not_met:
-                    summary_parts.append(f" Number of the price not reached the target : {len(price_not_met)} :\n")
-                    for item in price_not_met:
-                        diff = item['current_price'] - item['target_price']
-                        summary_parts.append(
-                            f"  • {item['city']}: {currency_symbol}{item['current_price']} "
-                            f"(Target: {currency_symbol}{item['target_price']}, Gap: {currency_symbol}{diff:.2f})\n"
-                        )
-                    summary_parts.append("\n")
-                
-                if no_flights_found:
-                    summary_parts.append(f" No direct flight was found. ({len(no_flights_found)}):\n")
-                    for city in no_flights_found:
-                        summary_parts.append(f"  • {city}\n")
-                    summary_parts.append("\n")
-                
-                if skipped_destinations:
-                    summary_parts.append(f" Skip number: ({len(skipped_destinations)} ):\n")
-                    for city in skipped_destinations:
-                        summary_parts.append(f"  • {city} (Need IATA code)\n")
-                    summary_parts.append("\n")
-                
-                summary_parts.append(f" Suggestion: It is possible to consider adjusting the target price or monitoring other destinations.\n\n")
-                summary_parts.append(f"— Flight price monitoring system")
-                
-                summary_message = "".join(summary_parts)
-                notification_manager.send_email(summary_message, users)
-                print(f"  The query summary has been sent")
+            except Exception as e:
+                print(f" Fail to notification: {e}")
+                undelivered.append(origin)
+        
+        # wait for the background sender before finishing
+        notifier.drain()
     
-    except Exception as e:
-        print(f" Fail to notification: {e}")
+    # stale answers served from the cache are searched again for the next run
+    with metrics.stage("refresh"):
+        refreshed = flight_search.wait_for_refreshes()
+        if refreshed:
+            print(f"   Finished {refreshed} background cache refresh/es")
+        flight_search.cache_manager.stop_sweeper()
+        flight_search.price_history.flush()
     
     # ===== Finish =====
     print_header(" The program has completed running.")
     print(f"   Valid destination: {len(destinations)} ")
-    print(f"   Lowest price: {len(found_deals)} \n")
+    print(f"   Lowest price: {len(found_deals)} ")
+    print(f"   API calls: {flight_search.api_calls} (saved by coalescing: {flight_search.calls_saved})")
+    for stage, seconds in metrics.stages.items():
+        print(f"   {stage}: {seconds:.2f}s")
+    write_run_report(metrics)
+    if undelivered:
+        # the journal stays open, the next run resumes and only retries the notifications
+        print(f"   Notifications for {', '.join(undelivered)} are sent again by the next run")
+        journal.close()
+    else:
+        journal.finish()
+    print()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,214 @@
+# metrics.py
+"""
+metrics.py
+counters, latency histograms and stage timings of a run, exported as JSON or Prometheus text
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    """hashable, ordered form of a label dict"""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    """{key="value",...} for the Prometheus text format"""
+    pairs = list(label_key) + list(extra or [])
+    if not pairs:
+        return ""
+    escaped = (
+        f'{key}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class Histogram:
+    """count of observations per bucket, with their sum"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(upper bound, observations at or below it), ending with +Inf"""
+        running = 0
+        pairs = []
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            pairs.append((bound, running))
+        pairs.append((float("inf"), self.count))
+        return pairs
+
+
+class MetricsRegistry:
+    """thread-safe store of the counters and histograms of one process"""
+
+    def __init__(self, prefix="flight_monitor_"):
+        """
+        initialize metrics registry
+
+        parameters:
+            prefix: prepended to every name in the Prometheus export
+        """
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        # stage name -> seconds, in the order the stages ran
+        self.stages = {}
+        self.started_at = time.time()
+
+    def inc(self, name, amount=1, **labels):
+        """add amount to a counter"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        """add one observation to a histogram"""
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """observe the time spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        """time one stage of a run"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            self.observe("stage_seconds", elapsed, stage=name)
+
+    def value(self, name, **labels):
+        """current value of a counter, 0 if never incremented"""
+        with self._lock:
+            return self._counters.get((name, _label_key(labels)), 0)
+
+    def total(self, name):
+        """sum of a counter over every label combination"""
+        with self._lock:
+            return sum(value for (counter, _), value in self._counters.items() if counter == name)
+
+    def reset(self):
+        """forget every measurement"""
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+            self.stages = {}
+            self.started_at = time.time()
+
+    def to_dict(self):
+        """JSON-friendly run report"""
+        with self._lock:
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self._counters.items())
+            ]
+            histograms = []
+            for (name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                histograms.append({
+                    "name": name,
+                    "labels": dict(labels),
+                    "count": histogram.count,
+                    "sum": round(histogram.sum, 6),
+                    "mean": round(histogram.sum / histogram.count, 6) if histogram.count else None,
+                    "buckets": {
+                        ("+Inf" if bound == float("inf") else str(bound)): count
+                        for bound, count in histogram.cumulative()
+                    },
+                })
+            return {
+                "started_at": self.started_at,
+                "duration_seconds": round(time.time() - self.started_at, 3),
+                "stages": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+                "counters": counters,
+                "histograms": histograms,
+            }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            counter_names = sorted({name for name, _ in self._counters})
+            for name in counter_names:
+                full_name = f"{self.prefix}{name}"
+                lines.append(f"# TYPE {full_name} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{full_name}{_format_labels(labels)} {value}")
+
+            histogram_names = sorted({name for name, _ in self._histograms})
+            for name in histogram_names:
+                full_name = f"{self.prefix}{name}"
+                lines.append(f"# TYPE {full_name} histogram")
+                for (histogram_name, labels), histogram in sorted(self._histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{full_name}_bucket{_format_labels(labels, [('le', le)])} {count}")
+                    lines.append(f"{full_name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, json_file=None, prometheus_file=None):
+        """write the JSON report and/or the Prometheus text file"""
+        for path, content in (
+            (json_file, lambda: json.dumps(self.to_dict(), indent=2)),
+            (prometheus_file, self.to_prometheus),
+        ):
+            if not path:
+                continue
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_file = f"{path}.tmp"
+            with open(temp_file, 'w') as f:
+                f.write(content())
+            os.replace(temp_file, path)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """return the metrics registry shared by every module"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+        return _metrics
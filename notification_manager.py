@@ -3,10 +3,13 @@
 notification_manager.py
 manage email notifications
 """
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import logging
+import queue
+import threading
 from config import Config
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
 
 class NotificationManager:
     """email notification manager class"""
@@ -19,6 +22,58 @@ class NotificationManager:
         
         self.email_user: str = email_user # type: ignore
         self.email_pass: str = email_pass # type: ignore
+        
+        # SMTP server, configurable so a local stand-in can be used
+        self.smtp_host = Config.SMTP_HOST
+        self.smtp_port = Config.SMTP_PORT
+        self.smtp_starttls = Config.SMTP_STARTTLS
+        
+        # one authenticated session is reused for every message
+        self._connection = None
+        self._lock = threading.Lock()
+    
+    def _connect(self):
+        """open and authenticate a new SMTP session"""
+        # smtplib and email are only loaded by runs that send mail
+        import smtplib
+        connection = smtplib.SMTP(self.smtp_host, self.smtp_port, timeout=30)
+        get_metrics().inc("smtp_connections_total")
+        try:
+            connection.ehlo()
+            if self.smtp_starttls:
+                connection.starttls()
+                connection.ehlo()
+            if self.email_pass and connection.has_extn("auth"):
+                connection.login(user=self.email_user, password=self.email_pass)
+        except Exception:
+            connection.close()
+            raise
+        return connection
+    
+    def _send_message(self, msg):
+        """send a message over the shared session, reconnecting once if it dropped"""
+        import smtplib
+        with self._lock:
+            if self._connection is None:
+                self._connection = self._connect()
+            try:
+                self._connection.send_message(msg)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                # the server closed an idle session, open a new one
+                self._connection = self._connect()
+                self._connection.send_message(msg)
+    
+    def close(self):
+        """close the SMTP session"""
+        with self._lock:
+            if self._connection is None:
+                return
+            import smtplib
+            try:
+                self._connection.quit()
+            except (smtplib.SMTPException, OSError):
+                self._connection.close()
+            self._connection = None
     
     def send_email(self, message, recipient_emails):
         """
@@ -27,10 +82,14 @@ class NotificationManager:
         parameters:
             message: 
             recipient_emails: list of recipient email addresses
+        return: False when the email could not be sent
         """
         if not recipient_emails:
-            print(" No recipient emails provided. Skipping email notification.")
-            return
+            logger.warning(" No recipient emails provided. Skipping email notification.")
+            return True
+        
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
         
         try:
             #  create email message
@@ -43,12 +102,76 @@ class NotificationManager:
             msg.attach(MIMEText(message, "plain", "utf-8"))
             
             # send the email
-            with smtplib.SMTP("smtp.gmail.com", 587) as connection:
-                connection.starttls()
-                connection.login(user=self.email_user, password=self.email_pass)
-                connection.send_message(msg)
+            with get_metrics().timer("smtp_send_seconds"):
+                self._send_message(msg)
             
-            print(f" Email sended!")
+            get_metrics().inc("smtp_messages_total", status="sent")
+            logger.debug(f" Email sended!")
+            return True
             
         except Exception as e:
-            print(f" Failed to send email: {e}")
+            get_metrics().inc("smtp_messages_total", status="failed")
+            logger.error(f" Failed to send email: {e}")
+            return False
+
+
+class NotificationDispatcher:
+    """send emails from a background worker so searching is not blocked on mail"""
+    
+    def __init__(self, notification_manager):
+        """
+        initialize notification dispatcher
+        
+        parameters:
+            notification_manager: NotificationManager used by the worker
+        """
+        self.notification_manager = notification_manager
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        # emails that could not be sent since the last wait_sent
+        self._failed = 0
+    
+    def _run(self):
+        """worker loop: send queued emails one by one"""
+        while True:
+            message, recipient_emails, on_sent = self._queue.get()
+            try:
+                if self.notification_manager.send_email(message, recipient_emails) is False:
+                    with self._lock:
+                        self._failed += 1
+                elif on_sent is not None:
+                    on_sent()
+            finally:
+                self._queue.task_done()
+    
+    def send_email(self, message, recipient_emails, on_sent=None):
+        """
+        queue an email, it is sent in the background
+        
+        parameters:
+            message: 
+            recipient_emails: list of recipient email addresses
+            on_sent: called from the worker once the email was sent
+        """
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+                self._worker.start()
+        self._queue.put((message, list(recipient_emails or []), on_sent))
+    
+    def wait_sent(self):
+        """
+        wait until every queued email is sent, keeping the SMTP session open
+        
+        return: True when every email queued since the last wait was sent
+        """
+        self._queue.join()
+        with self._lock:
+            failed, self._failed = self._failed, 0
+        return failed == 0
+    
+    def drain(self):
+        """wait until every queued email is sent, then close the SMTP session"""
+        self.wait_sent()
+        self.notification_manager.close()
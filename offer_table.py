@@ -0,0 +1,207 @@
+# offer_table.py
+"""
+offer_table.py
+compact column storage for many flight offers from one search
+"""
+import codecs
+import json
+import re
+from array import array
+from datetime import date
+from itertools import compress
+from flight_data import FlightData
+
+_DURATION_PATTERN = re.compile(r"P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?")
+
+
+def parse_duration(text):
+    """convert an ISO 8601 duration such as PT14H30M to minutes"""
+    match = _DURATION_PATTERN.fullmatch(text or "")
+    if not match:
+        return 0
+    days, hours, minutes = (int(part or 0) for part in match.groups())
+    return days * 1440 + hours * 60 + minutes
+
+
+def iter_json_array(chunks, key="data"):
+    """
+    yield the items of a top-level JSON array one by one while the body streams in
+
+    only the item being decoded is held in memory, never the whole document
+
+    parameters:
+        chunks: iterable of bytes or str pieces of the JSON document
+        key: name of the array to read
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    start_pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    chunks = iter(chunks)
+
+    def read():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return None
+        return text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+
+    # find the start of the array
+    buffer = ""
+    while True:
+        match = start_pattern.search(buffer)
+        if match:
+            buffer = buffer[match.end():]
+            break
+        chunk = read()
+        if chunk is None:
+            return
+        buffer += chunk
+
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,")
+        if buffer.startswith("]"):
+            return
+
+        if buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                # the item is not complete yet
+                pass
+            else:
+                yield item
+                buffer = buffer[end:]
+                continue
+
+        chunk = read()
+        if chunk is None:
+            if buffer.strip():
+                raise ValueError("Response ended in the middle of the offer list")
+            return
+        buffer += chunk
+
+
+class OfferTable:
+    """flight offers stored as typed columns instead of one object per offer"""
+
+    def __init__(self):
+        """initialize an empty offer table"""
+        self.price = array("d")
+        self.stops = array("b")
+        self.return_stops = array("b")
+        self.duration = array("l")      # outbound minutes
+        self.out_date = array("l")      # date ordinals
+        self.return_date = array("l")   # date ordinals, 0 for one-way offers
+        self.origin = array("H")        # index into the string pool
+        self.destination = array("H")
+        self.carrier = array("H")
+        self.flight_number = array("H")
+
+        # airport, carrier and flight number strings are stored once
+        self._strings = []
+        self._string_ids = {}
+
+    def __len__(self):
+        return len(self.price)
+
+    def _intern(self, text):
+        """return the pool index of a string, adding it if new"""
+        index = self._string_ids.get(text)
+        if index is None:
+            index = len(self._strings)
+            self._strings.append(text)
+            self._string_ids[text] = index
+        return index
+
+    def append_offer(self, offer):
+        """add one flight-offers API item to the table"""
+        outbound = offer["itineraries"][0]
+        first_segment = outbound["segments"][0]
+        last_segment = outbound["segments"][-1]
+
+        out_day = first_segment["departure"]["at"].split("T")[0]
+        return_day = 0
+        return_stops = 0
+        if len(offer["itineraries"]) > 1:
+            inbound = offer["itineraries"][1]
+            return_day = date.fromisoformat(inbound["segments"][0]["departure"]["at"].split("T")[0]).toordinal()
+            return_stops = len(inbound["segments"]) - 1
+
+        self.price.append(float(offer["price"]["total"]))
+        self.stops.append(len(outbound["segments"]) - 1)
+        self.return_stops.append(return_stops)
+        self.duration.append(parse_duration(outbound.get("duration")))
+        self.out_date.append(date.fromisoformat(out_day).toordinal())
+        self.return_date.append(return_day)
+        self.origin.append(self._intern(first_segment["departure"]["iataCode"]))
+        self.destination.append(self._intern(last_segment["arrival"]["iataCode"]))
+        self.carrier.append(self._intern(first_segment.get("carrierCode", "Unknown")))
+        self.flight_number.append(self._intern(first_segment.get("number", "N/A")))
+
+    @classmethod
+    def from_offers(cls, offers):
+        """build a table from an iterable of offer dicts"""
+        table = cls()
+        for offer in offers:
+            table.append_offer(offer)
+        return table
+
+    def best(self, max_stops=None, carriers=None, exclude_carriers=None, max_duration=None):
+        """
+        find the cheapest offer matching the criteria
+
+        parameters:
+            max_stops: most stops allowed on the outbound flight
+            carriers: carrier codes to choose from (None = any)
+            exclude_carriers: carrier codes to avoid
+            max_duration: longest outbound duration allowed, in minutes
+        return: row index of the cheapest matching offer, or None
+        """
+        if not len(self):
+            return None
+
+        # turn carrier codes into pool indexes so the filter compares integers
+        allowed = None
+        if carriers:
+            allowed = {self._string_ids[code] for code in carriers if code in self._string_ids}
+        excluded = {self._string_ids[code] for code in (exclude_carriers or ()) if code in self._string_ids}
+
+        mask = [True] * len(self)
+        if max_stops is not None:
+            mask = [keep and stops <= max_stops for keep, stops in zip(mask, self.stops)]
+        if allowed is not None:
+            mask = [keep and carrier in allowed for keep, carrier in zip(mask, self.carrier)]
+        if excluded:
+            mask = [keep and carrier not in excluded for keep, carrier in zip(mask, self.carrier)]
+        if max_duration:
+            mask = [keep and duration <= max_duration for keep, duration in zip(mask, self.duration)]
+
+        candidates = list(compress(range(len(self)), mask))
+        if not candidates:
+            return None
+        return min(candidates, key=self.price.__getitem__)
+
+    def to_flight_data(self, index):
+        """build a FlightData object for one row"""
+        origin_airport = self._strings[self.origin[index]]
+        destination_airport = self._strings[self.destination[index]]
+        out_date = date.fromordinal(self.out_date[index]).isoformat()
+        return_date = (
+            date.fromordinal(self.return_date[index]).isoformat() if self.return_date[index] else None
+        )
+
+        # URL for booking
+        booking_link = (f"https://www.google.com/travel/flights?"
+                        f"q=Flights%20from%20{origin_airport}%20to%20"
+                        f"{destination_airport}%20on%20{out_date}")
+
+        return FlightData(
+            self.price[index],
+            origin_airport,
+            destination_airport,
+            out_date,
+            return_date,
+            airline=self._strings[self.carrier[index]],
+            flight_number=self._strings[self.flight_number[index]],
+            stops=self.stops[index],
+            booking_link=booking_link
+        )
@@ -0,0 +1,97 @@
+# price_calendar.py
+"""
+price_calendar.py
+cheapest price for every departure/return date pair in a search window
+"""
+import math
+from array import array
+from datetime import date, datetime, timedelta
+
+
+def _as_date(value):
+    """accept a date, datetime or YYYY-MM-DD string"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def calendar_dates(start, end):
+    """return every date from start to end (inclusive) as YYYY-MM-DD strings"""
+    start, end = _as_date(start), _as_date(end)
+    return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+
+
+def calendar_date_pairs(start, end, min_trip_days, max_trip_days):
+    """
+    list every (departure, return) pair inside the window
+
+    parameters:
+        start, end: first and last day of the window
+        min_trip_days, max_trip_days: allowed trip length in days
+    return: list of (departure_date, return_date) strings
+    """
+    dates = calendar_dates(start, end)
+    pairs = []
+    for i, departure in enumerate(dates):
+        for length in range(max(min_trip_days, 0), max_trip_days + 1):
+            if i + length >= len(dates):
+                break
+            pairs.append((departure, dates[i + length]))
+    return pairs
+
+
+class PriceCalendar:
+    """dense departure × return price matrix for one route"""
+
+    def __init__(self, origin, destination, dates, flights):
+        """
+        initialize price calendar
+
+        parameters:
+            origin, destination: IATA codes of the route
+            dates: every date of the window, in order
+            flights: dict of (departure_date, return_date) -> FlightData or None
+        """
+        self.origin = origin
+        self.destination = destination
+        self.dates = list(dates)
+        self._positions = {day: position for position, day in enumerate(self.dates)}
+
+        size = len(self.dates)
+        # row = departure date, column = return date, inf = no flight or not searched
+        self.prices = array("d", [math.inf]) * (size * size)
+        self._flights = {}
+        for (departure, arrival), flight in flights.items():
+            if flight is None or departure not in self._positions or arrival not in self._positions:
+                continue
+            cell = self._positions[departure] * size + self._positions[arrival]
+            self.prices[cell] = flight.price
+            self._flights[cell] = flight
+
+    def matrix(self):
+        """return the prices as a list of rows (None where there is no flight)"""
+        size = len(self.dates)
+        return [
+            [None if math.isinf(price) else price for price in self.prices[row * size:(row + 1) * size]]
+            for row in range(size)
+        ]
+
+    def cheapest(self):
+        """
+        find the cheapest date pair
+
+        return: (departure_date, return_date, FlightData), or None if no flights
+        """
+        if not self._flights:
+            return None
+
+        # imported on first use, only calendar searches need it (installed with pandas)
+        import numpy as np
+
+        # a view of the matrix, no copy; empty cells hold inf, missing prices would be NaN
+        prices = np.frombuffer(self.prices, dtype=np.float64)
+        cell = int(np.argmin(np.where(np.isnan(prices), np.inf, prices)))
+        size = len(self.dates)
+        return self.dates[cell // size], self.dates[cell % size], self._flights[cell]
@@ -0,0 +1,303 @@
+# price_history.py
+"""
+price_history.py
+append-only history of every price observed from the Amadeus API
+"""
+import atexit
+import bisect
+import heapq
+import mmap
+import os
+import statistics
+import struct
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+from config import Config
+
+# observed_at (epoch seconds), price, departure date ordinal, return date ordinal
+_RECORD = struct.Struct("<ddii")
+
+
+def _observed_at(packed):
+    """observation time of a packed record"""
+    return _RECORD.unpack_from(packed)[0]
+
+
+def _date_ordinal(text):
+    """YYYY-MM-DD -> date ordinal, 0 when missing"""
+    return date.fromisoformat(text).toordinal() if text else 0
+
+
+class PriceHistory:
+    """per-route files of fixed-width price records, sorted by observation time"""
+
+    def __init__(self, history_dir=None, write_to_disk=True):
+        """
+        initialize price history
+
+        parameters:
+            history_dir: directory holding one .bin file per route
+            write_to_disk: False keeps the records in memory until take_buffered,
+                           for worker processes whose records are written by the coordinator
+        """
+        self.history_dir = history_dir or Config.PRICE_HISTORY_DIR
+        self.flush_threshold = Config.PRICE_HISTORY_FLUSH_THRESHOLD
+        self.write_to_disk = write_to_disk
+
+        # route -> packed records not written yet
+        self._buffers = {}
+        self._buffered = 0
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _route_file(self, origin, destination):
+        """path of the history file of a route"""
+        return os.path.join(self.history_dir, f"{origin}_{destination}.bin")
+
+    def record(self, origin, destination, flight, observed_at=None):
+        """
+        add one observed price, written to disk in batches
+
+        parameters:
+            flight: FlightData that was returned by the API
+            observed_at: epoch seconds, defaults to now
+        """
+        packed = _RECORD.pack(
+            observed_at if observed_at is not None else time.time(),
+            float(flight.price),
+            _date_ordinal(flight.out_date),
+            _date_ordinal(flight.return_date)
+        )
+        with self._lock:
+            self._buffers.setdefault((origin, destination), []).append(packed)
+            self._buffered += 1
+            if self._buffered >= self.flush_threshold:
+                self._flush_locked()
+
+    def add_records(self, origin, destination, data):
+        """
+        buffer records packed by another process, written with the next flush
+
+        parameters:
+            data: records of one route as returned by take_buffered
+        """
+        records = [data[start:start + _RECORD.size]
+                   for start in range(0, len(data) - len(data) % _RECORD.size, _RECORD.size)]
+        with self._lock:
+            self._buffers.setdefault((origin, destination), []).extend(records)
+            self._buffered += len(records)
+
+    def take_buffered(self):
+        """
+        hand over the records not written yet instead of writing them
+
+        return: dict of (origin, destination) -> packed records
+        """
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+            self._buffered = 0
+        return {route: b"".join(records) for route, records in buffers.items()}
+
+    def _flush_locked(self):
+        """append buffered records, one write per route (caller holds the lock)"""
+        if not self._buffered or not self.write_to_disk:
+            return
+
+        os.makedirs(self.history_dir, exist_ok=True)
+        for (origin, destination), records in self._buffers.items():
+            # concurrent searches, and records of several workers, arrive out of order
+            records.sort(key=_observed_at)
+            self._append_in_order(self._route_file(origin, destination), records)
+        self._buffers = {}
+        self._buffered = 0
+
+    @staticmethod
+    def _append_in_order(path, records):
+        """
+        add sorted records to a route file, keeping the file sorted by time
+
+        records older than the last one of the file are merged into its tail,
+        so _read_range can keep binary searching it
+        """
+        if not records:
+            return
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(b"".join(records))
+            return
+
+        with open(path, 'r+b') as f:
+            count = f.seek(0, os.SEEK_END) // _RECORD.size
+
+            def observed_at(index):
+                f.seek(index * _RECORD.size)
+                return _observed_at(f.read(_RECORD.size))
+
+            oldest = _observed_at(records[0])
+            if not count or observed_at(count - 1) <= oldest:
+                # a partial record left by a crash is overwritten
+                f.seek(count * _RECORD.size)
+                f.write(b"".join(records))
+                f.truncate()
+                return
+
+            # the first record of the file newer than the oldest new one
+            low, high = 0, count - 1
+            while low < high:
+                middle = (low + high) // 2
+                if observed_at(middle) <= oldest:
+                    low = middle + 1
+                else:
+                    high = middle
+            f.seek(low * _RECORD.size)
+            tail = f.read((count - low) * _RECORD.size)
+            tail = [tail[start:start + _RECORD.size] for start in range(0, len(tail), _RECORD.size)]
+            f.seek(low * _RECORD.size)
+            f.write(b"".join(heapq.merge(tail, records, key=_observed_at)))
+            f.truncate()
+
+    def flush(self):
+        """write every buffered record to disk"""
+        with self._lock:
+            self._flush_locked()
+
+    def _read_range(self, origin, destination, start, end):
+        """binary search the route file for records with start <= observed_at < end"""
+        path = self._route_file(origin, destination)
+        if not os.path.exists(path) or os.path.getsize(path) < _RECORD.size:
+            return []
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            count = len(view) // _RECORD.size
+
+            def first_at_or_after(moment, low):
+                high = count
+                while low < high:
+                    middle = (low + high) // 2
+                    if _RECORD.unpack_from(view, middle * _RECORD.size)[0] < moment:
+                        low = middle + 1
+                    else:
+                        high = middle
+                return low
+
+            first = first_at_or_after(start, 0)
+            last = first_at_or_after(end, first)
+            return [_RECORD.unpack_from(view, index * _RECORD.size) for index in range(first, last)]
+
+    def query(self, origin, destination, start=None, end=None):
+        """
+        price observations of a route in a time range
+
+        parameters:
+            start, end: datetime or epoch seconds, None for unbounded
+        return: list of (observed_at, price, departure_date, return_date), oldest first
+        """
+        start = start.timestamp() if isinstance(start, datetime) else (start or 0.0)
+        end = end.timestamp() if isinstance(end, datetime) else (end or float("inf"))
+
+        records = self._read_range(origin, destination, start, end)
+        with self._lock:
+            pending = [_RECORD.unpack(packed) for packed in self._buffers.get((origin, destination), [])]
+        records.extend(record for record in pending if start <= record[0] < end)
+        records.sort(key=lambda record: record[0])
+
+        return [
+            (observed_at, price,
+             date.fromordinal(departure).isoformat() if departure else None,
+             date.fromordinal(arrival).isoformat() if arrival else None)
+            for observed_at, price, departure, arrival in records
+        ]
+
+    def lowest(self, origin, destination, days=30):
+        """lowest price observed for a route in the last few days, or None"""
+        prices = [record[1] for record in self.query(origin, destination, start=time.time() - days * 86400)]
+        return min(prices) if prices else None
+
+    def is_lowest(self, origin, destination, price, days=30):
+        """check whether price is at or below everything seen in the last few days"""
+        lowest = self.lowest(origin, destination, days)
+        return lowest is None or price <= lowest
+
+    def rolling(self, origin, destination, window_days=7, start=None, end=None):
+        """
+        rolling minimum and median over a time window
+
+        return: list of (observed_at, rolling_min, rolling_median), one per observation
+        """
+        window = window_days * 86400
+        in_window = deque()
+        sorted_prices = []
+        aggregates = []
+
+        for observed_at, price, _, _ in self.query(origin, destination, start, end):
+            in_window.append((observed_at, price))
+            bisect.insort(sorted_prices, price)
+            while in_window[0][0] <= observed_at - window:
+                _, old_price = in_window.popleft()
+                del sorted_prices[bisect.bisect_left(sorted_prices, old_price)]
+            aggregates.append((observed_at, sorted_prices[0], statistics.median(sorted_prices)))
+
+        return aggregates
+
+    def compact(self, origin, destination, retention_days=None):
+        """
+        rewrite a route file sorted by time, keeping the lowest price per
+        (departure, return, day) and dropping records past the retention period
+
+        return: number of records kept
+        """
+        retention_days = Config.PRICE_HISTORY_RETENTION_DAYS if retention_days is None else retention_days
+        oldest = time.time() - retention_days * 86400 if retention_days else 0.0
+        path = self._route_file(origin, destination)
+
+        # hold the lock throughout so no append lands between read and replace
+        with self._lock:
+            self._flush_locked()
+            if not os.path.exists(path):
+                return 0
+            with open(path, 'rb') as f:
+                data = f.read()
+            return self._rewrite(path, data, oldest)
+
+    @staticmethod
+    def _rewrite(path, data, oldest):
+        """write the compacted records of a route file (caller holds the lock)"""
+        records = [record for record in _RECORD.iter_unpack(data[:len(data) - len(data) % _RECORD.size])
+                   if record[0] >= oldest]
+
+        best = {}
+        for record in records:
+            key = (record[2], record[3], int(record[0] // 86400))
+            if key not in best or record[1] < best[key][1]:
+                best[key] = record
+        kept = sorted(best.values(), key=lambda record: record[0])
+
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'wb') as f:
+            f.write(b"".join(_RECORD.pack(*record) for record in kept))
+        os.replace(temp_file, path)
+        return len(kept)
+
+    def maybe_compact(self):
+        """compact every route file if the last compaction is older than the configured interval"""
+        marker = os.path.join(self.history_dir, ".compacted")
+        interval = Config.PRICE_HISTORY_COMPACT_DAYS * 86400
+        if os.path.exists(marker) and time.time() - os.path.getmtime(marker) < interval:
+            return 0
+
+        self.flush()
+        if not os.path.isdir(self.history_dir):
+            return 0
+
+        compacted = 0
+        for name in os.listdir(self.history_dir):
+            if name.endswith(".bin"):
+                origin, destination = name[:-4].split("_", 1)
+                self.compact(origin, destination)
+                compacted += 1
+
+        with open(marker, 'w') as f:
+            f.write(datetime.now().isoformat())
+        return compacted
@@ -0,0 +1,249 @@
+# rate_governor.py
+"""
+rate_governor.py
+pace requests per host with adaptive token buckets and stop calling failing hosts
+"""
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+from config import Config
+from metrics import get_metrics
+
+# the rate never drops below this share of the configured rate
+MIN_RATE_SHARE = 0.1
+# share of the configured rate won back by every request that is not throttled
+RECOVERY_STEP = 0.05
+# pause after a 429 that came without a Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+
+
+class CircuitOpenError(Exception):
+    """raised instead of sending a request to a host that keeps failing"""
+
+
+def parse_retry_after(value, default=DEFAULT_RETRY_AFTER):
+    """
+    seconds to wait from a Retry-After header
+
+    parameters:
+        value: header value, a number of seconds or an HTTP date
+    return: seconds, default when the header is missing or unreadable
+    """
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    from email.utils import parsedate_to_datetime
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if retry_at is None:
+        return default
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """let requests through at a rate that halves when throttled and recovers on success"""
+
+    def __init__(self, rate, burst=None):
+        """
+        initialize token bucket
+
+        parameters:
+            rate: requests per second, 0 = no limit
+            burst: requests allowed at once after an idle period (default one second's worth)
+        """
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        wait until one request may be sent
+
+        return: seconds waited
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return waited
+                    self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def throttle(self, delay):
+        """the host asked to slow down: halve the rate and send nothing for delay seconds"""
+        with self._lock:
+            now = time.monotonic()
+            if self.max_rate > 0:
+                self.rate = max(self.max_rate * MIN_RATE_SHARE, self.rate / 2)
+            self.tokens = 0
+            self._updated = now
+            self._paused_until = max(self._paused_until, now + delay)
+
+    def recover(self):
+        """move the rate back towards the configured one"""
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+
+class CircuitBreaker:
+    """refuse requests for a while once too many recent requests to a host failed"""
+
+    def __init__(self, error_rate=None, window=None, min_calls=None, cooldown=None):
+        """
+        initialize circuit breaker
+
+        parameters:
+            error_rate: share of failed requests in the window that opens the circuit
+            window: number of recent requests looked at
+            min_calls: requests needed in the window before the circuit can open
+            cooldown: seconds the circuit stays open before one trial request is let through
+        """
+        self.error_rate = Config.CIRCUIT_BREAKER_ERROR_RATE if error_rate is None else error_rate
+        self.min_calls = Config.CIRCUIT_BREAKER_MIN_CALLS if min_calls is None else min_calls
+        self.cooldown = Config.CIRCUIT_BREAKER_COOLDOWN_SECONDS if cooldown is None else cooldown
+        self._results = deque(maxlen=window or Config.CIRCUIT_BREAKER_WINDOW)
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """closed, open or half_open"""
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or time.monotonic() - self._opened_at >= self.cooldown:
+                return "half_open"
+            return "open"
+
+    def before_request(self):
+        """raise CircuitOpenError unless a request may be sent now"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.cooldown - (time.monotonic() - self._opened_at)
+            if remaining > 0 or self._trial:
+                raise CircuitOpenError(
+                    f"Too many failed requests, calls are paused for up to {self.cooldown:.0f}s"
+                )
+            # half open: this request decides whether the host is back
+            self._trial = True
+
+    def record(self, success):
+        """
+        count the outcome of a request
+
+        return: True when this outcome opened the circuit
+        """
+        with self._lock:
+            if self._opened_at is not None:
+                if self._trial:
+                    self._trial = False
+                    if success:
+                        self._opened_at = None
+                        self._results.clear()
+                    else:
+                        self._opened_at = time.monotonic()
+                return False
+
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.error_rate:
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+class RateGovernor:
+    """one token bucket and one circuit breaker per host"""
+
+    # server errors and refused credentials count against the circuit breaker,
+    # other client errors are about a single request
+    FAILURE_STATUSES = (401, 403)
+
+    def __init__(self):
+        """initialize rate governor"""
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self._metrics = get_metrics()
+
+    @staticmethod
+    def _configured_rate(host):
+        """requests per second allowed for a host, 0 = no limit"""
+        rates = {
+            urlsplit(Config.AMADEUS_BASE_URL).netloc: Config.AMADEUS_REQUESTS_PER_SECOND,
+            urlsplit(Config.SHEETY_PRICES_ENDPOINT or "").netloc: Config.SHEETY_REQUESTS_PER_SECOND,
+            urlsplit(Config.SHEETY_USERS_ENDPOINT or "").netloc: Config.SHEETY_REQUESTS_PER_SECOND,
+        }
+        return rates.get(host, 0)
+
+    def _host(self, host):
+        """(TokenBucket, CircuitBreaker) of a host, created on first use"""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None:
+                state = self._hosts[host] = (TokenBucket(self._configured_rate(host)), CircuitBreaker())
+            return state
+
+    def before_request(self, host):
+        """wait for the host's rate limit, raise CircuitOpenError while its circuit is open"""
+        bucket, breaker = self._host(host)
+        try:
+            breaker.before_request()
+        except CircuitOpenError:
+            self._metrics.inc("circuit_breaker_rejections_total", host=host)
+            raise
+        waited = bucket.acquire()
+        if waited:
+            self._metrics.observe("rate_limit_wait_seconds", waited, host=host)
+
+    def record_response(self, host, status_code, retry_after=None):
+        """
+        adapt the pace of a host to a response
+
+        return: seconds the host asked to wait on a 429, None otherwise
+        """
+        bucket, breaker = self._host(host)
+        delay = None
+        if status_code == 429:
+            delay = parse_retry_after(retry_after)
+            bucket.throttle(delay)
+            self._metrics.inc("rate_limit_throttled_total", host=host)
+        else:
+            bucket.recover()
+
+        # a throttled host is up, it is only asking us to slow down
+        if breaker.record(status_code < 500 and status_code not in self.FAILURE_STATUSES):
+            self._metrics.inc("circuit_breaker_trips_total", host=host)
+        return delay
+
+    def record_error(self, host):
+        """count a request that got no response at all"""
+        _, breaker = self._host(host)
+        if breaker.record(False):
+            self._metrics.inc("circuit_breaker_trips_total", host=host)
+
+    def circuit_state(self, host):
+        """closed, open or half_open"""
+        return self._host(host)[1].state
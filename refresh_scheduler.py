@@ -0,0 +1,198 @@
+# refresh_scheduler.py
+"""
+refresh_scheduler.py
+decide when each route is refreshed next, within an hourly API budget
+"""
+import heapq
+import itertools
+import statistics
+import time
+from datetime import date
+from config import Config
+
+
+class ApiBudget:
+    """token bucket refilled at a fixed number of API calls per hour"""
+
+    def __init__(self, calls_per_hour=None):
+        """
+        initialize API budget
+
+        parameters:
+            calls_per_hour: sustained number of API calls allowed per hour
+        """
+        self.calls_per_hour = calls_per_hour or Config.DAEMON_API_CALLS_PER_HOUR
+        self.capacity = float(self.calls_per_hour)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        """add the tokens earned since the last update"""
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.calls_per_hour / 3600)
+        self._updated = now
+
+    def available(self):
+        """number of API calls that can be made right now"""
+        self._refill()
+        return self._tokens
+
+    def try_spend(self, calls):
+        """take calls from the bucket if there are enough, return whether it did"""
+        self._refill()
+        if self._tokens < calls:
+            return False
+        self._tokens -= calls
+        return True
+
+    def refund(self, calls):
+        """give back calls that were reserved but not used"""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + calls)
+
+    def seconds_until(self, calls):
+        """how long until calls can be spent"""
+        missing = min(calls, self.capacity) - self.available()
+        return max(0.0, missing * 3600 / self.calls_per_hour)
+
+
+class RouteState:
+    """scheduling state of one origin → destination route"""
+
+    def __init__(self, origin, destination, target_price):
+        self.origin = origin
+        self.destination = destination
+        self.target_price = target_price
+        self.interval = None
+        self.next_due = 0.0
+        self.last_price = None
+        self.last_refresh = None
+        # bumped on every reschedule so stale heap entries can be skipped
+        self.version = 0
+
+
+class RefreshScheduler:
+    """priority queue of routes ordered by their next refresh time"""
+
+    def __init__(self, price_history, min_interval=None, max_interval=None):
+        """
+        initialize refresh scheduler
+
+        parameters:
+            price_history: PriceHistory used to measure price volatility
+            min_interval: shortest time between refreshes of a route, in seconds
+            max_interval: longest time between refreshes of a route, in seconds
+        """
+        self.price_history = price_history
+        self.min_interval = min_interval or Config.DAEMON_MIN_REFRESH_MINUTES * 60
+        self.max_interval = max_interval or Config.DAEMON_MAX_REFRESH_HOURS * 3600
+
+        self.routes = {}
+        self._heap = []
+        self._sequence = itertools.count()
+
+    def _push(self, state):
+        """queue a route at its next due time"""
+        state.version += 1
+        heapq.heappush(self._heap, (state.next_due, next(self._sequence), state.version, state))
+
+    def add(self, origin, destination, target_price, due=None):
+        """
+        schedule a route, or update the target price of a known one
+
+        the target replaces the old one, also when it was lowered; callers pass the
+        highest target of the rows sharing a route, the one most likely to be met
+        """
+        key = (origin, destination)
+        state = self.routes.get(key)
+        if state is None:
+            state = RouteState(origin, destination, target_price)
+            state.next_due = time.time() if due is None else due
+            self.routes[key] = state
+            self._push(state)
+        else:
+            state.target_price = target_price
+        return state
+
+    def remove(self, origin, destination):
+        """stop refreshing a route"""
+        state = self.routes.pop((origin, destination), None)
+        if state is not None:
+            state.version += 1
+
+    def next_due_time(self):
+        """time of the earliest scheduled refresh, or None"""
+        while self._heap:
+            due, _, version, state = self._heap[0]
+            if version == state.version and (state.origin, state.destination) in self.routes:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, budget, cost_per_route, now=None, limit=None):
+        """
+        take routes whose refresh is due, as many as the budget allows
+
+        the estimated cost is reserved from the budget for each route taken
+
+        return: list of RouteState
+        """
+        now = time.time() if now is None else now
+        due_routes = []
+        while self.next_due_time() is not None and self.next_due_time() <= now:
+            if limit is not None and len(due_routes) >= limit:
+                break
+            if not budget.try_spend(cost_per_route):
+                break
+            _, _, _, state = heapq.heappop(self._heap)
+            due_routes.append(state)
+        return due_routes
+
+    def _volatility(self, state):
+        """coefficient of variation of the route's prices over the last week"""
+        prices = [
+            record[1] for record in
+            self.price_history.query(state.origin, state.destination, start=time.time() - 7 * 86400)
+        ]
+        if len(prices) < 2:
+            return 0.0
+        mean = statistics.mean(prices)
+        return statistics.pstdev(prices) / mean if mean else 0.0
+
+    def compute_interval(self, state, flight):
+        """
+        seconds until the next refresh of a route
+
+        refresh sooner when prices move a lot, when the price is near or under
+        the target, and when the flight leaves soon
+        """
+        urgency = 1.0
+
+        # 10% standard deviation doubles the refresh rate
+        urgency += 10 * self._volatility(state)
+
+        if flight is not None and state.target_price:
+            gap = (flight.price - state.target_price) / state.target_price
+            # 1 at or under the target, 0 at twice the target or more
+            urgency += 2 * max(0.0, 1 - max(gap, 0.0))
+
+            days_to_departure = (date.fromisoformat(flight.out_date) - date.today()).days
+            urgency += max(0.0, 1 - days_to_departure / 30)
+
+        return min(self.max_interval, max(self.min_interval, self.max_interval / urgency))
+
+    def reschedule(self, state, flight, now=None):
+        """record a refresh of a route and queue its next one"""
+        now = time.time() if now is None else now
+        state.last_refresh = now
+        state.last_price = flight.price if flight is not None else None
+        state.interval = self.compute_interval(state, flight)
+        state.next_due = now + state.interval
+        self._push(state)
+        return state.interval
+
+    def retry_later(self, state, delay=None, now=None):
+        """queue a route again after a failed refresh"""
+        now = time.time() if now is None else now
+        state.next_due = now + (delay or self.min_interval)
+        self._push(state)
@@ -0,0 +1,224 @@
+# reports.py
+"""
+reports.py
+build deal, summary and digest emails from search results
+"""
+import logging
+import re
+from datetime import datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE = "— Flight price monitoring system"
+
+# limits of the failure summary
+MAX_ERROR_GROUPS = 10
+MAX_PLACES_PER_ERROR = 5
+
+
+def _deal_details(deal, currency_symbol):
+    """return the detail lines describing one deal"""
+    flight = deal["flight"]
+
+    flight_type = "direct flight" if getattr(flight, 'stops', 0) == 0 else f"{getattr(flight, 'stops', 0)}次中转"
+    airline = getattr(flight, 'airline', 'N/A')
+    flight_number = getattr(flight, 'flight_number', '')
+    airline_info = f"{airline} {flight_number}".strip() if airline != 'N/A' else "N/A"
+    booking_link = getattr(flight, 'booking_link', 'https://www.google.com/flights')
+
+    return (
+        f" Destination: {deal['destination']}\n"
+        f" Current price: {currency_symbol}{flight.price}\n"
+        f" Target price: {currency_symbol}{deal['target_price']}\n"
+        f" Save: {currency_symbol}{(deal['target_price'] - flight.price):.2f}\n\n"
+        f" Departure: {flight.origin_airport}\n"
+        f" Destination: {flight.destination_airport}\n"
+        f" Date to outbound: {flight.out_date}\n"
+        f" Date to inbound: {flight.return_date}\n"
+        f" Airline: {airline_info}\n"
+        f" Flight type: {flight_type}\n\n"
+        f" Booking URL:\n{booking_link}\n\n"
+    )
+
+
+def _summary_sections(results, currency_symbol):
+    """return the per-bucket sections of the summary report"""
+    found_deals = results["found_deals"]
+    price_not_met = results["price_not_met"]
+    no_flights_found = results["no_flights_found"]
+    skipped_destinations = results["skipped_destinations"]
+
+    summary_parts = []
+    if found_deals:
+        summary_parts.append(f" Number of low price flight: {len(found_deals)} \n")
+        for deal in found_deals:
+            summary_parts.append(f"  • {deal['destination']}: {currency_symbol}{deal['flight'].price}\n")
+        summary_parts.append("\n")
+    else:
+        summary_parts.append(f" No low-priced flights were found this time\n\n")
+
+    if price_not_met:
+        summary_parts.append(f" Number of the price not reached the target : {len(price_not_met)} :\n")
+        for item in price_not_met:
+            diff = item['current_price'] - item['target_price']
+            summary_parts.append(
+                f"  • {item['city']}: {currency_symbol}{item['current_price']} "
+                f"(Target: {currency_symbol}{item['target_price']}, Gap: {currency_symbol}{diff:.2f})\n"
+            )
+        summary_parts.append("\n")
+
+    if no_flights_found:
+        summary_parts.append(f" No direct flight was found. ({len(no_flights_found)}):\n")
+        for city in no_flights_found:
+            summary_parts.append(f"  • {city}\n")
+        summary_parts.append("\n")
+
+    if skipped_destinations:
+        summary_parts.append(f" Skip number: ({len(skipped_destinations)} ):\n")
+        for city in skipped_destinations:
+            summary_parts.append(f"  • {city} (Need IATA code)\n")
+        summary_parts.append("\n")
+
+    return summary_parts
+
+
+def build_deal_message(deal, currency_symbol):
+    """build the email announcing one deal"""
+    return (
+        f" Lowest priced air tickets discovered!!\n\n"
+        f"{_deal_details(deal, currency_symbol)}"
+        f" Prices may change at any time. Please make your reservation as soon as possible!!\n\n"
+        f"{SIGNATURE}"
+    )
+
+
+def build_summary_message(origin, results, currency_symbol):
+    """build the query summary report email"""
+    summary_parts = [
+        f" Flight price monitoring report\n\n",
+        f" Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n",
+        f" Departure: {origin}\n\n"
+    ]
+    summary_parts.extend(_summary_sections(results, currency_symbol))
+    summary_parts.append(f" Suggestion: It is possible to consider adjusting the target price or monitoring other destinations.\n\n")
+    summary_parts.append(SIGNATURE)
+    return "".join(summary_parts)
+
+
+def build_digest_message(origin, results, currency_symbol):
+    """build one email holding every deal and the summary report"""
+    found_deals = results["found_deals"]
+
+    digest_parts = [
+        f" Flight price monitoring digest\n\n",
+        f" Date: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n",
+        f" Departure: {origin}\n\n"
+    ]
+
+    if found_deals:
+        digest_parts.append(f" Lowest priced air tickets discovered!! ({len(found_deals)})\n\n")
+        for number, deal in enumerate(found_deals, start=1):
+            digest_parts.append(f" ----- Deal {number} -----\n")
+            digest_parts.append(_deal_details(deal, currency_symbol))
+        digest_parts.append(f" Prices may change at any time. Please make your reservation as soon as possible!!\n\n")
+
+    digest_parts.append(f" ----- Summary -----\n")
+    digest_parts.extend(_summary_sections(results, currency_symbol))
+    digest_parts.append(f" Suggestion: It is possible to consider adjusting the target price or monitoring other destinations.\n\n")
+    digest_parts.append(SIGNATURE)
+    return "".join(digest_parts)
+
+
+def failure_summary(errors, lookups=None):
+    """
+    describe every failed lookup of a run in one text
+
+    parameters:
+        errors: list of (city or route, exception)
+        lookups: number of lookups made, None when unknown
+    return: text with the number of failures and the affected places grouped by error
+    """
+    by_error = {}
+    for place, error in errors:
+        # the request URL differs for every route, group on the rest of the message
+        message = re.sub(r" for url: \S+", "", str(error)) or type(error).__name__
+        by_error.setdefault(message, []).append(place)
+
+    total = f" of {lookups}" if lookups else ""
+    lines = [f"{len(errors)}{total} lookup/s failed:"]
+    groups = sorted(by_error.items(), key=lambda item: len(item[1]), reverse=True)
+    for message, places in groups[:MAX_ERROR_GROUPS]:
+        shown = ", ".join(places[:MAX_PLACES_PER_ERROR])
+        if len(places) > MAX_PLACES_PER_ERROR:
+            shown += f" and {len(places) - MAX_PLACES_PER_ERROR} more"
+        lines.append(f"• {message} ({len(places)}): {shown}")
+    if len(groups) > MAX_ERROR_GROUPS:
+        lines.append(f"• {len(groups) - MAX_ERROR_GROUPS} other error/s")
+    return "\n".join(lines)
+
+
+def send_notifications(notifier, users, origin, results, mode=None, journal=None):
+    """
+    send the deal and summary emails for a run
+
+    parameters:
+        notifier: object with send_email(message, recipient_emails)
+        users: list of recipient email addresses
+        origin: IATA code of the departure city
+        results: dict with found_deals, price_not_met, no_flights_found
+                 and skipped_destinations lists
+        mode: "per_deal" (one email per deal plus a summary), "digest" (one
+              email per run) or "recipient_digest" (one email per recipient)
+        journal: RunJournal recording every delivered email, emails it holds are
+                 not sent again; needs a NotificationDispatcher as notifier
+    return: number of emails sent
+    """
+    mode = mode or Config.NOTIFICATION_MODE
+    currency_symbol = Config.get_currency_symbol()
+    found_deals = results["found_deals"]
+    has_summary = results["price_not_met"] or results["no_flights_found"] or results["skipped_destinations"]
+
+    def send(key, build_message, recipient_emails):
+        """queue one email unless the run being resumed already delivered it"""
+        if journal is None:
+            notifier.send_email(build_message(), recipient_emails)
+            return 1
+        key = f"{origin} {key}"
+        if journal.delivered(key):
+            logger.debug(f"   Already delivered: {key}")
+            return 0
+        notifier.send_email(build_message(), recipient_emails, on_sent=lambda: journal.record_delivered(key))
+        return 1
+
+    if mode == "per_deal":
+        sent = 0
+        if found_deals:
+            logger.info(f"\n Find {len(found_deals)} lowest priced flight/s")
+            for deal in found_deals:
+                sent += send(
+                    f"deal {deal['destination']}", lambda: build_deal_message(deal, currency_symbol), users
+                )
+                logger.debug(f"   Queued notification  ")
+
+        if has_summary:
+            logger.info(f"\n Send the query summary report...")
+            sent += send("summary", lambda: build_summary_message(origin, results, currency_symbol), users)
+            logger.info(f"  The query summary has been queued")
+        return sent
+
+    if mode not in ("digest", "recipient_digest"):
+        raise ValueError(f"Unknown notification mode: {mode}")
+
+    if not found_deals and not has_summary:
+        return 0
+
+    logger.info(f"\n Send the digest ({len(found_deals)} lowest priced flight/s)...")
+    digest_message = build_digest_message(origin, results, currency_symbol)
+    if mode == "digest":
+        sent = send("digest", lambda: digest_message, users)
+    else:
+        # every user only sees their own address
+        sent = sum(send(f"digest {user}", lambda: digest_message, [user]) for user in users)
+    logger.info(f"  {sent} digest email/s queued")
+    return sent
@@ -0,0 +1,221 @@
+# run_journal.py
+"""
+run_journal.py
+append-only journal of a sweep, so an interrupted run resumes where it stopped
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+from config import Config
+from flight_data import FlightData
+
+logger = logging.getLogger(__name__)
+
+
+def _as_text(value):
+    """YYYY-MM-DD for dates, the value itself otherwise"""
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+class RunJournal:
+    """
+    record the progress of one sweep as JSON lines
+
+    the file holds a start record, then stage, lookup and delivery records
+    as they happen, and a finish record; a run that finds an unfinished journal
+    for the same origins and dates picks up its progress instead of starting over
+    """
+
+    def __init__(self, path=None, fsync_every=None, max_age_hours=None):
+        """
+        initialize run journal
+
+        parameters:
+            path: journal file (default RUN_JOURNAL_FILE)
+            fsync_every: lookup records written between two fsyncs (default RUN_JOURNAL_FSYNC_EVERY)
+            max_age_hours: oldest unfinished run that is resumed (default CACHE_EXPIRY_HOURS)
+        """
+        self.path = path or Config.RUN_JOURNAL_FILE
+        self.fsync_every = max(1, fsync_every or Config.RUN_JOURNAL_FSYNC_EVERY)
+        self.max_age_hours = Config.CACHE_EXPIRY_HOURS if max_age_hours is None else max_age_hours
+
+        self.started_at = None
+        self.resumed = False
+        self._stages = set()
+        # keys of the notification emails already delivered
+        self._delivered = set()
+        # ((origin, destination), (departure_date, return_date)) -> FlightData or None
+        self.lookups = {}
+
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _read(self):
+        """
+        records of the journal file, without a torn last line
+
+        return: (list of records, size in bytes of the complete records)
+        """
+        records = []
+        size = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("incomplete line")
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # the run died while writing this line
+                        break
+                    size += len(line)
+        except OSError:
+            pass
+        return records, size
+
+    def begin(self, origins, from_time, to_time):
+        """
+        resume the unfinished run of the same sweep, or start a new journal
+
+        parameters:
+            origins: origin IATA codes of the sweep
+            from_time, to_time: search window of the sweep
+        return: True when an interrupted run is resumed
+        """
+        sweep = {"origins": list(origins), "from": _as_text(from_time), "to": _as_text(to_time)}
+        records, size = self._read()
+        start = records[0] if records and records[0].get("type") == "start" else None
+
+        resumable = (
+            start is not None
+            and start["sweep"] == sweep
+            and records[-1].get("type") != "finish"
+            and time.time() - start["started_at"] < self.max_age_hours * 3600
+        )
+        if resumable:
+            self._replay(records)
+            self.started_at = start["started_at"]
+            self.resumed = True
+            # new records go after the last complete one
+            os.truncate(self.path, size)
+            self._open('a')
+            return True
+
+        self.started_at = time.time()
+        self.resumed = False
+        self._open('w')
+        self._append({"type": "start", "sweep": sweep, "started_at": self.started_at}, sync=True)
+        return False
+
+    def _replay(self, records):
+        """rebuild the progress held by the records of an interrupted run"""
+        for record in records:
+            kind = record.get("type")
+            if kind == "stage":
+                self._stages.add(record["stage"])
+            elif kind == "delivered":
+                self._delivered.add(record["message"])
+            elif kind == "lookup":
+                flight = record["flight"]
+                key = (
+                    (record["origin"], record["destination"]),
+                    (record["departure_date"], record["return_date"]),
+                )
+                self.lookups[key] = None if flight is None else FlightData.from_dict(flight)
+
+    def _open(self, mode):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, mode)
+
+    def _append(self, record, sync=False):
+        """
+        write one record; every record survives a crash of the process, lookups
+        are fsynced in batches, records guarding side effects (stages,
+        notifications) at once
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            if sync or self._unsynced >= self.fsync_every:
+                self._sync()
+
+    def _sync(self):
+        """push written records to disk (caller holds the lock)"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def stage_done(self, stage):
+        """True when the stage finished in this run or in the run being resumed"""
+        return stage in self._stages
+
+    def complete_stage(self, stage):
+        """record that a stage finished"""
+        self._stages.add(stage)
+        self._append({"type": "stage", "stage": stage}, sync=True)
+
+    def record_lookup(self, route, pair, flight):
+        """
+        record the answer of one search
+
+        parameters:
+            route: (origin, destination code)
+            pair: (departure_date, return_date)
+            flight: FlightData, or None when no flights were found
+        """
+        pair = (_as_text(pair[0]), _as_text(pair[1]))
+        with self._lock:
+            self.lookups[(route, pair)] = flight
+        self._append({
+            "type": "lookup",
+            "origin": route[0],
+            "destination": route[1],
+            "departure_date": pair[0],
+            "return_date": pair[1],
+            "flight": None if flight is None else flight.to_dict(),
+        })
+
+    def delivered(self, key):
+        """True when the notification email with this key was already delivered"""
+        return key in self._delivered
+
+    def record_delivered(self, key):
+        """
+        record that one notification email was delivered
+
+        parameters:
+            key: stable name of the email, e.g. "SYD deal Tokyo" or "SYD digest user@example.com"
+        """
+        with self._lock:
+            self._delivered.add(key)
+        self._append({"type": "delivered", "message": key}, sync=True)
+
+    def finish(self):
+        """mark the run complete, the next run starts a new journal"""
+        self._append({"type": "finish", "finished_at": time.time()}, sync=True)
+        self.close()
+
+    def close(self):
+        """sync and close the journal file"""
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._sync()
+            except OSError as e:
+                logger.warning(f"Failed to sync the run journal: {e}")
+            self._file.close()
+            self._file = None
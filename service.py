@@ -0,0 +1,261 @@
+# service.py
+"""
+service.py
+local HTTP service that keeps the search engine, cache and token warm between queries
+
+"""
+import json
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from config import Config
+from data_manager import DataManager
+from flight_search import FlightSearch
+from async_search import AsyncSearchEngine
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QueryService:
+    """answer price queries and sweeps from one long-lived FlightSearch"""
+
+    def __init__(self, flight_search=None, data_manager=None):
+        """
+        initialize query service
+
+        parameters:
+            flight_search: FlightSearch shared by every request
+            data_manager: DataManager used by sweeps
+        """
+        self.flight_search = flight_search or FlightSearch()
+        self.data_manager = data_manager or DataManager()
+
+        self.started_at = time.time()
+        self.requests = 0
+        self._lock = threading.Lock()
+        # sweeps fill in the IATA codes of the destination rows DataManager shares between them
+        self._sweep_lock = threading.Lock()
+
+    def _count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def cheapest(self, origin, destination, departure_date, return_date):
+        """
+        cheapest flight of a route for one departure/return date pair
+
+        return: dict with the flight (None when there is none) and the time taken
+        """
+        self._count_request()
+        start = time.perf_counter()
+        # identical requests arriving together share one upstream call inside FlightSearch
+        flight = self.flight_search.search_flights(origin, destination, departure_date, return_date)
+        self.flight_search.price_history.flush()
+        return {
+            "origin": origin,
+            "destination": destination,
+            "departure_date": departure_date,
+            "return_date": return_date,
+            "flight": flight.to_dict() if flight is not None else None,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    def sweep(self, refresh=False):
+        """
+        search every destination of the sheet from every origin
+
+        sweeps arriving together run one after the other, the later ones are mostly
+        answered from the cache
+
+        parameters:
+            refresh: download the destination sheet again instead of reusing it
+        """
+        self._count_request()
+        with self._sweep_lock:
+            return self._run_sweep(refresh)
+
+    def _run_sweep(self, refresh):
+        """run one sweep and summarize it"""
+        start = time.perf_counter()
+        calls_before = self.flight_search.api_calls
+        # one engine per sweep, its failed dates are only reported by this sweep
+        search_engine = AsyncSearchEngine(self.flight_search)
+
+        destinations = self.data_manager.get_destination_data(refresh=refresh)
+        iata_errors = search_engine.fill_iata_codes(destinations, self.data_manager)
+        self.flight_search.cache_manager.flush()
+        try:
+            self.data_manager.flush_updates()
+        except Exception as e:
+            # the codes are cached locally and will be written on the next sweep
+            logger.warning(f"Failed to update the sheet: {e}")
+
+        search_start = datetime.now() + timedelta(days=1)
+        search_end = datetime.now() + timedelta(days=10)
+        results_by_origin = search_engine.search_route_matrix(
+            Config.ORIGIN_CITY_IATAS, destinations, search_start, search_end
+        )
+        self.flight_search.price_history.flush()
+
+        origins = {}
+        for origin, results in results_by_origin.items():
+            origins[origin] = {
+                "found_deals": [
+                    {
+                        "destination": deal["destination"],
+                        "target_price": deal["target_price"],
+                        "flight": deal["flight"].to_dict(),
+                    }
+                    for deal in results["found_deals"]
+                ],
+                "price_not_met": results["price_not_met"],
+                "no_flights_found": results["no_flights_found"],
+                "skipped_destinations": results["skipped_destinations"],
+                "errors": [{"city": city, "error": str(error)} for city, error in results["errors"]],
+            }
+
+        return {
+            "search_start": search_start.strftime("%Y-%m-%d"),
+            "search_end": search_end.strftime("%Y-%m-%d"),
+            "destinations": len(destinations),
+            "iata_errors": [{"city": city, "error": str(error)} for city, error in iata_errors],
+            # dates that failed on routes still answered by other dates
+            "date_errors": [
+                {"route": label, "error": str(error)} for label, error in search_engine.pair_errors
+            ],
+            "origins": origins,
+            "api_calls": self.flight_search.api_calls - calls_before,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+        }
+
+    def stats(self):
+        """counters of the running service"""
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "coalesced_requests": self.flight_search.calls_saved,
+            "api_calls": self.flight_search.api_calls,
+        }
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON endpoints of the query service
+
+    routes:
+        GET  /health
+        GET  /stats
+        GET  /metrics (Prometheus text format)
+        GET  /cheapest?origin=SYD&destination=MEL&departure=YYYY-MM-DD&return=YYYY-MM-DD
+        POST /sweep (add ?refresh=true to reload the destination sheet)
+    """
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _run(self, handler, *args):
+        """call a service method and turn its outcome into a response"""
+        try:
+            self._send_json(200, handler(*args))
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            self._send_json(502, {"error": str(e)})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        service = self.server.service
+
+        if url.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif url.path == "/stats":
+            self._send_json(200, service.stats())
+        elif url.path == "/metrics":
+            payload = get_metrics().to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        elif url.path == "/cheapest":
+            missing = [key for key in ("origin", "destination", "departure", "return") if not params.get(key)]
+            if missing:
+                self._send_json(400, {"error": f"Missing parameter/s: {', '.join(missing)}"})
+                return
+            try:
+                departure = date.fromisoformat(params["departure"]).isoformat()
+                arrival = date.fromisoformat(params["return"]).isoformat()
+            except ValueError:
+                self._send_json(400, {"error": "Dates must be YYYY-MM-DD"})
+                return
+            self._run(
+                service.cheapest,
+                params["origin"].upper(), params["destination"].upper(), departure, arrival
+            )
+        else:
+            self._send_json(404, {"error": f"Unknown path: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/sweep":
+            self._run(self.server.service.sweep, params.get("refresh", "").lower() == "true")
+        else:
+            self._send_json(404, {"error": f"Unknown path: {url.path}"})
+
+    def log_message(self, format, *args):
+        """one line per request, hidden from LOG_LEVEL=WARNING on"""
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+def create_server(service, host=None, port=None):
+    """
+    build the HTTP server, port 0 picks a free port
+
+    return: ThreadingHTTPServer, call serve_forever() to start it
+    """
+    host = host or Config.SERVICE_HOST
+    port = Config.SERVICE_PORT if port is None else port
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main():
+    """start the local query service"""
+    Config.setup_logging()
+    try:
+        Config.validate()
+        Config.setup_cache_dirs()
+    except Exception as e:
+        print(f"Configuration error: {e}")
+        exit(1)
+
+    service = QueryService()
+    server = create_server(service)
+    service.flight_search.cache_manager.start_sweeper()
+    host, port = server.server_address[:2]
+    print(f"Flight price service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n Stopping the service")
+    finally:
+        server.server_close()
+        service.flight_search.cache_manager.stop_sweeper()
+        service.flight_search.wait_for_refreshes()
+
+
+if __name__ == "__main__":
+    main()
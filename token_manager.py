@@ -0,0 +1,112 @@
+# token_manager.py
+"""
+token_manager.py
+cache the Amadeus access token on disk and refresh it when needed
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class TokenManager:
+    """lazily acquire, persist and refresh an OAuth access token"""
+
+    def __init__(self, fetch_token, client_id, cache_file=None, refresh_margin=None):
+        """
+        initialize token manager
+
+        parameters:
+            fetch_token: callable returning (access_token, expires_in_seconds)
+            client_id: API key the token belongs to
+            cache_file: path of the on-disk token cache
+            refresh_margin: seconds before expiry at which the token is renewed
+        """
+        self._fetch_token = fetch_token
+        self._cache_file = cache_file or Config.TOKEN_CACHE_FILE
+        self._refresh_margin = (
+            Config.TOKEN_REFRESH_MARGIN_SECONDS if refresh_margin is None else refresh_margin
+        )
+        # only a fingerprint of the key is written to disk
+        self._client_fingerprint = hashlib.sha256((client_id or "").encode()).hexdigest()
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _is_fresh(self):
+        """check whether the in-memory token is still usable"""
+        return self._token is not None and time.time() < self._expires_at - self._refresh_margin
+
+    def _load_from_disk(self):
+        """load a previously saved token if it belongs to this client"""
+        if not os.path.exists(self._cache_file):
+            return
+
+        try:
+            with open(self._cache_file, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if cached.get("client") == self._client_fingerprint:
+            self._token = cached.get("access_token")
+            self._expires_at = float(cached.get("expires_at", 0))
+
+    def _save_to_disk(self):
+        """write the token to disk, readable by the owner only"""
+        cache_data = {
+            "client": self._client_fingerprint,
+            "access_token": self._token,
+            "expires_at": self._expires_at,
+        }
+        directory = os.path.dirname(self._cache_file) or "."
+        os.makedirs(directory, exist_ok=True)
+
+        temp_file = f"{self._cache_file}.tmp"
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache_data, f)
+        os.replace(temp_file, self._cache_file)
+
+    def _refresh(self):
+        """fetch a new token and persist it (caller holds the lock)"""
+        token, expires_in = self._fetch_token()
+        self._token = token
+        self._expires_at = time.time() + float(expires_in)
+        try:
+            self._save_to_disk()
+        except OSError as e:
+            logger.warning(f"Failed to save the access token: {e}")
+
+    def get_token(self):
+        """return a valid access token, fetching one only when needed"""
+        with self._lock:
+            if self._is_fresh():
+                return self._token
+
+            self._load_from_disk()
+            if not self._is_fresh():
+                self._refresh()
+            return self._token
+
+    def refresh(self, rejected_token):
+        """
+        replace a token the API rejected
+
+        concurrent callers that saw the same rejected token share one refresh
+
+        parameters:
+            rejected_token: the token that got a 401 response
+        """
+        with self._lock:
+            if self._token is not None and self._token != rejected_token and self._is_fresh():
+                # someone else already refreshed it
+                return self._token
+            self._refresh()
+            return self._token
@@ -0,0 +1,394 @@
+# work_queue.py
+"""
+work_queue.py
+durable queue of the searches of a sweep, shared by worker processes through SQLite
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import date, datetime
+from config import Config
+from flight_data import FlightData
+from metrics import get_metrics
+
+# statuses a task goes through: pending -> leased -> done, or back to pending
+# to be tried again, or failed once it has used up its attempts
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+STATUSES = (PENDING, LEASED, DONE, FAILED)
+
+
+def _as_text(value):
+    """YYYY-MM-DD for dates, the value itself otherwise"""
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+class WorkTask(namedtuple(
+    "WorkTask",
+    ["sweep_id", "origin", "destination", "departure_date", "return_date", "attempts"]
+)):
+    """one route and date pair of a sweep, as handed to a worker"""
+
+    __slots__ = ()
+
+
+class WorkQueue:
+    """
+    sweeps and their searches in one SQLite file
+
+    a worker leases a batch of tasks and owns them until the lease expires;
+    a task whose worker died is leased again by another worker once its lease
+    expired, a failed search is tried again later until WORK_MAX_ATTEMPTS
+    """
+
+    def __init__(self, db_file=None, lease_seconds=None, max_attempts=None, retry_delay=None):
+        """
+        initialize work queue
+
+        parameters:
+            db_file: SQLite file shared by the coordinator and the workers (default WORK_QUEUE_DB)
+            lease_seconds: time a worker owns the tasks it leased (default WORK_LEASE_SECONDS)
+            max_attempts: searches of a task before it is failed (default WORK_MAX_ATTEMPTS)
+            retry_delay: wait before a failed search is tried again, times the attempts so far
+                         (default WORK_RETRY_DELAY_SECONDS)
+        """
+        self._db_path = os.path.abspath(db_file or Config.WORK_QUEUE_DB)
+        self.lease_seconds = Config.WORK_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.max_attempts = max(1, max_attempts or Config.WORK_MAX_ATTEMPTS)
+        self.retry_delay = Config.WORK_RETRY_DELAY_SECONDS if retry_delay is None else retry_delay
+        # one SQLite connection per thread
+        self._local = threading.local()
+        self._metrics = get_metrics()
+        self._init_db()
+
+    def _connect(self):
+        """return the SQLite connection of the current thread"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self._db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # transactions are opened explicitly, leasing needs BEGIN IMMEDIATE
+            connection = sqlite3.connect(self._db_path, timeout=30, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def _transaction(self, statements):
+        """
+        run statements(connection) in a write transaction, so no other process
+        leases the same tasks in between
+
+        return: what statements returned
+        """
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def _init_db(self):
+        """create the sweep and task tables"""
+        connection = self._connect()
+        # workers on other hosts may share the file, WAL only works on one host,
+        # the rollback journal locks the whole file on any filesystem with working locks
+        connection.execute("PRAGMA journal_mode=DELETE")
+        connection.execute("PRAGMA synchronous=FULL")
+
+        def create(connection):
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sweeps (
+                    id TEXT PRIMARY KEY,
+                    sweep TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    finished_at REAL
+                )
+                """
+            )
+            # data is FlightData.to_bytes(), NULL when the search found no flights
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS tasks (
+                    sweep_id TEXT NOT NULL,
+                    origin TEXT NOT NULL,
+                    destination TEXT NOT NULL,
+                    departure_date TEXT NOT NULL,
+                    return_date TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL DEFAULT 0,
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    data BLOB,
+                    error TEXT,
+                    PRIMARY KEY (sweep_id, origin, destination, departure_date, return_date)
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (sweep_id, status)"
+            )
+            # price history records of the workers, written to the history files by the
+            # coordinator of their sweep; sweep_id is NULL for prices found outside a sweep
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS prices (
+                    origin TEXT NOT NULL,
+                    destination TEXT NOT NULL,
+                    records BLOB NOT NULL,
+                    sweep_id TEXT
+                )
+                """
+            )
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(prices)")}
+            if "sweep_id" not in columns:
+                # the first version of the table did not say which sweep the prices belong to
+                connection.execute("ALTER TABLE prices ADD COLUMN sweep_id TEXT")
+
+        self._transaction(create)
+
+    def create_sweep(self, origins, from_time, to_time, routes, date_pairs, max_age_hours=None):
+        """
+        queue the searches of a sweep, picking up an unfinished sweep of the same
+        origins and dates instead of starting over
+
+        parameters:
+            routes: list of (origin, destination code)
+            date_pairs: list of (departure_date, return_date) searched for every route
+            max_age_hours: oldest unfinished sweep that is picked up (default CACHE_EXPIRY_HOURS)
+        return: (sweep id, True when an unfinished sweep was picked up)
+        """
+        sweep = json.dumps({"origins": list(origins), "from": _as_text(from_time), "to": _as_text(to_time)})
+        max_age_hours = Config.CACHE_EXPIRY_HOURS if max_age_hours is None else max_age_hours
+        now = time.time()
+        rows = [
+            (origin, destination, _as_text(departure_date), _as_text(return_date))
+            for origin, destination in routes
+            for departure_date, return_date in date_pairs
+        ]
+
+        def create(connection):
+            found = connection.execute(
+                "SELECT id FROM sweeps WHERE sweep = ? AND finished_at IS NULL AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT 1",
+                (sweep, now - max_age_hours * 3600)
+            ).fetchone()
+            if found:
+                sweep_id = found[0]
+            else:
+                sweep_id = uuid.uuid4().hex[:12]
+                connection.execute(
+                    "INSERT INTO sweeps (id, sweep, created_at) VALUES (?, ?, ?)", (sweep_id, sweep, now)
+                )
+            # routes added to the sheet since an interrupted sweep are queued as well
+            connection.executemany(
+                "INSERT OR IGNORE INTO tasks (sweep_id, origin, destination, departure_date, return_date) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(sweep_id,) + row for row in rows]
+            )
+            return sweep_id, found is not None
+
+        return self._transaction(create)
+
+    def lease(self, worker_id, limit=1, sweep_id=None):
+        """
+        take up to limit tasks that are due, for lease_seconds
+
+        parameters:
+            worker_id: name of the worker, a lease can only be failed by its owner
+            sweep_id: only lease tasks of this sweep (default any unfinished sweep)
+        return: list of WorkTask
+        """
+        now = time.time()
+        sweep_filter = "sweep_id = ?" if sweep_id else \
+            "sweep_id IN (SELECT id FROM sweeps WHERE finished_at IS NULL)"
+        sweep_args = (sweep_id,) if sweep_id else ()
+
+        def lease(connection):
+            # a worker that stopped before its lease expired used up an attempt
+            abandoned = connection.execute(
+                f"UPDATE tasks SET status = ?, lease_owner = NULL, "
+                f"error = 'The worker searching this route stopped' "
+                f"WHERE {sweep_filter} AND status = ? AND lease_expires <= ? AND attempts >= ?",
+                (FAILED,) + sweep_args + (LEASED, now, self.max_attempts)
+            ).rowcount
+            rows = connection.execute(
+                f"SELECT rowid, sweep_id, origin, destination, departure_date, return_date, attempts, status "
+                f"FROM tasks WHERE {sweep_filter} AND "
+                f"((status = ? AND available_at <= ?) OR (status = ? AND lease_expires <= ?)) "
+                f"ORDER BY available_at, rowid LIMIT ?",
+                sweep_args + (PENDING, now, LEASED, now, limit)
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE rowid = ?",
+                [(LEASED, worker_id, now + self.lease_seconds, row[0]) for row in rows]
+            )
+            return abandoned, rows
+
+        abandoned, rows = self._transaction(lease)
+        if abandoned:
+            self._metrics.inc("work_tasks_total", abandoned, status="abandoned")
+        expired = sum(1 for row in rows if row[7] == LEASED)
+        if expired:
+            self._metrics.inc("work_lease_expired_total", expired)
+        return [WorkTask(*row[1:6], row[6] + 1) for row in rows]
+
+    def _key(self, task):
+        return (task.sweep_id, task.origin, task.destination, task.departure_date, task.return_date)
+
+    def complete(self, task, flight):
+        """
+        store the answer of a search
+
+        parameters:
+            flight: FlightData, or None when no flights were found
+        return: False when the task was already finished by another worker
+        """
+        data = None if flight is None else sqlite3.Binary(flight.to_bytes())
+        # a worker whose lease expired may still finish first, any answer is as good
+        stored = self._transaction(lambda connection: connection.execute(
+            "UPDATE tasks SET status = ?, data = ?, error = NULL, lease_owner = NULL "
+            "WHERE sweep_id = ? AND origin = ? AND destination = ? AND departure_date = ? "
+            "AND return_date = ? AND status IN (?, ?)",
+            (DONE, data) + self._key(task) + (PENDING, LEASED)
+        ).rowcount)
+        if stored:
+            self._metrics.inc("work_tasks_total", status=DONE)
+        return bool(stored)
+
+    def fail(self, task, worker_id, error):
+        """
+        record a failed search, it is tried again later until it used up its attempts
+
+        return: True when the task will be tried again
+        """
+        retry = task.attempts < self.max_attempts
+        if retry:
+            values = (PENDING, time.time() + self.retry_delay * task.attempts)
+        else:
+            values = (FAILED, 0)
+        updated = self._transaction(lambda connection: connection.execute(
+            "UPDATE tasks SET status = ?, available_at = ?, lease_owner = NULL, error = ? "
+            "WHERE sweep_id = ? AND origin = ? AND destination = ? AND departure_date = ? "
+            "AND return_date = ? AND status = ? AND lease_owner = ?",
+            values + (str(error),) + self._key(task) + (LEASED, worker_id)
+        ).rowcount)
+        if updated:
+            self._metrics.inc("work_tasks_total", status="retried" if retry else FAILED)
+        return retry and bool(updated)
+
+    def add_prices(self, records_by_route, sweep_id=None):
+        """
+        store price history records for the coordinator
+
+        parameters:
+            records_by_route: dict of (origin, destination) -> packed records, from
+                              PriceHistory.take_buffered
+            sweep_id: sweep whose searches found the prices, None when they were found
+                      outside a sweep; any coordinator writes those
+        """
+        rows = [(origin, destination, sqlite3.Binary(records), sweep_id)
+                for (origin, destination), records in records_by_route.items() if records]
+        if rows:
+            self._transaction(lambda connection: connection.executemany(
+                "INSERT INTO prices (origin, destination, records, sweep_id) VALUES (?, ?, ?, ?)", rows
+            ))
+
+    def take_prices(self, sweep_id):
+        """
+        remove and return the price history records of a sweep, and those of no sweep
+
+        return: list of ((origin, destination), packed records)
+        """
+        def take(connection):
+            condition = "WHERE sweep_id = ? OR sweep_id IS NULL"
+            rows = connection.execute(
+                f"SELECT origin, destination, records FROM prices {condition}", (sweep_id,)
+            ).fetchall()
+            connection.execute(f"DELETE FROM prices {condition}", (sweep_id,))
+            return rows
+
+        return [((origin, destination), bytes(records)) for origin, destination, records in self._transaction(take)]
+
+    def progress(self, sweep_id):
+        """
+        number of tasks of a sweep in each status
+
+        return: dict of status -> count, every status included
+        """
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self._connect().execute(
+            "SELECT status, COUNT(*) FROM tasks WHERE sweep_id = ? GROUP BY status", (sweep_id,)
+        ).fetchall())
+        return counts
+
+    def has_work(self, sweep_id=None):
+        """True while tasks are waiting or leased, of one sweep or of any unfinished sweep"""
+        if sweep_id:
+            query = "SELECT 1 FROM tasks WHERE sweep_id = ? AND status IN (?, ?) LIMIT 1"
+            args = (sweep_id, PENDING, LEASED)
+        else:
+            query = (
+                "SELECT 1 FROM tasks WHERE status IN (?, ?) AND "
+                "sweep_id IN (SELECT id FROM sweeps WHERE finished_at IS NULL) LIMIT 1"
+            )
+            args = (PENDING, LEASED)
+        return self._connect().execute(query, args).fetchone() is not None
+
+    def answers(self, sweep_id, unfinished=None):
+        """
+        answers of the tasks of a sweep
+
+        parameters:
+            unfinished: answer given to tasks still pending or leased (default they are left out)
+        return: dict of ((origin, destination code), (departure_date, return_date))
+                -> FlightData, None, or an exception for a task that failed
+        """
+        rows = self._connect().execute(
+            "SELECT origin, destination, departure_date, return_date, status, data, error "
+            "FROM tasks WHERE sweep_id = ?",
+            (sweep_id,)
+        )
+        answers = {}
+        for origin, destination, departure_date, return_date, status, data, error in rows:
+            if status == DONE:
+                answer = None if data is None else FlightData.from_bytes(bytes(data))
+            elif status == FAILED:
+                answer = Exception(error)
+            elif unfinished is not None:
+                answer = unfinished
+            else:
+                continue
+            answers[((origin, destination), (departure_date, return_date))] = answer
+        return answers
+
+    def finish_sweep(self, sweep_id, keep_hours=None):
+        """
+        mark a sweep reported, and delete the tasks of sweeps finished long ago
+
+        parameters:
+            keep_hours: tasks of sweeps finished this long ago are deleted (default CACHE_EXPIRY_HOURS)
+        """
+        now = time.time()
+        keep_hours = Config.CACHE_EXPIRY_HOURS if keep_hours is None else keep_hours
+
+        def finish(connection):
+            connection.execute("UPDATE sweeps SET finished_at = ? WHERE id = ?", (now, sweep_id))
+            old = "SELECT id FROM sweeps WHERE finished_at < ?"
+            connection.execute(f"DELETE FROM tasks WHERE sweep_id IN ({old})", (now - keep_hours * 3600,))
+            connection.execute(f"DELETE FROM sweeps WHERE id IN ({old})", (now - keep_hours * 3600,))
+
+        self._transaction(finish)
@@ -0,0 +1,180 @@
+# worker.py
+"""
+worker.py
+search the routes queued by coordinator.py, run one or more per host
+
+"""
+import argparse
+import logging
+import os
+import socket
+import time
+from config import Config
+from flight_search import FlightSearch
+from price_history import PriceHistory
+from work_queue import WorkQueue
+
+logger = logging.getLogger(__name__)
+
+# wait between two looks at the queue when nothing is due
+POLL_SECONDS = 1.0
+
+
+class SweepWorker:
+    """lease queued searches in batches, run them concurrently and store the answers"""
+
+    def __init__(self, flight_search, work_queue=None, worker_id=None, concurrency=None):
+        """
+        initialize sweep worker
+
+        parameters:
+            flight_search: FlightSearch used for every search
+            work_queue: WorkQueue the tasks come from (default one on WORK_QUEUE_DB)
+            worker_id: name of the worker in the queue (default host:pid)
+            concurrency: searches run at the same time, also the size of a leased batch
+        """
+        self.flight_search = flight_search
+        self.work_queue = work_queue or WorkQueue()
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.concurrency = max(1, concurrency or Config.SEARCH_CONCURRENCY)
+        self.searched = 0
+        self.failed = 0
+
+    def _search(self, task):
+        """search one task, the shared cache answers it when another run already did"""
+        return self.flight_search.search_flights(
+            task.origin, task.destination, task.departure_date, task.return_date
+        )
+
+    def run_batch(self, executor, sweep_id=None):
+        """
+        lease one batch of tasks and search it
+
+        return: number of tasks leased
+        """
+        tasks = self.work_queue.lease(self.worker_id, self.concurrency, sweep_id)
+        futures = [(task, executor.submit(self._search, task)) for task in tasks]
+        outcomes = []
+        for task, future in futures:
+            try:
+                outcomes.append((task, future.result()))
+            except Exception as e:
+                outcomes.append((task, e))
+
+        # prices are stored before the answers, the coordinator takes them once every task is done
+        self.hand_off_prices(sweep_id, tasks)
+        for task, outcome in outcomes:
+            label = f"{task.origin} → {task.destination} {task.departure_date}/{task.return_date}"
+            if isinstance(outcome, Exception):
+                self.failed += 1
+                retry = self.work_queue.fail(task, self.worker_id, outcome)
+                logger.warning(f"  {label}: {outcome}" + (" (will be tried again)" if retry else ""))
+                continue
+            self.searched += 1
+            self.work_queue.complete(task, outcome)
+            logger.debug(f"  {label}: {'no flights' if outcome is None else outcome.price}")
+        return len(tasks)
+
+    def hand_off_prices(self, sweep_id=None, tasks=()):
+        """
+        move the prices found so far into the queue, only the coordinator writes the history files
+
+        parameters:
+            sweep_id: sweep the worker works on, None for any unfinished sweep
+            tasks: tasks searched since the last hand-off, their routes go to the coordinator of their sweep
+        """
+        sweep_by_route = {(task.origin, task.destination): task.sweep_id for task in tasks}
+        by_sweep = {}
+        for route, records in self.flight_search.price_history.take_buffered().items():
+            by_sweep.setdefault(sweep_by_route.get(route, sweep_id), {})[route] = records
+        for sweep, records_by_route in by_sweep.items():
+            self.work_queue.add_prices(records_by_route, sweep)
+
+    def run(self, sweep_id=None, wait=False):
+        """
+        search queued tasks until the queue is empty
+
+        parameters:
+            sweep_id: only work on this sweep (default every unfinished sweep)
+            wait: keep waiting for new sweeps instead of stopping when the queue is empty
+        return: number of tasks searched
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sweep-worker") as executor:
+            while True:
+                if self.run_batch(executor, sweep_id):
+                    continue
+                # tasks leased by other workers come back here if their worker dies
+                if not wait and not self.work_queue.has_work(sweep_id):
+                    break
+                time.sleep(POLL_SECONDS)
+        return self.searched
+
+
+def run_worker(sweep_id=None, wait=False, processes=1):
+    """
+    entry point of one worker process
+
+    parameters:
+        processes: worker processes on this host, they share its API rate limit
+    """
+    Config.setup_logging()
+    if processes > 1 and Config.AMADEUS_REQUESTS_PER_SECOND > 0:
+        # every process paces its own requests, together they keep to the configured rate
+        Config.AMADEUS_REQUESTS_PER_SECOND /= processes
+
+    flight_search = FlightSearch()
+    # appends of several processes would interleave in the history files,
+    # the prices go through the queue to the coordinator instead
+    flight_search.price_history = PriceHistory(write_to_disk=False)
+    worker = SweepWorker(flight_search)
+    try:
+        worker.run(sweep_id, wait)
+    finally:
+        flight_search.wait_for_refreshes()
+        flight_search.cache_manager.flush()
+        worker.hand_off_prices(sweep_id)
+    print(f"Worker {worker.worker_id}: {worker.searched} search/es done, {worker.failed} failed, "
+          f"{flight_search.api_calls} API call/s")
+
+
+def start_workers(count, sweep_id=None, wait=False):
+    """
+    start worker processes on this host
+
+    return: list of started multiprocessing.Process
+    """
+    import multiprocessing
+
+    # a fresh interpreter per worker, nothing of the parent's connections is shared
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_worker, args=(sweep_id, wait, count), name=f"sweep-worker-{index}"
+        )
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def main(argv=None):
+    """search queued routes until the queue is empty, or forever with --wait"""
+    parser = argparse.ArgumentParser(description="Search the routes queued by coordinator.py")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes to start on this host")
+    parser.add_argument("--sweep", default=None, help="only work on this sweep id")
+    parser.add_argument("--wait", action="store_true", help="keep waiting for new sweeps")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        run_worker(args.sweep, args.wait)
+        return
+
+    for process in start_workers(args.processes, args.sweep, args.wait):
+        process.join()
+
+
+if __name__ == "__main__":
+    main()